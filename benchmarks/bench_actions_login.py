@@ -0,0 +1,54 @@
+"""
+Measure IdP logins per second for users without pending actions.
+
+Every login asks ActionDB.has_pending_actions(), and almost always the answer is no. Compares
+the previous cold path (find all actions sorted by preference, and count them), the existence
+probe (find_one for a single _id) and the negative cache, where logins by users found to
+have no actions within the last `negative_ttl' seconds don't reach the database.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from bson import ObjectId
+
+from common import timed, server_ops, report, temporary_db_uri
+
+from eduid_userdb.actions import ActionDB
+
+
+def legacy_has_pending_actions(actionsdb, userid, session=None):
+    # The cold path of ActionDB.has_pending_actions before the existence probe
+    actions = actionsdb._coll.find(actionsdb._pending_query(userid, session)).sort('preference')
+    return actions.count() > 0
+
+
+def main(num_users=1000, iterations=10000):
+    db_uri, conn = temporary_db_uri()
+    actionsdb = ActionDB(db_uri, 'eduid_bench', 'bench_actions_login', negative_ttl=0)
+    actionsdb._drop_whole_collection()
+    actionsdb.reconcile_indexes()
+    # a few users with actions, so the collection isn't empty
+    for _ in xrange(num_users // 10):
+        actionsdb.add_action(ObjectId(), action_type='tou', params={'version': 'bench-v1'})
+
+    userids = [str(ObjectId()) for _ in xrange(num_users)]
+
+    def _run(name, func):
+        it = iter(userids * (iterations // num_users + 1))
+        before = server_ops(conn)
+        seconds = timed(lambda: func(next(it)), iterations)
+        round_trips = (server_ops(conn) - before - 1) / float(iterations)
+        report(name, iterations, seconds, round_trips_per_op='{:.2f}'.format(round_trips))
+
+    _run('legacy find+count', lambda userid: legacy_has_pending_actions(actionsdb, userid))
+    _run('existence probe', lambda userid: actionsdb.has_pending_actions(userid))
+    cached = ActionDB(db_uri, 'eduid_bench', 'bench_actions_login', negative_ttl=60)
+    _run('negative cache', lambda userid: cached.has_pending_actions(userid))
+
+    actionsdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
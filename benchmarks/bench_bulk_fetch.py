@@ -0,0 +1,68 @@
+"""
+Measure the throughput of fetching many users at once.
+
+Compares looping over UserDB.get_user_by_id() with the bulk UserDB.get_users_by_ids() and
+UserDB.get_users_by_eppns() using a few different chunk sizes. Run with the number of users
+to load into the database as argument, e.g. 10000 and 100000.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from common import server_ops, report, make_user_doc, temporary_db_uri
+
+from eduid_userdb import UserDB
+
+
+def main(num_users=10000, single_users=2000):
+    db_uri, conn = temporary_db_uri()
+    userdb = UserDB(db_uri, 'eduid_bench', 'bench_bulk_fetch')
+    userdb._drop_whole_collection()
+    userdb.setup_indexes({'eppn-index-v1': {'key': [('eduPersonPrincipalName', 1)], 'unique': True}})
+    docs = []
+    for num in xrange(num_users):
+        docs.append(make_user_doc(num))
+        if len(docs) == 1000:
+            userdb._coll.insert(docs)
+            docs = []
+    if docs:
+        userdb._coll.insert(docs)
+
+    user_ids = [doc['_id'] for doc in userdb._coll.find({}, {'_id': True})]
+    eppns = ['bench-{:07d}'.format(num) for num in xrange(num_users)]
+
+    def _run(name, func, count):
+        before = server_ops(conn)
+        start = time.time()
+        found, missing = func()
+        seconds = time.time() - start
+        round_trips = server_ops(conn) - before - 1
+        report(name, count, seconds, found=found, missing=missing, round_trips=round_trips)
+
+    def _single():
+        found = 0
+        for user_id in user_ids[:single_users]:
+            if userdb.get_user_by_id(user_id, raise_on_missing=False) is not None:
+                found += 1
+        return found, single_users - found
+
+    def _bulk(method, values, chunk_size):
+        users, missing = method(values, chunk_size=chunk_size)
+        found = sum(1 for _ in users)
+        return found, len(missing)
+
+    _run('get_user_by_id loop', _single, single_users)
+    for chunk_size in [100, 1000, 5000]:
+        _run('get_users_by_ids chunk_size={:d}'.format(chunk_size),
+             lambda: _bulk(userdb.get_users_by_ids, user_ids, chunk_size), num_users)
+    for chunk_size in [100, 1000, 5000]:
+        _run('get_users_by_eppns chunk_size={:d}'.format(chunk_size),
+             lambda: _bulk(userdb.get_users_by_eppns, eppns, chunk_size), num_users)
+
+    userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,80 @@
+"""
+Measure how element list operations scale with the number of elements.
+
+For list sizes from 1 to 10000 elements, time building a ToUList (which adds the events one
+by one) and a MailAddressList, and the find, primary and add/remove operations on the list.
+A find done by scanning all elements, like ElementList.find used to, is included for reference.
+"""
+
+from __future__ import print_function
+
+import datetime
+import sys
+
+from bson import ObjectId
+
+from common import report, timed
+
+from eduid_userdb.mail import MailAddressList, address_from_dict
+from eduid_userdb.tou import ToUList
+
+
+def tou_dicts(count):
+    now = datetime.datetime(2015, 9, 24, 1, 1, 1, 111000)
+    return [{'id': ObjectId(),
+             'version': '2016-v{:d}'.format(idx),
+             'created_by': 'dashboard',
+             'created_ts': now,
+             } for idx in xrange(count)]
+
+
+def mail_dicts(count):
+    return [{'email': 'user.{:d}@example.org'.format(idx),
+             'verified': True,
+             'primary': idx == 0,
+             } for idx in xrange(count)]
+
+
+def scan_find(element_list, key):
+    # ElementList.find before elements were indexed by key
+    res = [x for x in element_list.to_list() if x.key == key]
+    if len(res) == 1:
+        return res[0]
+    return False
+
+
+def main(max_size=10000, operations=20000):
+    size = 1
+    while size <= max_size:
+        # keep the total amount of work for each size roughly constant
+        builds = max(1, operations // size)
+        tous = tou_dicts(size)
+        mails = mail_dicts(size)
+        seconds = timed(lambda: ToUList(tous), builds)
+        report('ToUList({:d}) build'.format(size), builds, seconds)
+        seconds = timed(lambda: MailAddressList(mails), builds)
+        report('MailAddressList({:d}) build'.format(size), builds, seconds)
+
+        addresses = MailAddressList(mails)
+        last = mails[-1]['email']
+        seconds = timed(lambda: addresses.find(last), operations)
+        report('MailAddressList({:d}) find'.format(size), operations, seconds)
+        scans = max(1, operations // size)
+        seconds = timed(lambda: scan_find(addresses, last), scans)
+        report('MailAddressList({:d}) find by scan'.format(size), scans, seconds)
+        seconds = timed(lambda: addresses.primary, operations)
+        report('MailAddressList({:d}) primary'.format(size), operations, seconds)
+
+        extra = address_from_dict({'email': 'extra@example.org', 'verified': True, 'primary': False})
+
+        def add_remove():
+            addresses.add(extra)
+            addresses.remove(extra.key)
+
+        seconds = timed(add_remove, operations)
+        report('MailAddressList({:d}) add+remove'.format(size), operations, seconds)
+        size *= 10
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,51 @@
+"""
+Measure the overhead of instrumenting database objects.
+
+Users are looked up through a UserCache, so that the database round trip (which would dwarf
+the overhead) is avoided for all but the first lookup. The lookups are made without
+instrumentation, with a MemorySink and with a MemorySink measuring the size of the users.
+The instrumentation is then removed again, to show that the uninstrumented cost is unchanged.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from common import timed, report, make_user_doc, temporary_db_uri
+
+from eduid_userdb import UserDB
+from eduid_userdb.cache import UserCache
+from eduid_userdb.instrumentation import MemorySink
+
+
+def main(num_users=100, iterations=20000):
+    db_uri, _conn = temporary_db_uri()
+    userdb = UserDB(db_uri, 'eduid_bench', 'bench_instrumentation', cache=UserCache(max_size=num_users, ttl=3600))
+    userdb._drop_whole_collection()
+    user_ids = []
+    for num in xrange(num_users):
+        doc = make_user_doc(num)
+        userdb._coll.insert(doc)
+        user_ids.append(doc['_id'])
+
+    def _lookup():
+        userdb.get_user_by_id(user_ids[_lookup.count % num_users])
+        _lookup.count += 1
+    _lookup.count = 0
+    timed(_lookup, num_users)  # warm the cache
+
+    sink = MemorySink()
+    for name, setup in [('disabled', userdb.uninstrument),
+                        ('MemorySink', lambda: userdb.instrument(sink)),
+                        ('MemorySink measure_bytes', lambda: userdb.instrument(sink, measure_bytes=True)),
+                        ('disabled again', userdb.uninstrument),
+                        ]:
+        setup()
+        seconds = timed(_lookup, iterations)
+        report('get_user_by_id {!s}'.format(name), iterations, seconds)
+
+    userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
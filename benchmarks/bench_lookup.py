@@ -0,0 +1,60 @@
+"""
+Measure database round trips and latency of single user lookups.
+
+Compares the uniqueness checked point lookup in BaseDB (one find() with limit(2)) to the
+previous implementation, which counted the matching documents on the server (twice) before
+fetching the first one.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from common import timed, server_ops, report, make_user_doc, temporary_db_uri
+
+from eduid_userdb import UserDB
+from eduid_userdb.exceptions import DocumentDoesNotExist, MultipleDocumentsReturned
+
+
+
+def legacy_get_document_by_attr(userdb, attr, value):
+    # The implementation of BaseDB._get_document_by_attr before the single round trip lookup
+    docs = userdb._coll.find({attr: value})
+    if docs.count() == 0:
+        raise DocumentDoesNotExist("No document matching %s='%s'" % (attr, value))
+    elif docs.count() > 1:
+        raise MultipleDocumentsReturned("Multiple matching documents for %s='%s'" % (attr, value))
+    return docs[0]
+
+
+def main(num_users=1000, iterations=5000):
+    db_uri, conn = temporary_db_uri()
+    userdb = UserDB(db_uri, 'eduid_bench', 'bench_lookup')
+    userdb._drop_whole_collection()
+    userdb.setup_indexes({'eppn-index-v1': {'key': [('eduPersonPrincipalName', 1)], 'unique': True}})
+    for num in xrange(num_users):
+        userdb._coll.insert(make_user_doc(num))
+
+    eppns = ['bench-{:07d}'.format(num % num_users) for num in xrange(iterations)]
+
+    def _run(name, func):
+        it = iter(eppns)
+        before = server_ops(conn)
+        seconds = timed(lambda: func(next(it)), iterations)
+        round_trips = (server_ops(conn) - before - 1) / float(iterations)
+        report(name, iterations, seconds, round_trips_per_op='{:.2f}'.format(round_trips))
+
+    _run('legacy _get_document_by_attr',
+         lambda eppn: legacy_get_document_by_attr(userdb, 'eduPersonPrincipalName', eppn))
+    _run('_get_document_by_attr',
+         lambda eppn: userdb._get_document_by_attr('eduPersonPrincipalName', eppn))
+    _run('get_user_by_eppn',
+         lambda eppn: userdb.get_user_by_eppn(eppn))
+    _run('get_user_by_mail',
+         lambda eppn: userdb.get_user_by_mail('user{:d}.0@example.org'.format(int(eppn[6:]))))
+
+    userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,114 @@
+"""
+Measure the parse and serialize hot paths of the user models, without a database.
+
+Covers creating users from documents, User.to_dict() in both the new and the old userdb
+format, the DashboardUser, SignupUser, ChpassUser and SupportUser models, PrimaryElementList
+add/remove/primary operations and ToUList.has_accepted. The documents are the ones in
+eduid_userdb.data_samples, and synthetic ones with 1, 10 and 100 of each list element.
+
+Run with BENCH_JSON set (or through run_all.py) to get results that can be compared
+between commits with compare.py.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from common import timed, report, make_user_doc
+
+from eduid_userdb import User
+from eduid_userdb.dashboard import DashboardUser
+from eduid_userdb.signup import SignupUser
+from eduid_userdb.actions.chpass import ChpassUser
+from eduid_userdb.support.models import SupportUser
+from eduid_userdb.mail import MailAddressList, address_from_dict
+from eduid_userdb.phone import PhoneNumberList, phone_from_dict
+from eduid_userdb.tou import ToUList
+from eduid_userdb.data_samples import NEW_USER_EXAMPLE, OLD_USER_EXAMPLE, NEW_SIGNUP_USER_EXAMPLE
+from eduid_userdb.data_samples import NEW_DASHBOARD_USER_EXAMPLE
+
+SCALES = [1, 10, 100]
+
+
+def scaled_doc(size):
+    return make_user_doc(0, mails=size, phones=size, nins=size, tous=size)
+
+
+def bench_users(iterations):
+    samples = [('new', NEW_USER_EXAMPLE, iterations), ('old', OLD_USER_EXAMPLE, iterations)]
+    # fewer iterations for the larger documents, to keep the run time reasonable
+    samples += [('x{:d}'.format(size), scaled_doc(size), max(10, iterations // size)) for size in SCALES]
+    for sample_name, sample, count in samples:
+        seconds = timed(lambda: User(data=sample), count)
+        report('User/{!s} init'.format(sample_name), count, seconds)
+        user = User(data=sample)
+        seconds = timed(lambda: user.to_dict(), count)
+        report('User/{!s} to_dict'.format(sample_name), count, seconds)
+        seconds = timed(lambda: user.to_dict(old_userdb_format=True), count)
+        report('User/{!s} to_dict old format'.format(sample_name), count, seconds)
+        seconds = timed(lambda: SupportUser(sample), count)
+        report('SupportUser/{!s} init'.format(sample_name), count, seconds)
+
+
+def bench_subclasses(iterations):
+    chpass_sample = {'_id': NEW_USER_EXAMPLE['_id'], 'passwords': NEW_USER_EXAMPLE['passwords']}
+    subclasses = [('DashboardUser', DashboardUser, NEW_DASHBOARD_USER_EXAMPLE),
+                  ('SignupUser', SignupUser, NEW_SIGNUP_USER_EXAMPLE),
+                  ('ChpassUser', ChpassUser, chpass_sample),
+                  ]
+    for name, cls, sample in subclasses:
+        seconds = timed(lambda: cls(data=sample), iterations)
+        report('{!s} init'.format(name), iterations, seconds)
+        user = cls(data=sample)
+        seconds = timed(lambda: user.to_dict(), iterations)
+        report('{!s} to_dict'.format(name), iterations, seconds)
+
+
+def bench_primary_lists(iterations):
+    for size in SCALES:
+        doc = scaled_doc(size)
+        for name, list_cls, from_dict, items, key in [
+                ('MailAddressList', MailAddressList, address_from_dict, doc['mailAliases'], 'email'),
+                ('PhoneNumberList', PhoneNumberList, phone_from_dict, doc['phone'], 'number')]:
+            elements = list_cls(items)
+            extra = from_dict({key: 'extra', 'verified': True, 'primary': False})
+            last = items[-1][key]
+
+            def add_remove():
+                elements.add(extra)
+                elements.remove(extra.key)
+
+            seconds = timed(add_remove, iterations)
+            report('{!s}({:d}) add+remove'.format(name, size), iterations, seconds)
+            seconds = timed(lambda: elements.primary, iterations)
+            report('{!s}({:d}) primary'.format(name, size), iterations, seconds)
+
+            first = items[0][key]
+
+            def set_primary():
+                elements.primary = last
+                elements.primary = first
+
+            seconds = timed(set_primary, iterations)
+            report('{!s}({:d}) set primary'.format(name, size), iterations * 2, seconds)
+
+
+def bench_tou(iterations):
+    for size in SCALES:
+        tous = ToUList(scaled_doc(size)['tou'])
+        last = '2016-v{:d}'.format(size - 1)
+        seconds = timed(lambda: tous.has_accepted(last), iterations)
+        report('ToUList({:d}) has_accepted hit'.format(size), iterations, seconds)
+        seconds = timed(lambda: tous.has_accepted('2099-v1'), iterations)
+        report('ToUList({:d}) has_accepted miss'.format(size), iterations, seconds)
+
+
+def main(iterations=2000, list_operations=20000):
+    bench_users(iterations)
+    bench_subclasses(iterations)
+    bench_primary_lists(list_operations)
+    bench_tou(list_operations)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
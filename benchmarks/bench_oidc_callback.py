@@ -0,0 +1,76 @@
+"""
+Measure the database work of the OIDC proofing callback.
+
+The callback looks up the proofing state by the OIDC state parameter, and removes it when the
+proofing is done. Compares the lookup as it was first implemented (two counts and a fetch,
+on an unindexed field), the uniqueness checked lookup in BaseDB (one find() with limit(2))
+and the point lookup on the unique state index (one find_one()). The whole callback
+(lookup and removal) is measured too.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from common import timed, server_ops, report, temporary_db_uri
+
+from eduid_userdb.nin import Nin
+from eduid_userdb.proofing import OidcProofingStateDB
+from eduid_userdb.proofing.proofing_state import OidcProofingState
+
+
+def legacy_get_state_by_oidc_state(statedb, oidc_state):
+    # The implementation of _get_document_by_attr used by get_state_by_oidc_state at first
+    docs = statedb._coll.find({'state': oidc_state})
+    if docs.count() == 0 or docs.count() > 1:
+        return None
+    return OidcProofingState(docs[0])
+
+
+def make_state(num):
+    nin = Nin(number='19{:08d}00'.format(num), application='eduid_oidc_proofing', verified=False, primary=False)
+    return OidcProofingState({'eduPersonPrincipalName': 'bench-{:07d}'.format(num),
+                              'nin': nin.to_dict(),
+                              'state': 'state-{:07d}'.format(num),
+                              'nonce': 'nonce-{:07d}'.format(num),
+                              'token': 'token-{:07d}'.format(num),
+                              })
+
+
+def main(num_states=10000, iterations=5000):
+    db_uri, conn = temporary_db_uri()
+    statedb = OidcProofingStateDB(db_uri, 'eduid_bench_oidc_proofing')
+    statedb._drop_whole_collection()
+    docs = [make_state(num).to_dict() for num in xrange(num_states)]
+    for start in xrange(0, num_states, 1000):
+        statedb._coll.insert(docs[start:start + 1000])
+
+    oidc_states = ['state-{:07d}'.format(num % num_states) for num in xrange(iterations)]
+
+    def _run(name, func):
+        it = iter(oidc_states)
+        before = server_ops(conn)
+        seconds = timed(lambda: func(next(it)), iterations)
+        round_trips = (server_ops(conn) - before - 1) / float(iterations)
+        report(name, iterations, seconds, round_trips_per_op='{:.2f}'.format(round_trips))
+
+    _run('legacy lookup, no index', lambda state: legacy_get_state_by_oidc_state(statedb, state))
+    statedb.reconcile_indexes()
+    _run('legacy lookup', lambda state: legacy_get_state_by_oidc_state(statedb, state))
+    _run('_get_document_by_attr',
+         lambda state: OidcProofingState(statedb._get_document_by_attr('state', state)))
+    _run('get_state_by_oidc_state', lambda state: statedb.get_state_by_oidc_state(state))
+
+    def _callback(oidc_state):
+        state = statedb.get_state_by_oidc_state(oidc_state)
+        statedb.remove_state(state)
+        # put it back for the next round
+        statedb._coll.insert(state.to_dict())
+
+    _run('callback (lookup, remove, re-insert)', _callback)
+
+    statedb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,64 @@
+"""
+Measure how much UserDB.save() writes with and without partial updates.
+
+A full save replaces the whole user document, so the write (and the oplog entry replicated
+to the secondaries) is as large as the document. With save(partial=True) only the changed
+fields are sent in a $set. The reported bytes/op is the BSON size of the update sent to the
+database, which approximates the size of the oplog entry.
+"""
+
+from __future__ import print_function
+
+import datetime
+import logging
+import sys
+import time
+
+import bson
+
+from common import report, make_user_doc, temporary_db_uri
+
+from eduid_userdb import UserDB
+
+
+def main(num_users=500, iterations=5000):
+    # avoid logging.warning() from _drop_whole_collection() adding a handler writing to stderr
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    db_uri, _conn = temporary_db_uri()
+    userdb = UserDB(db_uri, 'eduid_bench', 'bench_partial_save')
+    userdb._drop_whole_collection()
+
+    for partial in [False, True]:
+        userdb._drop_whole_collection()
+        userdb.track_changes = partial
+        for num in xrange(num_users):
+            doc = make_user_doc(num, mails=3, phones=2, nins=1, tous=10)
+            doc['modified_ts'] = datetime.datetime.utcnow()  # make save() update rather than insert
+            userdb._coll.insert(doc)
+        users = [userdb.get_user_by_eppn('bench-{:07d}'.format(num)) for num in xrange(num_users)]
+
+        written = [0]
+        orig_update = userdb._coll.update
+
+        def _counting_update(spec, document, *args, **kwargs):
+            written[0] += len(bson.BSON.encode(document))
+            return orig_update(spec, document, *args, **kwargs)
+        userdb._coll.update = _counting_update
+
+        start = time.time()
+        for count in xrange(iterations):
+            user = users[count % num_users]
+            user.given_name = 'Bench {:d}'.format(count)
+            userdb.save(user, partial=partial)
+        seconds = time.time() - start
+        del userdb._coll.update
+
+        report('save(partial={!r})'.format(partial), iterations, seconds,
+               bytes_per_op=written[0] // iterations)
+
+    userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,62 @@
+"""
+Measure UserDB.save() throughput with logging at INFO versus DEBUG level.
+
+Before the debug output was made lazy, every save() pretty-printed the whole user document
+regardless of log level, so the DEBUG numbers approximate the cost all saves used to have.
+The audit log of changed fields is measured too.
+"""
+
+from __future__ import print_function
+
+import datetime
+import logging
+import sys
+
+from common import timed, report, make_user_doc, temporary_db_uri
+
+from eduid_userdb import UserDB
+
+
+class DiscardHandler(logging.Handler):
+    """
+    Format log records like a real handler would, but don't write them anywhere.
+    """
+
+    def emit(self, record):
+        self.format(record)
+
+
+def main(num_users=500, iterations=5000):
+    # a handler on the root logger also stops logging.warning() from adding one writing to stderr
+    root = logging.getLogger()
+    root.addHandler(DiscardHandler())
+
+    db_uri, _conn = temporary_db_uri()
+    userdb = UserDB(db_uri, 'eduid_bench', 'bench_save_logging')
+    userdb._drop_whole_collection()
+    for num in xrange(num_users):
+        doc = make_user_doc(num, mails=2, phones=2, tous=5)
+        doc['modified_ts'] = datetime.datetime.utcnow()  # make save() update rather than insert
+        userdb._coll.insert(doc)
+    users = [userdb.get_user_by_eppn('bench-{:07d}'.format(num)) for num in xrange(num_users)]
+
+    def _save():
+        user = users[_save.count % num_users]
+        _save.count += 1
+        user.given_name = 'Bench {:d}'.format(_save.count)
+        userdb.save(user)
+    _save.count = 0
+
+    for level, audit in [(logging.INFO, False), (logging.DEBUG, False), (logging.INFO, True)]:
+        root.setLevel(level)
+        userdb.audit_changes = audit
+        seconds = timed(_save, iterations)
+        name = 'save() at {!s}{!s}'.format(logging.getLevelName(level), ' with audit' if audit else '')
+        report(name, iterations, seconds)
+
+    root.setLevel(logging.WARNING)
+    userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,71 @@
+"""
+Measure the latency of a combined support lookup, made sequentially and with fan_out().
+
+A support page searches for a user (four lookups) and then fetches the users authn info,
+verifications, actions, letter proofing state and proofing log, which SupportUserDetails does
+with fan_out(). Each database call is delayed by an artificial round trip latency (in
+milliseconds, default 5), to simulate a database that is not on localhost.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+from functools import partial
+
+from common import report, make_user_doc, temporary_db_uri, SlowCollection
+
+from eduid_userdb.support.db import SupportUserDB, SupportUserDetails
+
+
+def main(latency_ms=5, iterations=50, num_users=100):
+    db_uri, _conn = temporary_db_uri()
+    userdb = SupportUserDB(db_uri, collection='bench_support_lookup')
+    userdb._drop_whole_collection()
+    for num in xrange(num_users):
+        userdb._coll.insert(make_user_doc(num))
+
+    details = SupportUserDetails(db_uri)
+    dbs = [userdb, details.authn_info_db, details.verifications_db, details.actions_db,
+           details.letter_proofing_db, details.proofing_log_db]
+    for this in dbs:
+        this._coll = SlowCollection(this._coll, latency_ms / 1000.0)
+
+    def _details(user):
+        return [partial(details.authn_info_db.get_authn_info, user['user_id']),
+                partial(details.verifications_db.get_verifications, user['user_id']),
+                partial(details.actions_db.get_actions, user['user_id']),
+                partial(details.letter_proofing_db.get_proofing_state, user['eduPersonPrincipalName']),
+                partial(details.proofing_log_db.get_entries, user['eduPersonPrincipalName']),
+                ]
+
+    def _sequential(query):
+        # what search_users() and the support page did before fan_out()
+        results = [userdb.get_user_by_eppn(query, raise_on_missing=False),
+                   userdb.get_user_by_nin(query, raise_on_missing=False)]
+        results.extend(userdb.get_user_by_mail(query, raise_on_missing=False, return_list=True))
+        results.extend(userdb.get_user_by_phone(query, raise_on_missing=False, return_list=True))
+        for user in [this for this in results if this]:
+            for func in _details(user):
+                func()
+
+    def _concurrent(query):
+        for user in userdb.search_users(query):
+            res = details.get_details(user, timeout=10)
+            for this in res.values():
+                this.get()
+
+    queries = ['bench-{:07d}'.format(num % num_users) for num in xrange(iterations)]
+    for name, func in [('sequential', _sequential), ('fan_out', _concurrent)]:
+        start = time.time()
+        for query in queries:
+            func(query)
+        seconds = time.time() - start
+        report('support lookup {!s}'.format(name), iterations, seconds, latency_ms=latency_ms)
+
+    userdb._coll = userdb._coll._coll
+    userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
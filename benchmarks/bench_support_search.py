@@ -0,0 +1,68 @@
+"""
+Measure SupportUserDB.search_users() against the four separate lookups it used to make.
+
+The searches are made for eppns, nins, e-mail addresses and phone numbers of existing users,
+and for unknown values. Each database call is delayed by an artificial round trip latency
+(in milliseconds, default 2) to simulate a database that is not on localhost. The indexes
+declared for the class are created first.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+from common import server_ops, report, make_user_doc, temporary_db_uri, SlowCollection
+
+from eduid_userdb.support.db import SupportUserDB
+
+
+def main(num_users=10000, iterations=500, latency_ms=2):
+    db_uri, conn = temporary_db_uri()
+    userdb = SupportUserDB(db_uri, collection='bench_support_search')
+    userdb._drop_whole_collection()
+    userdb.reconcile_indexes()
+    docs = []
+    for num in xrange(num_users):
+        docs.append(make_user_doc(num))
+        if len(docs) == 1000:
+            userdb._coll.insert(docs)
+            docs = []
+    if docs:
+        userdb._coll.insert(docs)
+    userdb._coll = SlowCollection(userdb._coll, latency_ms / 1000.0)
+
+    queries = []
+    for num in xrange(iterations):
+        doc = make_user_doc(num % num_users)
+        queries.append([doc['eduPersonPrincipalName'],
+                        doc['nins'][0]['number'],
+                        doc['mailAliases'][0]['email'],
+                        doc['phone'][0]['number'],
+                        'unknown-{:d}'.format(num),
+                        ][num % 5])
+
+    def _separate(query):
+        # what search_users() did before it used a single query
+        results = [userdb.get_user_by_eppn(query, raise_on_missing=False),
+                   userdb.get_user_by_nin(query, raise_on_missing=False)]
+        results.extend(userdb.get_user_by_mail(query, raise_on_missing=False, return_list=True))
+        results.extend(userdb.get_user_by_phone(query, raise_on_missing=False, return_list=True))
+        return [user for user in results if user]
+
+    for name, func in [('four lookups', _separate), ('search_users', userdb.search_users)]:
+        before = server_ops(conn)
+        found = 0
+        start = time.time()
+        for query in queries:
+            found += len(func(query))
+        seconds = time.time() - start
+        round_trips = server_ops(conn) - before - 1
+        report(name, iterations, seconds, found=found, round_trips=round_trips, latency_ms=latency_ms)
+
+    userdb._coll = userdb._coll._coll
+    userdb._drop_whole_collection()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,95 @@
+"""
+Measure the cost of creating User objects from database documents.
+
+Compares the default construction (copy the callers data) with handing over ownership
+of a freshly fetched document (copy_data=False, as done by UserDB), and with the copying
+done before the copy-on-write construction (two deep copies per user).
+
+Memory is reported as the number of objects allocated per user and still alive afterwards.
+When tracemalloc is available, the peak number of bytes allocated per user while
+constructing them is reported too.
+"""
+
+from __future__ import print_function
+
+import copy
+import gc
+import sys
+import time
+
+from common import report
+
+from eduid_userdb import User
+from eduid_userdb.dashboard import DashboardUser
+from eduid_userdb.signup import SignupUser
+from eduid_userdb.actions.chpass import ChpassUser
+from eduid_userdb.actions.tou import ToUUser
+from eduid_userdb.proofing import ProofingUser
+from eduid_userdb.data_samples import NEW_USER_EXAMPLE, OLD_USER_EXAMPLE, NEW_SIGNUP_USER_EXAMPLE
+from eduid_userdb.data_samples import NEW_DASHBOARD_USER_EXAMPLE
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def legacy_user(data):
+    # Creating a User used to copy the data one extra time (to an attribute that was never used)
+    extra = copy.deepcopy(data)
+    return User(data=data), extra
+
+
+def measure(name, factory, sample, iterations):
+    # prepare one fresh document per user, like the ones returned from pymongo
+    docs = [copy.deepcopy(sample) for _ in xrange(iterations)]
+    gc.collect()
+    gc.disable()
+    if tracemalloc:
+        tracemalloc.start()
+    objects_before = len(gc.get_objects())
+    start = time.time()
+    users = [factory(doc) for doc in docs]
+    seconds = time.time() - start
+    objects_per_user = (len(gc.get_objects()) - objects_before - 1) / float(iterations)
+    extra = {'objects_per_user': '{:.1f}'.format(objects_per_user)}
+    if tracemalloc:
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        extra['peak_bytes_per_user'] = '{:d}'.format(peak // iterations)
+    gc.enable()
+    report(name, iterations, seconds, **extra)
+    del users
+
+
+def main(iterations=2000):
+    samples = [('new', NEW_USER_EXAMPLE), ('old', OLD_USER_EXAMPLE)]
+    for sample_name, sample in samples:
+        measure('User/{!s} two copies (previous)'.format(sample_name),
+                legacy_user, sample, iterations)
+        measure('User/{!s} copy_data=True'.format(sample_name),
+                lambda doc: User(data=doc), sample, iterations)
+        measure('User/{!s} copy_data=False'.format(sample_name),
+                lambda doc: User(data=doc, copy_data=False), sample, iterations)
+
+    subclasses = [('DashboardUser', DashboardUser, NEW_DASHBOARD_USER_EXAMPLE),
+                  ('ProofingUser', ProofingUser, NEW_DASHBOARD_USER_EXAMPLE),
+                  ('SignupUser', SignupUser, NEW_SIGNUP_USER_EXAMPLE),
+                  ]
+    for name, cls, sample in subclasses:
+        measure('{!s} copy_data=True'.format(name),
+                lambda doc: cls(data=doc), sample, iterations)
+        measure('{!s} copy_data=False'.format(name),
+                lambda doc: cls(data=doc, copy_data=False), sample, iterations)
+
+    chpass_sample = {'_id': NEW_USER_EXAMPLE['_id'], 'passwords': NEW_USER_EXAMPLE['passwords']}
+    tou_sample = {'_id': NEW_USER_EXAMPLE['_id'], 'tou': []}
+    for name, cls, sample in [('ChpassUser', ChpassUser, chpass_sample), ('ToUUser', ToUUser, tou_sample)]:
+        measure('{!s} copy_data=True'.format(name),
+                lambda doc: cls(data=doc), sample, iterations)
+        measure('{!s} copy_data=False'.format(name),
+                lambda doc: cls(data=doc, copy_data=False), sample, iterations)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
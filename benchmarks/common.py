@@ -0,0 +1,199 @@
+"""
+Shared helpers for the eduid_userdb benchmarks.
+
+The benchmarks are plain scripts, run them from the top of the source tree, e.g.
+
+    PYTHONPATH=src python benchmarks/bench_lookup.py
+
+Benchmarks that need a database start a throw-away mongod using
+eduid_userdb.testing.MongoTemporaryInstance, so `mongod' must be in $PATH.
+
+When the environment variable BENCH_JSON is set to a file name, every reported result is
+also appended to that file as one JSON object per line, for comparing results between
+commits (see run_all.py and compare.py).
+"""
+
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import sys
+import time
+
+from bson import ObjectId
+
+def timed(func, iterations):
+    """
+    Call `func' `iterations' times.
+
+    :param func: Callable taking no arguments
+    :param iterations: Number of calls to make
+
+    :type func: callable
+    :type iterations: int
+
+    :return: Wall clock time spent, in seconds
+    :rtype: float
+    """
+    start = time.time()
+    for _ in xrange(iterations):
+        func()
+    return time.time() - start
+
+def server_ops(conn):
+    """
+    Get the number of operations a mongod has served so far.
+
+    Each query, getmore and command in the server opcounters is one client round trip. The
+    serverStatus command used to read the counters is itself counted, so callers comparing two
+    readings should subtract one.
+
+    :param conn: Pymongo connection to the mongod
+    :type conn: pymongo.MongoClient
+
+    :rtype: int
+    """
+    counters = conn.admin.command('serverStatus')['opcounters']
+    return counters['query'] + counters['getmore'] + counters['command']
+
+def report(name, iterations, seconds, **extra):
+    """
+    Print the result of a benchmark.
+
+    :param name: Name of the benchmark
+    :param iterations: Number of operations performed
+    :param seconds: Time spent performing them
+    :param extra: Additional values to report
+    """
+    per_op = (seconds / iterations) * 1000000 if iterations else 0
+    ops = iterations / seconds if seconds else 0
+    res = '{:<40s} {:>8d} ops {:>10.1f} us/op {:>10.1f} ops/s'.format(name, iterations, per_op, ops)
+    for key in sorted(extra):
+        res += ' {!s}={!s}'.format(key, extra[key])
+    print(res)
+
+    json_file = os.environ.get('BENCH_JSON')
+    if json_file:
+        result = {'benchmark': os.path.splitext(os.path.basename(sys.argv[0]))[0],
+                  'name': name,
+                  'iterations': iterations,
+                  'seconds': seconds,
+                  'us_per_op': per_op,
+                  'ops_per_s': ops,
+                  'extra': dict((key, str(value)) for key, value in extra.items()),
+                  }
+        with open(json_file, 'a') as fd:
+            fd.write(json.dumps(result, sort_keys=True) + '\n')
+
+def percentile(values, pct):
+    """
+    Get a percentile of a list of values, using the nearest rank.
+
+    :param values: Sorted values
+    :param pct: Percentile (0-100)
+
+    :type values: [float]
+    :type pct: float
+
+    :rtype: float | None
+    """
+    if not values:
+        return None
+    idx = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[idx]
+
+def make_user_doc(num, mails=1, phones=1, nins=1, tous=0):
+    """
+    Create a synthetic user document in the new userdb format.
+
+    :param num: Sequence number of the user, used to make the user unique
+    :param mails: Number of e-mail addresses
+    :param phones: Number of phone numbers
+    :param nins: Number of national identity numbers
+    :param tous: Number of ToU acceptance events
+
+    :return: User document
+    :rtype: dict
+    """
+    now = datetime.datetime(2015, 9, 24, 1, 1, 1, 111000)
+    doc = {'_id': ObjectId(),
+           'eduPersonPrincipalName': 'bench-{:07d}'.format(num),
+           'givenName': 'Bench',
+           'surname': 'User {:d}'.format(num),
+           'displayName': 'Bench User {:d}'.format(num),
+           'subject': 'physical person',
+           'preferredLanguage': 'en',
+           'mailAliases': [],
+           'phone': [],
+           'nins': [],
+           'tou': [],
+           'passwords': [{'id': ObjectId(),
+                          'salt': '$NDNv1H1$9c810d852430b62a9a7c6159d5d64c41$32$32$',
+                          'created_by': 'signup',
+                          'created_ts': now,
+                          }],
+           }
+    for idx in xrange(mails):
+        doc['mailAliases'].append({'email': 'user{:d}.{:d}@example.org'.format(num, idx),
+                                   'created_by': 'signup',
+                                   'created_ts': now,
+                                   'verified': True,
+                                   'primary': idx == 0,
+                                   })
+    for idx in xrange(phones):
+        doc['phone'].append({'number': '+46{:07d}{:02d}'.format(num, idx),
+                             'created_by': 'dashboard',
+                             'created_ts': now,
+                             'verified': True,
+                             'primary': idx == 0,
+                             })
+    for idx in xrange(nins):
+        doc['nins'].append({'number': '19{:08d}{:02d}'.format(num, idx),
+                            'created_by': 'dashboard',
+                            'created_ts': now,
+                            'verified': True,
+                            'primary': idx == 0,
+                            })
+    for idx in xrange(tous):
+        doc['tou'].append({'id': ObjectId(),
+                           'version': '2016-v{:d}'.format(idx),
+                           'created_by': 'dashboard',
+                           'created_ts': now,
+                           })
+    return doc
+
+class SlowCollection(object):
+    """
+    Proxy for a pymongo collection, sleeping before each call to simulate network latency.
+
+    :param coll: Collection to proxy
+    :param latency: Seconds to sleep before each call
+
+    :type coll: pymongo.collection.Collection
+    :type latency: float
+    """
+
+    def __init__(self, coll, latency):
+        self._coll = coll
+        self._latency = latency
+
+    def __getattr__(self, name):
+        attr = getattr(self._coll, name)
+        if not callable(attr):
+            return attr
+
+        def _slow(*args, **kwargs):
+            time.sleep(self._latency)
+            return attr(*args, **kwargs)
+        return _slow
+
+def temporary_db_uri():
+    """
+    Start (or re-use) a temporary mongod, and return a URI and a raw connection to it.
+
+    :rtype: (str, pymongo.Connection)
+    """
+    from eduid_userdb.testing import MongoTemporaryInstance
+    tmp_db = MongoTemporaryInstance.get_instance()
+    return tmp_db.get_uri(), tmp_db.conn
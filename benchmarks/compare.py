@@ -0,0 +1,47 @@
+"""
+Compare two result files written by run_all.py.
+
+    python benchmarks/compare.py results-old.json results-new.json [threshold]
+
+Prints the time per operation in both runs for each benchmark present in both files. Results
+where the new run is slower by more than `threshold' percent (default 10) are marked as
+regressions, and make the script exit with status 1.
+"""
+
+from __future__ import print_function
+
+import json
+import sys
+
+
+def load(filename):
+    with open(filename) as fd:
+        data = json.load(fd)
+    return data, dict(((res['benchmark'], res['name']), res) for res in data['results'])
+
+
+def main(old_file, new_file, threshold=10.0):
+    old_data, old = load(old_file)
+    new_data, new = load(new_file)
+    print('{!s} -> {!s}'.format(old_data.get('commit'), new_data.get('commit')))
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        old_us, new_us = old[key]['us_per_op'], new[key]['us_per_op']
+        change = ((new_us - old_us) / old_us) * 100 if old_us else 0
+        mark = ''
+        if change > threshold:
+            mark = ' REGRESSION'
+            regressions += 1
+        print('{:<22s} {:<40s} {:>10.1f} {:>10.1f} us/op {:>+7.1f}%{!s}'.format(
+            key[0], key[1], old_us, new_us, change, mark))
+    for key in sorted(set(old) ^ set(new)):
+        print('{:<22s} {:<40s} only in {!s}'.format(key[0], key[1], old_file if key in old else new_file))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Syntax: {!s} old.json new.json [threshold]'.format(sys.argv[0]))
+        sys.exit(1)
+    threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+    sys.exit(main(sys.argv[1], sys.argv[2], threshold))
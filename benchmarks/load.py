@@ -0,0 +1,230 @@
+"""
+Load test the user, actions and proofing databases with a mix of realistic operations.
+
+Seeds a database with synthetic users and then runs a number of worker processes, each with
+a number of threads, that pick operations at random (weighted by --mix) until --duration
+seconds have passed:
+
+  login      IdP login; look up a user by eppn or by e-mail address, and check for pending actions
+  dashboard  load a user with DashboardUserDB, change it and save it
+  actions    add an action for a user, fetch it with get_next_action and remove it
+  proofing   save a letter proofing state, load it and remove it
+
+Throughput and median/99th percentile latency are reported per operation, e.g.
+
+    PYTHONPATH=src python benchmarks/load.py --users 100000 --processes 4 --threads 8
+
+By default a temporary mongod is started (see eduid_userdb.testing.MongoTemporaryInstance),
+use --db-uri to run against an existing one. Results go to BENCH_JSON like for the other
+benchmarks, with the wall clock time of the run as `seconds'.
+"""
+
+from __future__ import print_function
+
+import argparse
+import datetime
+import multiprocessing
+import random
+import sys
+import threading
+import time
+
+from common import report, percentile, make_user_doc, temporary_db_uri
+
+from eduid_userdb import UserDB
+from eduid_userdb.actions import ActionDB
+from eduid_userdb.dashboard import DashboardUserDB
+from eduid_userdb.exceptions import UserOutOfSync
+from eduid_userdb.proofing import LetterProofingStateDB, LetterProofingState
+
+DB_NAME = 'eduid_bench'
+USERS_COLLECTION = 'load_users'
+ACTIONS_COLLECTION = 'load_actions'
+PROOFING_DB_NAME = 'eduid_bench_proofing'
+
+OPERATIONS = ['login', 'dashboard', 'actions', 'proofing']
+
+
+def seed(db_uri, args):
+    """
+    Replace the contents of the benchmark databases with `args.users' synthetic users.
+    """
+    userdb = UserDB(db_uri, DB_NAME, USERS_COLLECTION)
+    userdb._drop_whole_collection()
+    docs = []
+    for num in xrange(args.users):
+        doc = make_user_doc(num, mails=args.mails, phones=args.phones, nins=args.nins, tous=args.tous)
+        doc['modified_ts'] = datetime.datetime.utcnow()  # make save() update rather than insert
+        docs.append(doc)
+        if len(docs) == 1000:
+            userdb._coll.insert(docs)
+            docs = []
+    if docs:
+        userdb._coll.insert(docs)
+    userdb.reconcile_indexes()
+
+    actionsdb = ActionDB(db_uri, DB_NAME, ACTIONS_COLLECTION)
+    actionsdb._drop_whole_collection()
+    actionsdb.reconcile_indexes()
+
+    statedb = LetterProofingStateDB(db_uri, PROOFING_DB_NAME)
+    statedb._drop_whole_collection()
+    statedb.reconcile_indexes()
+
+
+class Worker(object):
+    """
+    One thread of load, with its own database objects (ActionDB has a per instance cache).
+    """
+
+    def __init__(self, db_uri, args, name):
+        self.args = args
+        self.name = name
+        self.userdb = UserDB(db_uri, DB_NAME, USERS_COLLECTION)
+        self.dashboarddb = DashboardUserDB(db_uri, DB_NAME, USERS_COLLECTION)
+        self.actionsdb = ActionDB(db_uri, DB_NAME, ACTIONS_COLLECTION)
+        self.statedb = LetterProofingStateDB(db_uri, PROOFING_DB_NAME)
+        self.latencies = dict((op, []) for op in OPERATIONS)
+        self.errors = dict((op, 0) for op in OPERATIONS)
+        self._count = 0
+
+    def run(self, weights, deadline):
+        choices = []
+        for op in OPERATIONS:
+            choices += [op] * weights.get(op, 0)
+        while time.time() < deadline:
+            op = random.choice(choices)
+            start = time.time()
+            try:
+                getattr(self, op)(random.randrange(self.args.users))
+            except UserOutOfSync:
+                # another worker saved the same user, like a user having two dashboard sessions
+                self.errors[op] += 1
+            self.latencies[op].append(time.time() - start)
+
+    def login(self, num):
+        if num % 2 or not self.args.mails:
+            user = self.userdb.get_user_by_eppn('bench-{:07d}'.format(num))
+        else:
+            user = self.userdb.get_user_by_mail('user{:d}.0@example.org'.format(num))
+        self.actionsdb.has_pending_actions(str(user.user_id), clean_cache=True)
+
+    def dashboard(self, num):
+        user = self.dashboarddb.get_user_by_eppn('bench-{:07d}'.format(num))
+        user.display_name = 'Bench User {:d} ({!s})'.format(num, self.name)
+        self.dashboarddb.save(user)
+
+    def actions(self, num):
+        user_id = self.userdb._coll.find_one({'eduPersonPrincipalName': 'bench-{:07d}'.format(num)},
+                                             {'_id': True})['_id']
+        self.actionsdb.add_action(user_id, action_type='bench', session=self.name)
+        action = self.actionsdb.get_next_action(str(user_id), session=self.name)
+        if action is not None:
+            self.actionsdb.remove_action_by_id(action.action_id)
+        self.actionsdb.clean_cache(str(user_id), session=self.name)
+
+    def proofing(self, num):
+        self._count += 1
+        eppn = 'bench-{!s}-{:d}'.format(self.name, self._count)
+        state = LetterProofingState({'eduPersonPrincipalName': eppn,
+                                     'nin': {'number': '19{:08d}00'.format(num),
+                                             'created_by': 'bench',
+                                             'created_ts': True,
+                                             'verified': False,
+                                             'verification_code': 'abc123',
+                                             },
+                                     })
+        self.statedb.save(state)
+        state = self.statedb.get_state_by_eppn(eppn)
+        self.statedb.remove_state(state)
+
+
+def run_process(db_uri, args, weights, deadline, proc_num, queue=None):
+    """
+    Run `args.threads' workers until `deadline', and collect their latencies and errors.
+    """
+    workers = [Worker(db_uri, args, '{:d}.{:d}'.format(proc_num, num)) for num in xrange(args.threads)]
+    threads = [threading.Thread(target=worker.run, args=(weights, deadline)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies = dict((op, []) for op in OPERATIONS)
+    errors = dict((op, 0) for op in OPERATIONS)
+    for worker in workers:
+        for op in OPERATIONS:
+            latencies[op] += worker.latencies[op]
+            errors[op] += worker.errors[op]
+    if queue is not None:
+        queue.put((latencies, errors))
+    return latencies, errors
+
+
+def parse_mix(value):
+    weights = {}
+    for part in value.split(','):
+        op, _, weight = part.partition('=')
+        if op not in OPERATIONS:
+            raise argparse.ArgumentTypeError('Unknown operation {!r}'.format(op))
+        weights[op] = int(weight)
+    if not sum(weights.values()):
+        raise argparse.ArgumentTypeError('At least one operation must have a weight')
+    return weights
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Load test the eduid_userdb databases')
+    parser.add_argument('--users', type=int, default=10000, help='Number of users to seed')
+    parser.add_argument('--mails', type=int, default=1, help='E-mail addresses per user')
+    parser.add_argument('--phones', type=int, default=1, help='Phone numbers per user')
+    parser.add_argument('--nins', type=int, default=1, help='National identity numbers per user')
+    parser.add_argument('--tous', type=int, default=2, help='ToU acceptance events per user')
+    parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='Number of threads per process')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run the workload')
+    parser.add_argument('--mix', type=parse_mix, default='login=70,dashboard=10,actions=10,proofing=10',
+                        help='Operation weights, e.g. login=70,dashboard=10,actions=10,proofing=10')
+    parser.add_argument('--db-uri', help='Use an existing database instead of a temporary mongod')
+    parser.add_argument('--no-seed', action='store_true', help='Use the users already in the database')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    if args.db_uri:
+        db_uri = args.db_uri
+    else:
+        db_uri, _conn = temporary_db_uri()
+    if not args.no_seed:
+        start = time.time()
+        seed(db_uri, args)
+        print('Seeded {:d} users in {:.1f} seconds'.format(args.users, time.time() - start))
+
+    start = time.time()
+    deadline = start + args.duration
+    if args.processes == 1:
+        results = [run_process(db_uri, args, args.mix, deadline, 0)]
+    else:
+        queue = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=run_process, args=(db_uri, args, args.mix, deadline, num, queue))
+                 for num in xrange(args.processes)]
+        for proc in procs:
+            proc.start()
+        results = [queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+    seconds = time.time() - start
+
+    for op in OPERATIONS:
+        latencies = sorted(sum([res[0][op] for res in results], []))
+        if not latencies:
+            continue
+        errors = sum(res[1][op] for res in results)
+        report('load {!s} ({:d}x{:d})'.format(op, args.processes, args.threads), len(latencies), seconds,
+               p50_ms='{:.2f}'.format(percentile(latencies, 50) * 1000),
+               p99_ms='{:.2f}'.format(percentile(latencies, 99) * 1000),
+               errors=errors)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
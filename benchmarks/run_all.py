@@ -0,0 +1,86 @@
+"""
+Run the benchmarks that don't need a database, and save the results as JSON.
+
+    PYTHONPATH=src python benchmarks/run_all.py results-abc123.json [--with-db]
+
+Each benchmark runs in a separate process. The output file has the git commit, the Python
+version and a list with one entry per reported result, and can be compared to the results
+from another commit with compare.py. With --with-db, the benchmarks that start a temporary
+mongod are run too.
+"""
+
+from __future__ import print_function
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+NO_DB_BENCHMARKS = ['bench_models.py',
+                    'bench_user_init.py',
+                    'bench_element_list.py',
+                    ]
+
+DB_BENCHMARKS = ['bench_lookup.py',
+                 'bench_bulk_fetch.py',
+                 'bench_partial_save.py',
+                 'bench_save_logging.py',
+                 'bench_support_lookup.py',
+                 'bench_support_search.py',
+                 'bench_instrumentation.py',
+                 'bench_actions_login.py',
+                 'bench_oidc_callback.py',
+                 'load.py',
+                 ]
+
+
+def git_commit(path):
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(script, json_file):
+    env = dict(os.environ)
+    env['BENCH_JSON'] = json_file
+    here = os.path.dirname(os.path.abspath(__file__))
+    print('Running {!s}'.format(script))
+    return subprocess.call([sys.executable, os.path.join(here, script)], env=env, cwd=here)
+
+
+def main(output, with_db=False):
+    here = os.path.dirname(os.path.abspath(__file__))
+    scripts = NO_DB_BENCHMARKS + (DB_BENCHMARKS if with_db else [])
+    fd, json_file = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    failed = []
+    try:
+        for script in scripts:
+            if run(script, json_file) != 0:
+                failed.append(script)
+        with open(json_file) as fd:
+            results = [json.loads(line) for line in fd if line.strip()]
+    finally:
+        os.unlink(json_file)
+
+    data = {'commit': git_commit(here),
+            'python': platform.python_version(),
+            'created_ts': datetime.datetime.utcnow().isoformat(),
+            'failed': failed,
+            'results': results,
+            }
+    with open(output, 'w') as fd:
+        json.dump(data, fd, indent=2, sort_keys=True)
+    print('Wrote {:d} results to {!s}'.format(len(results), output))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Syntax: {!s} output.json [--with-db]'.format(sys.argv[0]))
+        sys.exit(1)
+    sys.exit(main(sys.argv[1], with_db='--with-db' in sys.argv[2:]))
@@ -14,6 +14,7 @@ version = '0.2.5b0'
 
 install_requires = [
     'pymongo >= 2.8.0, < 3.0',
+    'futures >= 3.0.0; python_version < "3"',
 ]
 
 testing_extras = [
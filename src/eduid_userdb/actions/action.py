@@ -94,6 +94,10 @@ class Action(object):
         self._data['preference'] = self._data_in.pop('preference', 100)
         self._data['session'] = self._data_in.pop('session', '')
         self._data['params'] = self._data_in.pop('params', {})
+        # optional; expires_ts when added, the claim when claimed by a worker (see ActionDB.claim_next_action)
+        for key in ['expires_ts', 'claim_id', 'claim_expires_ts']:
+            if key in self._data_in:
+                self._data[key] = self._data_in.pop(key)
 
         if len(self._data_in) > 0:
             if raise_on_unknown:
@@ -194,6 +198,36 @@ class Action(object):
         """
         return self._data.get('params')
 
+    # -----------------------------------------------------------------
+    @property
+    def expires_ts(self):
+        """
+        Get the time after which the action is removed, if not performed.
+
+        :rtype: datetime.datetime | None
+        """
+        return self._data.get('expires_ts')
+
+    # -----------------------------------------------------------------
+    @property
+    def claim_id(self):
+        """
+        Get the identifier of the claim on the action, if it has been claimed by a worker.
+
+        :rtype: bson.ObjectId | None
+        """
+        return self._data.get('claim_id')
+
+    # -----------------------------------------------------------------
+    @property
+    def claim_expires_ts(self):
+        """
+        Get the time the claim on the action expires, if it has been claimed by a worker.
+
+        :rtype: datetime.datetime | None
+        """
+        return self._data.get('claim_expires_ts')
+
     # -----------------------------------------------------------------
     def to_dict(self):
         """
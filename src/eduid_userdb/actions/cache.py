@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Caching of pending actions, for use with eduid_userdb.actions.db.ActionDB.
+
+The IdP asks ActionDB.has_pending_actions() on every login. To not grow without bounds in
+long lived processes, the pending actions are kept in a bounded (LRU) cache, where entries
+also expire after a while:
+
+    actionsdb = ActionDB(db_uri, cache=ActionCache(max_size=10000, ttl=30))
+
+Several processes (IdP and actions app workers) share the same actions collection. To pick
+up actions added or removed by another process sooner than the TTL, ActionDB can bump a
+version counter in the database on every change, and have each process poll that counter:
+
+    actionsdb = ActionDB(db_uri, invalidation_interval=2)
+"""
+
+from __future__ import absolute_import
+
+import time
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ActionCache(object):
+    """
+    Bounded (LRU) cache of the pending actions of users, with a time to live for each entry.
+
+    The cached lists are returned as they are (not copied), since ActionDB.get_next_action()
+    consumes the actions from them.
+
+    Any object with the get(), put(), invalidate() and clear() methods of this class can be
+    used as cache by ActionDB.
+
+    :param max_size: Maximum number of users/sessions to keep in the cache
+    :param ttl: Number of seconds an entry is valid after it has been stored
+    :param timer: Function returning current time in seconds (for tests)
+
+    :type max_size: int
+    :type ttl: int | float
+    :type timer: callable
+    """
+
+    def __init__(self, max_size=10000, ttl=60, timer=time.time):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, actions), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __repr__(self):
+        return '<eduID {!s}: {!s}/{!s} entries, ttl {!s}>'.format(self.__class__.__name__,
+                                                                   len(self._entries),
+                                                                   self.max_size,
+                                                                   self.ttl)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Get the cached actions for a user (and session).
+
+        :param key: Cache key
+        :type key: str | unicode
+
+        :return: Action documents, or None if not found in cache
+        :rtype: [dict] | None
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self._timer():
+                self.expirations += 1
+                self.misses += 1
+                return None
+            # re-insert to mark entry as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, actions):
+        """
+        Store the actions for a user (and session) in the cache.
+
+        :param key: Cache key
+        :param actions: Action documents
+
+        :type key: str | unicode
+        :type actions: [dict]
+        """
+        entry = (self._timer() + self.ttl, actions)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Remove an entry from the cache.
+
+        :param key: Cache key
+        :type key: str | unicode
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove all entries from the cache. The counters are left as they are.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        :return: Cache statistics
+        :rtype: dict
+        """
+        with self._lock:
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    }
+
+
+class VersionInvalidation(object):
+    """
+    Invalidation channel for ActionCaches in different processes, using a version counter
+    stored in the database.
+
+    Every change to the actions collection increments the counter (changed()). Before using
+    its cache, each process reads the counter at most once every `poll_interval' seconds
+    (check()), and clears the cache if the counter has changed since the last time.
+
+    :param coll: Collection to keep the counter in
+    :param poll_interval: Minimum number of seconds between reads of the counter
+    :param timer: Function returning current time in seconds (for tests)
+
+    :type coll: pymongo.collection.Collection
+    :type poll_interval: int | float
+    :type timer: callable
+    """
+
+    COUNTER_ID = 'actions'
+
+    def __init__(self, coll, poll_interval=1, timer=time.time):
+        self._coll = coll
+        self.poll_interval = poll_interval
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._version = None
+        self._next_poll = 0
+        self.polls = 0
+        self.invalidations = 0
+
+    def __repr__(self):
+        return '<eduID {!s}: {!r} version {!s}>'.format(self.__class__.__name__,
+                                                        self._coll.name,
+                                                        self._version)
+
+    def changed(self):
+        """
+        Tell all processes that the actions have changed.
+        """
+        self._coll.update({'_id': self.COUNTER_ID}, {'$inc': {'version': 1}}, upsert=True)
+
+    def check(self, *caches):
+        """
+        Clear `caches' if the actions have been changed (by any process) since the last check.
+
+        :param caches: Caches to clear
+        :type caches: [ActionCache]
+        """
+        now = self._timer()
+        with self._lock:
+            if now < self._next_poll:
+                return
+            self._next_poll = now + self.poll_interval
+            self.polls += 1
+            doc = self._coll.find_one({'_id': self.COUNTER_ID})
+            version = doc['version'] if doc else 0
+            if self._version is not None and version != self._version:
+                logger.debug('{!s} Actions changed (version {!s}), clearing caches'.format(self, version))
+                for cache in caches:
+                    cache.clear()
+                self.invalidations += 1
+            self._version = version
@@ -30,10 +30,14 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 
+import datetime
+
 from bson import ObjectId
 import pymongo
+from pymongo.errors import BulkWriteError
 
 from eduid_userdb.actions import Action
+from eduid_userdb.actions.cache import ActionCache, VersionInvalidation
 from eduid_userdb.db import BaseDB
 from eduid_userdb.exceptions import ActionDBError
 
@@ -44,14 +48,41 @@ logger = logging.getLogger(__name__)
 class ActionDB(BaseDB):
     """
     Interface class to the central eduID actions DB.
+
+    :param cache: Cache of pending actions (default an ActionCache with default settings)
+    :param negative_ttl: Number of seconds to remember users without pending actions (0 to disable)
+    :param invalidation_interval: Poll a version counter in the database at most this often
+                                  (in seconds), to notice actions changed by other processes
+                                  (default no polling, see eduid_userdb.actions.cache)
+
+    :type cache: eduid_userdb.actions.cache.ActionCache | None
+    :type negative_ttl: int | float
+    :type invalidation_interval: int | float | None
     """
 
     ActionClass = Action
 
-    def __init__(self, db_uri, db_name='eduid_actions', collection='actions'):
+    indexes = {
+        'user-preference-index-v1': {'key': [('user_oid', 1), ('preference', 1)]},
+        # let the server remove actions past their expires_ts
+        'expires-index-v1': {'key': [('expires_ts', 1)], 'expireAfterSeconds': 0, 'sparse': True},
+    }
+
+    def __init__(self, db_uri, db_name='eduid_actions', collection='actions', cache=None,
+                 negative_ttl=5, invalidation_interval=None):
         super(ActionDB, self).__init__(db_uri, db_name, collection)
 
-        self._cache = {}
+        if cache is None:
+            cache = ActionCache()
+        self._cache = cache
+        # str(userid) -> sessions for which the user had no pending actions
+        self._negative_cache = None
+        if negative_ttl:
+            self._negative_cache = ActionCache(ttl=negative_ttl)
+        self.invalidation = None
+        if invalidation_interval is not None:
+            version_coll = self._db.get_collection('{!s}_version'.format(collection))
+            self.invalidation = VersionInvalidation(version_coll, invalidation_interval)
         logger.debug("{!s} connected to database".format(self))
 
     def __repr__(self):
@@ -78,25 +109,58 @@ class ActionDB(BaseDB):
         :type session: str
         """
         cachekey = self._make_key(userid, session)
-        if cachekey in self._cache:
-            del self._cache[cachekey]
+        self._cache.invalidate(cachekey)
 
-    def _update_cache(self, userid, session):
-        cachekey = self._make_key(userid, session)
-
-        if cachekey not in self._cache:
-            query = {'user_oid': ObjectId(userid)}
-            if session is None:
-                query['session'] = {'$exists': False}
+    def _pending_query(self, userid, session):
+        query = {'user_oid': ObjectId(userid)}
+        if session is None:
+            query['session'] = {'$exists': False}
+        else:
+            query['$or'] = [ {'session': {'$exists': False}},
+                             {'session': session} ]
+        return query
+
+    def _check_invalidation(self):
+        if self.invalidation is not None:
+            if self._negative_cache is not None:
+                self.invalidation.check(self._cache, self._negative_cache)
             else:
-                query['$or'] = [ {'session': {'$exists': False}},
-                                 {'session': session} ]
+                self.invalidation.check(self._cache)
+
+    def _known_without_actions(self, userid, session):
+        if self._negative_cache is None:
+            return False
+        sessions = self._negative_cache.get(str(userid))
+        return sessions is not None and session in sessions
+
+    def _remember_without_actions(self, userid, session):
+        if self._negative_cache is None:
+            return
+        sessions = self._negative_cache.get(str(userid)) or frozenset()
+        self._negative_cache.put(str(userid), sessions | frozenset([session]))
 
-            actions = self._coll.find(query).sort('preference')
-            count = actions.count()
-            if count > 0:
-                self._cache[cachekey] = [a for a in actions]
-        return cachekey
+    def _get_cached(self, userid, session):
+        """
+        Get the pending actions of a user from the cache, loading them from the database
+        if they are not cached.
+
+        :return: The pending actions (None if there are none)
+        :rtype: [dict] | None
+        """
+        cachekey = self._make_key(userid, session)
+        self._check_invalidation()
+
+        actions = self._cache.get(cachekey)
+        if actions is None:
+            if self._known_without_actions(userid, session):
+                return None
+            actions = [a for a in self._coll.find(self._pending_query(userid, session)).sort('preference')]
+            if actions:
+                self._cache.put(cachekey, actions)
+            else:
+                self._remember_without_actions(userid, session)
+                actions = None
+        return actions
 
     def has_pending_actions(self, userid, session=None, clean_cache=False):
         """
@@ -105,6 +169,10 @@ class ActionDB(BaseDB):
         otherwise search actions with either no session
         or with the specified session.
 
+        Users found to have no pending actions are remembered for `negative_ttl' seconds
+        (or until an action is added for them by this ActionDB). Users not in the cache
+        are looked up with a query for a single _id, rather than loading their actions.
+
         :param userid: The id of the user with possible pending actions
         :param session: The actions session for the user
         :param clean_cache: Whether to clean the cache of pending actions
@@ -119,15 +187,24 @@ class ActionDB(BaseDB):
 
         :rtype: bool
         """
-        cachekey = self._update_cache(userid, session)
-        if cachekey in self._cache:
-            if len(self._cache[cachekey]) > 0:
+        cachekey = self._make_key(userid, session)
+        self._check_invalidation()
+
+        actions = self._cache.get(cachekey)
+        if actions is not None:
+            if len(actions) > 0:
                 if clean_cache:
                     self.clean_cache(userid, session)
                 return True
-            else:
-                self.clean_cache(userid, session)
-        return False
+            self.clean_cache(userid, session)
+            return False
+
+        if self._known_without_actions(userid, session):
+            return False
+        if self._coll.find_one(self._pending_query(userid, session), {'_id': True}) is None:
+            self._remember_without_actions(userid, session)
+            return False
+        return True
 
     def has_actions(self, userid=None, session=None, action_type=None, params=None):
         """
@@ -177,11 +254,11 @@ class ActionDB(BaseDB):
 
         :rtype: eduid_userdb.actions:Action or None
         """
-        cachekey = self._update_cache(userid, session)
+        actions = self._get_cached(userid, session)
         action = None
-        if cachekey in self._cache:
+        if actions is not None:
             try:
-                action_doc = self._cache[cachekey].pop()
+                action_doc = actions.pop()
             except IndexError:
                 self.clean_cache(userid, session)
             else:
@@ -189,7 +266,7 @@ class ActionDB(BaseDB):
         return action
 
     def add_action(self, userid=None, action_type=None, preference=100,
-                   session=None, params=None, data=None):
+                   session=None, params=None, data=None, expires_ts=None):
         """
         Add an action to the DB.
 
@@ -199,6 +276,7 @@ class ActionDB(BaseDB):
         :param session: The IdP session for the user
         :param params: Any params the action may need
         :param data: all the previous params together
+        :param expires_ts: Time after which the action is removed, if not performed
 
         :type userid: bson.ObjectId
         :type action_type: str
@@ -206,6 +284,7 @@ class ActionDB(BaseDB):
         :type session: str
         :type params: dict
         :type data: dict
+        :type expires_ts: datetime.datetime | None
 
         :rtype: Action
         """
@@ -218,15 +297,89 @@ class ActionDB(BaseDB):
                 data['session'] = session
             if params is not None:
                 data['params'] = params
+            if expires_ts is not None:
+                data['expires_ts'] = expires_ts
 
         # XXX deal with exceptions here ?
         action = Action(data = data)
         result = self._coll.insert(action.to_dict())
+        if self._negative_cache is not None:
+            self._negative_cache.invalidate(str(action.user_id))
         if result == action.action_id:
+            if self.invalidation is not None:
+                self.invalidation.changed()
             return action
         logger.error("Failed inserting action {!r} into db".format(action))
         raise ActionDBError('Failed inserting action into db')
 
+    def add_actions(self, userids, action_type, preference=100, session=None, params=None,
+                    expires_ts=None, chunk_size=1000):
+        """
+        Add the same action for a large number of users, e.g. a new version of the ToU.
+
+        Users that already have an action with the same action_type and params (in any session)
+        are skipped, as are duplicates in `userids'. Instead of a has_actions() and an
+        add_action() call for each user, the existing actions are found with one aggregation
+        and the new ones inserted with one unordered bulk operation per `chunk_size' users.
+
+        :param userids: The ids of the users who have to perform the action
+        :param action_type: the kind of action to be performed
+        :param preference: preference to order actions
+        :param session: The IdP session for the users
+        :param params: Any params the action may need
+        :param expires_ts: Time after which the actions are removed, if not performed
+        :param chunk_size: Number of users to handle in each database operation
+
+        :type userids: [bson.ObjectId | str]
+        :type action_type: str
+        :type preference: int
+        :type session: str | None
+        :type params: dict | None
+        :type expires_ts: datetime.datetime | None
+        :type chunk_size: int
+
+        :return: Number of actions added and number of users skipped
+        :rtype: (int, int)
+        """
+        if params is None:
+            params = {}
+        userids = [x if isinstance(x, ObjectId) else ObjectId(x) for x in userids]
+        added = 0
+        seen = set()
+        for start in xrange(0, len(userids), chunk_size):
+            chunk = [x for x in userids[start:start + chunk_size] if x not in seen]
+            seen.update(chunk)
+            if not chunk:
+                continue
+            pipeline = [{'$match': {'user_oid': {'$in': chunk}, 'action': action_type, 'params': params}},
+                        {'$group': {'_id': '$user_oid'}},
+                        ]
+            existing = set(doc['_id'] for doc in self._coll.aggregate(pipeline, cursor={}))
+            new = [x for x in chunk if x not in existing]
+            if not new:
+                continue
+            bulk = self._coll.initialize_unordered_bulk_op()
+            for userid in new:
+                action = Action(user_oid=userid, action_type=action_type, preference=preference,
+                                session=session, params=params)
+                doc = action.to_dict()
+                if expires_ts is not None:
+                    doc['expires_ts'] = expires_ts
+                bulk.insert(doc)
+            try:
+                result = bulk.execute()
+            except BulkWriteError as exc:
+                logger.error("Failed inserting {!s} actions into db: {!r}".format(len(new), exc.details))
+                raise ActionDBError('Failed inserting actions into db')
+            added += result['nInserted']
+            if self._negative_cache is not None:
+                for userid in new:
+                    self._negative_cache.invalidate(str(userid))
+        if added and self.invalidation is not None:
+            self.invalidation.changed()
+        logger.debug("{!s} Added {!s} {!r} actions to {!r}".format(self, added, action_type, self._coll_name))
+        return added, len(userids) - added
+
     def remove_action_by_id(self, action_id):
         """
         Remove an action in the actions db given the action's _id.
@@ -235,5 +388,145 @@ class ActionDB(BaseDB):
         :type action_id: bson.ObjectId
         """
         logger.debug("{!s} Removing action with id {!r} from {!r}".format(self, action_id, self._coll_name))
-        return self._coll.remove(spec_or_id=action_id)
+        result = self._coll.remove(spec_or_id=action_id)
+        if self.invalidation is not None:
+            self.invalidation.changed()
+        return result
+
+    def remove_expired_actions(self, session_max_age=None, now=None):
+        """
+        Remove actions past their expires_ts, and optionally session bound actions older than
+        `session_max_age' seconds (abandoned when the user didn't return from the actions app).
+
+        The server removes expired actions by itself (using a TTL index, see `indexes'), but
+        only about once a minute. Session bound actions are aged by the creation time in their
+        _id, since actions added before expires_ts existed don't have one.
 
+        :param session_max_age: Maximum age of session bound actions, in seconds
+        :param now: Current time (for tests)
+
+        :type session_max_age: int | None
+        :type now: datetime.datetime | None
+
+        :return: Number of actions removed
+        :rtype: int
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        spec = {'expires_ts': {'$lte': now}}
+        if session_max_age is not None:
+            cutoff = ObjectId.from_datetime(now - datetime.timedelta(seconds=session_max_age))
+            spec = {'$or': [spec, {'session': {'$exists': True}, '_id': {'$lt': cutoff}}]}
+        result = self._coll.remove(spec)
+        removed = result['n']
+        if removed:
+            logger.info("{!s} Removed {!s} expired actions from {!r}".format(self, removed, self._coll_name))
+            if self.invalidation is not None:
+                self.invalidation.changed()
+        return removed
+
+
+    def _claimable_query(self, userid, session, now):
+        unclaimed = {'$or': [{'claim_expires_ts': {'$exists': False}},
+                             {'claim_expires_ts': {'$lte': now}}]}
+        return {'$and': [self._pending_query(userid, session), unclaimed]}
+
+    def claim_next_action(self, userid, session=None, lease=300):
+        """
+        Claim the next pending action for userid and session, for processing by this worker.
+
+        Unlike get_next_action(), this is done atomically in the database, so that only one
+        of several actions app workers gets each action. The action is claimed for `lease'
+        seconds, after which another worker can claim it again (e.g. if this worker crashed
+        while processing it). When done, remove it with remove_claimed_action().
+
+        The action with the highest preference is claimed first, like get_next_action().
+
+        :param userid: The id of the user with possible pending actions
+        :param session: The IdP session for the user
+        :param lease: Number of seconds to hold the claim
+
+        :type userid: str
+        :type session: str
+        :type lease: int
+
+        :return: The claimed action, or None if there are no unclaimed pending actions
+        :rtype: eduid_userdb.actions:Action or None
+        """
+        now = datetime.datetime.utcnow()
+        claim = {'claim_id': ObjectId(),
+                 'claim_expires_ts': now + datetime.timedelta(seconds=lease),
+                 }
+        doc = self._coll.find_and_modify(query=self._claimable_query(userid, session, now),
+                                         sort=[('preference', pymongo.DESCENDING)],
+                                         update={'$set': claim},
+                                         new=True)
+        if doc is None:
+            return None
+        return self.ActionClass(data=doc)
+
+    def claim_actions(self, userid, session=None, lease=300, limit=10):
+        """
+        Claim up to `limit' pending actions for userid and session at once.
+
+        The actions are claimed with a single update, so each action is only claimed by
+        one worker even if several workers try to claim actions for the same user at the
+        same time (in which case each worker might get fewer than `limit' actions).
+
+        :param userid: The id of the user with possible pending actions
+        :param session: The IdP session for the user
+        :param lease: Number of seconds to hold the claims
+        :param limit: Maximum number of actions to claim
+
+        :type userid: str
+        :type session: str
+        :type lease: int
+        :type limit: int
+
+        :return: The claimed actions, highest preference first
+        :rtype: [eduid_userdb.actions:Action]
+        """
+        now = datetime.datetime.utcnow()
+        query = self._claimable_query(userid, session, now)
+        candidates = self._coll.find(query, {'_id': True, 'preference': True})
+        candidates = candidates.sort('preference', pymongo.DESCENDING).limit(limit)
+        action_ids = [doc['_id'] for doc in candidates]
+        if not action_ids:
+            return []
+        claim = {'claim_id': ObjectId(),
+                 'claim_expires_ts': now + datetime.timedelta(seconds=lease),
+                 }
+        # re-check the query, since other workers might have claimed some of the candidates
+        self._coll.update({'$and': [{'_id': {'$in': action_ids}}, query]}, {'$set': claim}, multi=True)
+        docs = self._coll.find({'_id': {'$in': action_ids}, 'claim_id': claim['claim_id']})
+        return [self.ActionClass(data=doc) for doc in docs.sort('preference', pymongo.DESCENDING)]
+
+    def release_action(self, action):
+        """
+        Give up the claim on an action, making it available to other workers immediately.
+
+        :param action: Action claimed with claim_next_action() or claim_actions()
+        :type action: eduid_userdb.actions:Action
+
+        :return: False if the claim had already expired and been taken over by another worker
+        :rtype: bool
+        """
+        result = self._coll.update({'_id': action.action_id, 'claim_id': action.claim_id},
+                                   {'$unset': {'claim_id': True, 'claim_expires_ts': True}})
+        return result['n'] > 0
+
+    def remove_claimed_action(self, action):
+        """
+        Remove a processed action, unless the claim on it has been taken over by another worker.
+
+        :param action: Action claimed with claim_next_action() or claim_actions()
+        :type action: eduid_userdb.actions:Action
+
+        :return: False if the claim had expired and been taken over by another worker
+        :rtype: bool
+        """
+        logger.debug("{!s} Removing claimed action {!r} from {!r}".format(self, action, self._coll_name))
+        result = self._coll.remove({'_id': action.action_id, 'claim_id': action.claim_id})
+        if self.invalidation is not None:
+            self.invalidation.changed()
+        return result['n'] > 0
@@ -53,10 +53,13 @@ class ToUUser(User):
     :param raise_on_unknown: whether to raise an exception if
                              there is unknown data in the data dict
     :type raise_on_unknown: bool
+    :param copy_data: whether to copy the data dict before using it,
+                      or take ownership of it
+    :type copy_data: bool
     """
 
     def __init__(self, userid = None, tou = None, data = None,
-                                         raise_on_unknown = True):
+                                         raise_on_unknown = True, copy_data = True):
         """
         """
         if data is None:
@@ -70,8 +73,12 @@ class ToUUser(User):
                                   'an unknown version of the ToU for '
                                   'the user with id ' + str(data['_id']))
 
-        self._data_in = deepcopy(data)
+        if copy_data:
+            data = deepcopy(data)
+        self._data_in = data
         self._data = dict()
+        self._raw_lists = dict()
+        self._migrated_lists = set()
 
         # things without setters
         _id = self._data_in.pop('_id', None)
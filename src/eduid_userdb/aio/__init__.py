@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking access to the eduID databases, for applications that must not block on database I/O.
+
+Python 2 has no asyncio, and pymongo has no non-blocking API, so the blocking database
+classes are run in a thread pool. The methods return concurrent.futures.Future instances,
+which can be awaited with asyncio.wrap_future() on Python 3.
+"""
+
+from eduid_userdb.aio.db import get_default_executor
+from eduid_userdb.aio.db import AsyncBaseDB, AsyncUserDB, AsyncActionDB, AsyncProofingStateDB
+from eduid_userdb.aio.db import AsyncOidcProofingStateDB
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking versions of the eduID database classes.
+
+Each class wraps an instance of the corresponding synchronous class, and runs its methods
+in a thread pool executor. The methods return futures instead of blocking the caller on
+database I/O. Lookups, optimistic locking in save() and the exceptions raised are those of
+the wrapped class - exceptions are raised when the result of the future is retrieved.
+
+    userdb = AsyncUserDB(UserDB(db_uri, 'eduid_am'))
+    future = userdb.get_user_by_eppn('hubba-bubba')
+    user = future.result(timeout=5)
+
+The futures are concurrent.futures.Future instances (from the `futures' backport on Python 2),
+so with asyncio they can be awaited using asyncio.wrap_future().
+"""
+
+from __future__ import absolute_import
+
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+_default_executor = None
+_default_executor_pid = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor(max_workers=10):
+    """
+    Get the executor shared by everything in this process not given an executor of its own.
+
+    Threads don't survive os.fork(), so a new executor is created in child processes.
+
+    :param max_workers: Number of worker threads, if the executor has to be created
+    :type max_workers: int
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _default_executor, _default_executor_pid
+    with _default_executor_lock:
+        if _default_executor is None or _default_executor_pid != os.getpid():
+            _default_executor = ThreadPoolExecutor(max_workers=max_workers)
+            _default_executor_pid = os.getpid()
+        return _default_executor
+
+
+def _run_in_executor(name):
+    """
+    Create a method running the method `name' of the wrapped database object in the executor.
+
+    :param name: Name of the method of the wrapped object
+    :type name: str
+
+    :rtype: callable
+    """
+    def method(self, *args, **kwargs):
+        return self._submit(getattr(self._db, name), *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'Call {!s}() on the wrapped database object in the executor.\n\n' \
+                     ':rtype: Future\n'.format(name)
+    return method
+
+
+class AsyncBaseDB(object):
+    """
+    Base class for the non-blocking database classes.
+
+    :param db: Database object to wrap
+    :param executor: Executor to run the calls in, default is the one shared by the process
+
+    :type db: eduid_userdb.db.BaseDB
+    :type executor: concurrent.futures.ThreadPoolExecutor
+    """
+
+    # Classes that are not safe to use from more than one thread at the time set this
+    serialize = False
+
+    def __init__(self, db, executor=None):
+        self._db = db
+        self._executor = executor
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<eduID {!s}: {!r}>'.format(self.__class__.__name__, self._db)
+
+    @property
+    def db(self):
+        """
+        The wrapped (blocking) database object.
+        """
+        return self._db
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            return get_default_executor()
+        return self._executor
+
+    def _submit(self, fn, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)' in the executor.
+
+        :rtype: Future
+        """
+        if self.serialize:
+            return self.executor.submit(self._call_locked, fn, args, kwargs)
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def _call_locked(self, fn, args, kwargs):
+        with self._lock:
+            return fn(*args, **kwargs)
+
+    db_count = _run_in_executor('db_count')
+    remove_document = _run_in_executor('remove_document')
+    close = _run_in_executor('close')
+
+
+class AsyncUserDB(AsyncBaseDB):
+    """
+    Non-blocking version of eduid_userdb.userdb.UserDB.
+
+    iter_users() is not available, since consuming the iterator would block the caller.
+
+    :type db: eduid_userdb.userdb.UserDB
+    """
+
+    get_user_by_id = _run_in_executor('get_user_by_id')
+    get_user_by_mail = _run_in_executor('get_user_by_mail')
+    get_user_by_nin = _run_in_executor('get_user_by_nin')
+    get_user_by_phone = _run_in_executor('get_user_by_phone')
+    get_user_by_eppn = _run_in_executor('get_user_by_eppn')
+    save = _run_in_executor('save')
+    save_many = _run_in_executor('save_many')
+    remove_user_by_id = _run_in_executor('remove_user_by_id')
+    update_user = _run_in_executor('update_user')
+    get_identity_proofing = _run_in_executor('get_identity_proofing')
+
+    def get_users_by_ids(self, user_ids, chunk_size=1000):
+        """
+        Look up many users by _id. See UserDB.get_users_by_ids().
+
+        :return: Future with the result ([UserClass], set of user_ids not found)
+        :rtype: Future
+        """
+        return self._submit(self._get_users_list, self._db.get_users_by_ids, user_ids, chunk_size)
+
+    def get_users_by_eppns(self, eppns, chunk_size=1000):
+        """
+        Look up many users by eppn. See UserDB.get_users_by_eppns().
+
+        :return: Future with the result ([UserClass], set of eppns not found)
+        :rtype: Future
+        """
+        return self._submit(self._get_users_list, self._db.get_users_by_eppns, eppns, chunk_size)
+
+    @staticmethod
+    def _get_users_list(method, values, chunk_size):
+        # consume the generator in the worker thread
+        users, missing = method(values, chunk_size=chunk_size)
+        users = list(users)
+        return users, missing
+
+
+class AsyncActionDB(AsyncBaseDB):
+    """
+    Non-blocking version of eduid_userdb.actions.ActionDB.
+
+    The calls are serialized, since the ActionDB keeps an (unlocked) cache of pending actions.
+
+    :type db: eduid_userdb.actions.ActionDB
+    """
+
+    serialize = True
+
+    clean_cache = _run_in_executor('clean_cache')
+    has_pending_actions = _run_in_executor('has_pending_actions')
+    has_actions = _run_in_executor('has_actions')
+    get_next_action = _run_in_executor('get_next_action')
+    add_action = _run_in_executor('add_action')
+    add_actions = _run_in_executor('add_actions')
+    remove_expired_actions = _run_in_executor('remove_expired_actions')
+    remove_action_by_id = _run_in_executor('remove_action_by_id')
+    claim_next_action = _run_in_executor('claim_next_action')
+    claim_actions = _run_in_executor('claim_actions')
+    release_action = _run_in_executor('release_action')
+    remove_claimed_action = _run_in_executor('remove_claimed_action')
+
+
+class AsyncProofingStateDB(AsyncBaseDB):
+    """
+    Non-blocking version of eduid_userdb.proofing.proofingdb.ProofingStateDB
+    (e.g. LetterProofingStateDB or OidcProofingStateDB).
+
+    :type db: eduid_userdb.proofing.proofingdb.ProofingStateDB
+    """
+
+    get_state_by_user_id = _run_in_executor('get_state_by_user_id')
+    get_state_by_eppn = _run_in_executor('get_state_by_eppn')
+    save = _run_in_executor('save')
+    remove_state = _run_in_executor('remove_state')
+
+
+class AsyncOidcProofingStateDB(AsyncProofingStateDB):
+    """
+    Non-blocking version of eduid_userdb.proofing.proofingdb.OidcProofingStateDB.
+
+    :type db: eduid_userdb.proofing.proofingdb.OidcProofingStateDB
+    """
+
+    get_state_by_oidc_state = _run_in_executor('get_state_by_oidc_state')
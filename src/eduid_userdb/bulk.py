@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk saving of users, for use with eduid_userdb.userdb.UserDB.
+
+Saving a large number of users one at a time with UserDB.save() costs (at least) one
+database round trip per user. The BulkUserWriter instead queues the writes and sends them
+to the database as unordered bulk operations:
+
+    with BulkUserWriter(userdb, flush_size=500) as writer:
+        for user in userdb.iter_users():
+            user.entitlements.append('urn:example:entitlement')
+            writer.save(user)
+    for user in writer.result.out_of_sync:
+        ...
+
+Users that have been modified in the database since they were loaded are not saved
+(like UserDB.save() with check_sync=True), but rather than raising UserOutOfSync they
+are collected in the result.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import logging
+
+import bson
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from eduid_userdb.user import User
+from eduid_userdb.util import naive_utc
+
+logger = logging.getLogger(__name__)
+
+INSERTED = 'inserted'
+UPDATED = 'updated'
+OUT_OF_SYNC = 'out_of_sync'
+FAILED = 'failed'
+
+
+class BulkSaveResult(object):
+    """
+    Outcome of saving users with a BulkUserWriter.
+
+    :ivar outcomes: user_id -> INSERTED, UPDATED, OUT_OF_SYNC or FAILED
+    :ivar out_of_sync: Users not saved because they had been modified in the database
+    :ivar errors: user_id -> error message from the database, for users that failed
+    :ivar flushes: Number of bulk operations sent to the database
+    """
+
+    def __init__(self):
+        self.outcomes = {}
+        self.out_of_sync = []
+        self.errors = {}
+        self.flushes = 0
+
+    def __repr__(self):
+        return '<eduID {!s}: {!s}>'.format(self.__class__.__name__, self.counts())
+
+    def counts(self):
+        """
+        :return: Number of users with each outcome
+        :rtype: dict
+        """
+        res = {INSERTED: 0, UPDATED: 0, OUT_OF_SYNC: 0, FAILED: 0}
+        for outcome in self.outcomes.values():
+            res[outcome] += 1
+        return res
+
+
+class BulkUserWriter(object):
+    """
+    Save users to a UserDB using unordered bulk operations.
+
+    Queued writes are sent to the database when `flush_size' users are queued, when the
+    queued documents add up to more than `max_bytes' bytes, when flush() is called or
+    when the writer is used as a context manager and the block is exited. If the block
+    is exited with an exception, the queued writes are discarded (see discard()).
+
+    The users are saved with modified_ts truncated to milliseconds (the precision of
+    timestamps in MongoDB). When check_sync is set, and not all guarded writes matched
+    a document, the users whose modified_ts in the database isn't exactly the one they
+    were saved with are considered out of sync. This includes users saved by this writer
+    but modified again by someone else before the check.
+
+    :param userdb: Database to save users in
+    :param check_sync: Ensure the users haven't been updated in the database since they were loaded
+    :param old_format: Save the users in legacy format in the database
+    :param flush_size: Maximum number of users in each bulk operation
+    :param max_bytes: Maximum (BSON encoded) size of the queued documents
+
+    :type userdb: eduid_userdb.userdb.UserDB
+    :type check_sync: bool
+    :type old_format: bool
+    :type flush_size: int
+    :type max_bytes: int
+    """
+
+    def __init__(self, userdb, check_sync=True, old_format=False, flush_size=500, max_bytes=8 * 1024 * 1024):
+        if flush_size < 1:
+            raise ValueError('flush_size must be at least 1')
+        self._userdb = userdb
+        self.check_sync = check_sync
+        self.old_format = old_format
+        self.flush_size = flush_size
+        self.max_bytes = max_bytes
+        self.result = BulkSaveResult()
+        self._queue = []  # (user, document, modified_ts when loaded)
+        self._queued_bytes = 0
+
+    def __repr__(self):
+        return '<eduID {!s}: {!s} queued for {!s}>'.format(self.__class__.__name__,
+                                                           len(self._queue),
+                                                           self._userdb)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def save(self, user):
+        """
+        Queue a user to be saved.
+
+        Like UserDB.save(), this updates the users modified_ts.
+
+        :param user: UserClass object
+        :type user: UserClass
+        """
+        assert isinstance(user.user_id, ObjectId)
+        if self._userdb.cache is not None:
+            self._userdb.cache.invalidate(user.user_id)
+        modified = user.modified_ts
+        user.modified_ts = _utcnow_ms()  # update to current time
+        doc = user.to_dict(old_userdb_format=self.old_format)
+        self._queue.append((user, doc, modified))
+        self._queued_bytes += len(bson.BSON.encode(doc))
+        if len(self._queue) >= self.flush_size or self._queued_bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Send all queued writes to the database.
+
+        :return: The result so far
+        :rtype: BulkSaveResult
+        """
+        if not self._queue:
+            return self.result
+        queue, self._queue, self._queued_bytes = self._queue, [], 0
+
+        bulk = self._userdb._coll.initialize_unordered_bulk_op()
+        for user, doc, modified in queue:
+            if modified is None:
+                # profile has never been modified through the dashboard.
+                # possibly just created in signup.
+                bulk.insert(doc)
+            else:
+                test_doc = {'_id': user.user_id}
+                if self.check_sync:
+                    test_doc['modified_ts'] = modified
+                    bulk.find(test_doc).replace_one(doc)
+                else:
+                    bulk.find(test_doc).upsert().replace_one(doc)
+        try:
+            res = bulk.execute()
+        except BulkWriteError as exc:
+            res = exc.details
+        self.result.flushes += 1
+
+        failed = {}
+        for error in res.get('writeErrors', []):
+            user = queue[error['index']][0]
+            failed[user.user_id] = error.get('errmsg')
+        guarded = [user for user, _doc, modified in queue
+                   if modified is not None and self.check_sync and user.user_id not in failed]
+        stale = set()
+        if res.get('nMatched', 0) < len(guarded):
+            stale = self._find_stale(guarded)
+
+        for user, doc, modified in queue:
+            if user.user_id in failed:
+                outcome = FAILED
+                self.result.errors[user.user_id] = failed[user.user_id]
+            elif user.user_id in stale:
+                outcome = OUT_OF_SYNC
+                self.result.out_of_sync.append(user)
+            elif modified is None:
+                outcome = INSERTED
+            else:
+                outcome = UPDATED
+            self.result.outcomes[user.user_id] = outcome
+            if outcome in [INSERTED, UPDATED] and isinstance(user, User):
+                user._set_unchanged(doc.keys(), track_changes=self._userdb._tracks_changes())
+
+        logger.debug("{!s} Saved {!s} users in {!r}: {!r}".format(self, len(queue), self._userdb._coll_name, res))
+        if self._userdb.cache is not None:
+            for user, _doc, _modified in queue:
+                self._userdb.cache.invalidate(user.user_id)
+        return self.result
+
+    def discard(self):
+        """
+        Discard all queued writes, restoring the modified_ts the users had before they were queued.
+        """
+        for user, _doc, modified in self._queue:
+            if modified is None:
+                user._data.pop('modified_ts', None)
+            else:
+                user.modified_ts = modified
+        if self._queue:
+            logger.debug("{!s} Discarded {!s} queued users".format(self, len(self._queue)))
+        self._queue, self._queued_bytes = [], 0
+
+    def _find_stale(self, users):
+        """
+        Find out which of a number of users whose updates were guarded by modified_ts were not updated.
+
+        The updated users have exactly the modified_ts the writer set on the user object in the database.
+
+        :param users: Users whose update was guarded by modified_ts
+        :type users: [UserClass]
+
+        :return: user_ids of the users not updated
+        :rtype: set
+        """
+        expected = dict((user.user_id, naive_utc(user.modified_ts)) for user in users)
+        stale = set(expected.keys())
+        docs = self._userdb._coll.find({'_id': {'$in': list(stale)}}, {'modified_ts': True})
+        for doc in docs:
+            db_ts = doc.get('modified_ts')
+            if db_ts is None:
+                continue
+            if naive_utc(db_ts) == expected[doc['_id']]:
+                stale.discard(doc['_id'])
+        for user_id in stale:
+            logger.debug("{!s} FAILED Updating user {!s} in {!r}, modified in db".format(
+                self, user_id, self._userdb._coll_name))
+        return stale
+
+
+def _utcnow_ms():
+    """
+    Get the current time, truncated to the millisecond precision timestamps are stored with in MongoDB.
+
+    :rtype: datetime.datetime
+    """
+    now = datetime.datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Read-through cache of user documents, for use with eduid_userdb.userdb.UserDB.
+
+Applications looking up the same user many times in a short period of time (like the IdP
+during a login) can avoid a database query for all but the first lookup.
+
+    userdb = UserDB(db_uri, 'eduid_am', cache=UserCache(max_size=5000, ttl=30))
+"""
+
+from __future__ import absolute_import
+
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+
+class UserCache(object):
+    """
+    Bounded (LRU) cache of user documents, with a time to live for each entry.
+
+    Documents are keyed by their _id. Secondary keys (aliases) such as ('eppn', 'hubba-bubba')
+    can be registered for an entry, and are forgotten when the entry is removed from the cache.
+
+    Documents are copied both when they are stored and when they are returned, so callers
+    can't corrupt the cached data.
+
+    :param max_size: Maximum number of documents to keep in the cache
+    :param ttl: Number of seconds a document is valid after it has been stored
+    :param timer: Function returning current time in seconds (for tests)
+
+    :type max_size: int
+    :type ttl: int | float
+    :type timer: callable
+    """
+
+    def __init__(self, max_size=1000, ttl=60, timer=time.time):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.max_size = max_size
+        self.ttl = ttl
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # _id -> (expires, doc, aliases), least recently used first
+        self._aliases = {}  # alias -> _id
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __repr__(self):
+        return '<eduID {!s}: {!s}/{!s} entries, ttl {!s}>'.format(self.__class__.__name__,
+                                                                   len(self._entries),
+                                                                   self.max_size,
+                                                                   self.ttl)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id):
+        """
+        Get a copy of a cached user document.
+
+        :param user_id: User identifier
+        :type user_id: bson.ObjectId
+
+        :return: User document, or None if not found in cache
+        :rtype: dict | None
+        """
+        with self._lock:
+            return self._get(user_id)
+
+    def get_by_alias(self, alias):
+        """
+        Get a copy of a cached user document using a secondary key.
+
+        :param alias: Secondary key, like ('eppn', 'hubba-bubba')
+        :type alias: tuple
+
+        :return: User document, or None if not found in cache
+        :rtype: dict | None
+        """
+        with self._lock:
+            user_id = self._aliases.get(alias)
+            if user_id is None:
+                self.misses += 1
+                return None
+            return self._get(user_id)
+
+    def put(self, doc, aliases=None):
+        """
+        Store a user document in the cache.
+
+        The document's eduPersonPrincipalName is always registered as an alias.
+
+        :param doc: User document, as fetched from the database
+        :param aliases: Secondary keys to register for this document
+
+        :type doc: dict
+        :type aliases: [tuple] | None
+        """
+        user_id = doc['_id']
+        _aliases = set(aliases or [])
+        if doc.get('eduPersonPrincipalName'):
+            _aliases.add(('eppn', doc['eduPersonPrincipalName']))
+        entry = (self._timer() + self.ttl, copy.deepcopy(doc), _aliases)
+        with self._lock:
+            old = self._entries.pop(user_id, None)
+            if old is not None:
+                _aliases.update(old[2])
+            self._entries[user_id] = entry
+            for this in _aliases:
+                self._aliases[this] = user_id
+            while len(self._entries) > self.max_size:
+                old_id, old_entry = self._entries.popitem(last=False)
+                self._forget_aliases(old_id, old_entry)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        """
+        Remove a user from the cache, typically because it was modified in the database.
+
+        :param user_id: User identifier
+        :type user_id: bson.ObjectId
+        """
+        with self._lock:
+            self._remove(user_id)
+
+    def clear(self):
+        """
+        Remove all entries from the cache. The counters are left as they are.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._aliases.clear()
+
+    def stats(self):
+        """
+        :return: Cache statistics
+        :rtype: dict
+        """
+        with self._lock:
+            return {'size': len(self._entries),
+                    'max_size': self.max_size,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    }
+
+    def _get(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry[0] <= self._timer():
+            self._forget_aliases(user_id, entry)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        # re-insert to mark entry as most recently used
+        self._entries[user_id] = entry
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._forget_aliases(user_id, entry)
+
+    def _forget_aliases(self, user_id, entry):
+        for this in entry[2]:
+            if self._aliases.get(this) == user_id:
+                del self._aliases[this]
@@ -50,9 +50,10 @@ class DashboardUser(User):
     Subclass of eduid_userdb.User with eduid Dashboard application specific data.
     """
 
-    def __init__(self, userid = None, eppn = None, subject = 'physical person', data = None):
+    def __init__(self, userid = None, eppn = None, subject = 'physical person', data = None, copy_data = True):
         data_in = data
-        data = copy.copy(data_in)  # to not modify callers data
+        if copy_data:
+            data = copy.copy(data_in)  # to not modify callers data
 
         if data is None:
             if userid is None:
@@ -62,7 +63,7 @@ class DashboardUser(User):
                         subject = subject,
                         )
 
-        User.__init__(self, data = data)
+        User.__init__(self, data = data, copy_data = copy_data)
 
     def add_letter_proofing_data(self, data):
         """
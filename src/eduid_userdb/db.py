@@ -1,15 +1,35 @@
+import os
 import copy
+import time
+import itertools
+import threading
 import pymongo
 import logging
 from .exceptions import (DocumentDoesNotExist, MultipleDocumentsReturned,
                         MongoConnectionError)
+from .indexes import reconcile_indexes
+from . import instrumentation
+
+# Process wide registry of pymongo clients, shared by all MongoDB instances using the same
+# URI and options. Maps the key from _client_key() to [client, number of references,
+# authentication cache].
+_clients = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+_auth_count = 0
 
 
 class MongoDB(object):
-    """Simple wrapper to get pymongo real objects from the settings uri"""
+    """
+    Simple wrapper to get pymongo real objects from the settings uri
+
+    Unless `shared' is False, the pymongo client (with its connection pool and monitor
+    threads) is shared with all other MongoDB instances in the process using the same
+    URI and options. The client is closed when the last of them calls close().
+    """
 
     def __init__(self, db_uri, db_name=None,
-                 connection_factory=None, **kwargs):
+                 connection_factory=None, shared=True, **kwargs):
 
         if db_uri is None:
             raise ValueError('db_uri not supplied')
@@ -43,13 +63,16 @@ class MongoDB(object):
 
         self._db_uri = _format_mongodb_uri(self._parsed_uri)
 
-        try:
-            self._connection = connection_factory(
-                host=self._db_uri,
-                tz_aware=True,
-                **kwargs)
-        except pymongo.errors.ConnectionFailure as e:
-            raise MongoConnectionError('Error connecting to mongo: ' + str(e))
+        self._connection_factory = connection_factory
+        self._connection_kwargs = kwargs
+        self._client_key = None
+        if shared:
+            self._client_key = _client_key(connection_factory, self._parsed_uri, kwargs)
+        self._connection = None
+        self._auth_cache = None
+        self.authentications = 0
+        self._pid = os.getpid()
+        self._connect()
 
     def __repr__(self):
         return '<eduID {!s}: {!s} {!s}>'.format(self.__class__.__name__,
@@ -71,11 +94,39 @@ class MongoDB(object):
             self._sanitized_uri = _format_mongodb_uri(_parsed)
         return self._sanitized_uri
 
+    def _connect(self):
+        """
+        Get a pymongo client, from the registry unless this instance is not shared.
+
+        The authentication cache belongs to the client, so a new client always starts
+        out unauthenticated.
+        """
+        try:
+            if self._client_key is None:
+                self._connection = self._connection_factory(host=self._db_uri, tz_aware=True,
+                                                            **self._connection_kwargs)
+                self._auth_cache = {}
+            else:
+                self._connection, self._auth_cache = _acquire_client(self._client_key, self._connection_factory,
+                                                                     self._db_uri, self._connection_kwargs)
+        except pymongo.errors.ConnectionFailure as e:
+            raise MongoConnectionError('Error connecting to mongo: ' + str(e))
+
     def get_connection(self):
         """
         Get the raw pymongo connection object.
+
+        pymongo clients must not be used in both the parent and the child of an os.fork(),
+        so a new client is created the first time this is called in a child process, or
+        after close().
+
         :return: Pymongo connection object
         """
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._connect()
+        elif self._connection is None:
+            self._connect()
         return self._connection
 
     def get_database(self, database_name=None, username=None, password=None):
@@ -85,6 +136,10 @@ class MongoDB(object):
         Authenticates using the username/password in the DB URI given to
         __init__() unless username/password is supplied as arguments.
 
+        Pymongo re-authenticates new sockets using the credentials it has cached
+        once authenticated, so each username is only authenticated once per database
+        and client.
+
         :param database_name: (optional) Name of database
         :param username: (optional) Username to login with
         :param password: (optional) Password to login with
@@ -94,16 +149,43 @@ class MongoDB(object):
             database_name = self._database_name
         if database_name is None:
             raise ValueError('No database_name supplied, and no default provided to __init__')
-        db = self._connection[database_name]
+        db = self.get_connection()[database_name]
         if username and password:
-            db.authenticate(username, password)
+            self._authenticate(db, database_name, username, password)
         elif self._parsed_uri.get("username", None):
-            db.authenticate(
-                self._parsed_uri.get("username", None),
-                self._parsed_uri.get("password", None)
-            )
+            self._authenticate(db, database_name,
+                               self._parsed_uri.get("username", None),
+                               self._parsed_uri.get("password", None)
+                               )
         return db
 
+    def _authenticate(self, db, database_name, username, password):
+        """
+        Authenticate to a database, unless already done with the same credentials.
+
+        :param db: Pymongo database object
+        :param database_name: Name of database
+        :param username: Username to login with
+        :param password: Password to login with
+        """
+        global _auth_count
+        key = (database_name, username)
+        if key in self._auth_cache and self._auth_cache[key] == password:
+            return
+        db.authenticate(username, password)
+        self._auth_cache[key] = password
+        self.authentications += 1
+        with _clients_lock:
+            _auth_count += 1
+
+    def reset_authentication(self):
+        """
+        Forget about the authentications made, so that the next get_database() authenticates again.
+
+        Useful if the server has for some reason lost the authentication of the connections.
+        """
+        self._auth_cache.clear()
+
     def get_collection(self, collection, database_name=None, username=None, password=None):
         """
         Get a pymongo collection handle.
@@ -118,7 +200,148 @@ class MongoDB(object):
         return _db[collection]
 
     def close(self):
-        self._connection.close()
+        """
+        Close the pymongo client, or release this instance's reference to a shared client.
+        """
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        if self._client_key is None:
+            connection.close()
+        elif self._pid == os.getpid():
+            _release_client(self._client_key, connection)
+
+
+def _client_key(connection_factory, parsed_uri, kwargs):
+    """
+    Get the key for a pymongo client in the registry.
+
+    The key is made from the parts of a parsed URI that matter to the client (the database
+    only matters if there are credentials in the URI, since they authenticate against it)
+    together with the connection factory and the keyword arguments to it.
+
+    :param connection_factory: Pymongo client class
+    :param parsed_uri: Result of pymongo.uri_parser.parse_uri
+    :param kwargs: Keyword arguments for the connection factory
+
+    :type parsed_uri: dict
+    :type kwargs: dict
+
+    :rtype: tuple
+    """
+    database = None
+    if parsed_uri.get('username'):
+        database = parsed_uri.get('database')
+    options = [(key, repr(value)) for key, value in (parsed_uri.get('options') or {}).items()]
+    return (connection_factory,
+            tuple(sorted(parsed_uri.get('nodelist'))),
+            parsed_uri.get('username'),
+            parsed_uri.get('password'),
+            database,
+            tuple(sorted(options)),
+            tuple(sorted([(key, repr(value)) for key, value in kwargs.items()])),
+            )
+
+
+def _check_fork():
+    """
+    Forget about the clients created in the parent process after an os.fork().
+
+    The clients are not closed, since their sockets are still used by the parent.
+    Must be called with _clients_lock held.
+    """
+    global _clients_pid
+    if _clients_pid != os.getpid():
+        _clients.clear()
+        _clients_pid = os.getpid()
+
+
+def _acquire_client(key, connection_factory, db_uri, kwargs):
+    """
+    Get a pymongo client from the registry, creating it if necessary.
+
+    :param key: Registry key from _client_key()
+    :param connection_factory: Pymongo client class
+    :param db_uri: URI to connect to
+    :param kwargs: Keyword arguments for the connection factory
+
+    :type key: tuple
+    :type db_uri: str | unicode
+    :type kwargs: dict
+
+    :return: Pymongo client and its authentication cache
+    :rtype: (pymongo.MongoClient, dict)
+    """
+    with _clients_lock:
+        _check_fork()
+        entry = _clients.get(key)
+        if entry is None:
+            entry = [connection_factory(host=db_uri, tz_aware=True, **kwargs), 0, {}]
+            _clients[key] = entry
+        entry[1] += 1
+        return entry[0], entry[2]
+
+
+def _release_client(key, client):
+    """
+    Release a reference to a pymongo client in the registry, and close it if it was the last one.
+
+    :param key: Registry key from _client_key()
+    :param client: Pymongo client
+
+    :type key: tuple
+    """
+    with _clients_lock:
+        _check_fork()
+        entry = _clients.get(key)
+        if entry is None or entry[0] is not client:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _clients[key]
+    client.close()
+
+
+def _count_sockets(client):
+    """
+    Count the sockets in the connection pools of a pymongo client.
+
+    Pymongo doesn't expose this, so it is looked up in the internals of the pymongo 2.x clients.
+
+    :param client: Pymongo client
+
+    :return: Number of sockets, or None if unknown
+    :rtype: int | None
+    """
+    member = getattr(client, '_MongoClient__member', None)
+    if member is not None:
+        return len(member.pool.sockets)
+    rs_state = getattr(client, '_MongoReplicaSetClient__rs_state', None)
+    if rs_state is not None:
+        return sum([len(member.pool.sockets) for member in rs_state.members])
+    return None
+
+
+def get_client_stats():
+    """
+    Get statistics about the pymongo clients shared between MongoDB instances in this process.
+
+    :return: Number of open clients, references to them, sockets in their connection pools
+             and authentications performed (by all MongoDB instances)
+    :rtype: dict
+    """
+    with _clients_lock:
+        _check_fork()
+        entries = _clients.values()
+        res = {'clients': len(entries),
+               'references': sum([refs for _client, refs, _auth_cache in entries]),
+               'sockets': 0,
+               'authentications': _auth_count,
+               }
+    for client, _refs, _auth_cache in entries:
+        res['sockets'] += _count_sockets(client) or 0
+    return res
 
 
 def _format_mongodb_uri(parsed_uri):
@@ -169,6 +392,13 @@ def _format_mongodb_uri(parsed_uri):
 class BaseDB(object):
     """ Base class for common db operations """
 
+    # Indexes needed by the queries of the class, see eduid_userdb.indexes
+    indexes = {}
+    # Record slow queries here (a eduid_userdb.slowlog.SlowQueryLog)
+    slow_query_log = None
+    # Fields with a unique index in the database, see _has_unique_index()
+    _unique_indexes = None
+
     def __init__(self, db_uri, db_name, collection):
 
         self._db_uri = db_uri
@@ -176,6 +406,30 @@ class BaseDB(object):
         self._db = MongoDB(db_uri, db_name=db_name)
         self._coll = self._db.get_collection(collection)
 
+    @property
+    def _coll(self):
+        """
+        The pymongo collection, using the client of the current process.
+
+        pymongo clients must not be used in both the parent and the child of an os.fork(),
+        so the collection is looked up again (through MongoDB.get_connection(), which
+        reconnects) the first time it is used in a child process.
+
+        :rtype: pymongo.collection.Collection
+        """
+        if self._coll_pid != os.getpid():
+            self._collection = self._db.get_collection(self._coll_name)
+            self._coll_pid = os.getpid()
+        return self._collection
+
+    @_coll.setter
+    def _coll(self, value):
+        """
+        Use another collection (or a wrapper around it) in the current process.
+        """
+        self._collection = value
+        self._coll_pid = os.getpid()
+
     def __repr__(self):
         return '<eduID {!s}: {!s} {!r}>'.format(self.__class__.__name__,
                                                 self._db.sanitized_uri,
@@ -200,6 +454,56 @@ class BaseDB(object):
         """
         return self._coll.find({})
 
+    def _iter_documents(self, spec=None, fields=None, batch_size=1000, after_id=None):
+        """
+        Go through all documents matching a search filter, in _id order.
+
+        The documents are fetched one page of `batch_size' documents at a time, each page with
+        a query for documents with an _id greater than the last one already returned. No more
+        than one page is held in memory, and no server side cursor is kept open between pages.
+
+        To resume an interrupted scan, pass the _id of the last document processed as `after_id'.
+
+        :param spec: the search filter (default all documents)
+        :param fields: the fields to return in the search result (_id is always included)
+        :param batch_size: Number of documents to fetch in each query
+        :param after_id: Only return documents with an _id greater than this
+
+        :type spec: dict | None
+        :type fields: dict | [str] | None
+        :type batch_size: int
+        :type after_id: bson.ObjectId | None
+
+        :return: Generator yielding documents
+        :rtype: collections.Iterator
+        """
+        if batch_size < 1:
+            raise ValueError('batch_size must be at least 1')
+        if isinstance(fields, dict):
+            fields = dict(fields)
+            fields.pop('_id', None)  # _id is needed to fetch the next page
+        elif fields is not None:
+            fields = list(fields) + ['_id']
+        while True:
+            page_spec = dict(spec or {})
+            if after_id is not None:
+                if '_id' in page_spec:
+                    page_spec = {'$and': [page_spec, {'_id': {'$gt': after_id}}]}
+                else:
+                    page_spec['_id'] = {'$gt': after_id}
+            if fields is None:
+                cursor = self._coll.find(page_spec)
+            else:
+                cursor = self._coll.find(page_spec, fields)
+            docs = list(cursor.sort('_id', pymongo.ASCENDING).limit(batch_size).batch_size(batch_size))
+            if not docs:
+                return
+            after_id = docs[-1]['_id']
+            for doc in docs:
+                yield doc
+            if len(docs) < batch_size:
+                return
+
     def _get_document_by_attr(self, attr, value, raise_on_missing=True):
         """
         Return the document in the MongoDB matching field=value
@@ -213,15 +517,125 @@ class BaseDB(object):
         :return: A document dict
         :rtype: dict | None
         """
-        docs = self._coll.find({attr: value})
-        if docs.count() == 0:
+        docs = self._find_unique({attr: value})
+        if len(docs) == 0:
             if raise_on_missing:
                 raise DocumentDoesNotExist("No document matching %s='%s'" % (attr, value))
             return None
-        elif docs.count() > 1:
+        elif len(docs) > 1:
             raise MultipleDocumentsReturned("Multiple matching documents for %s='%s'" % (attr, value))
         return docs[0]
 
+    def _get_document_by_filter(self, spec, fields=None, raise_on_missing=True):
+        """
+        Locate a single document in the db using a custom search filter.
+
+        :param spec: the search filter
+        :type spec: dict
+        :param fields: the fields to return in the search result
+        :type fields: dict | None
+        :param raise_on_missing:  If True, raise exception if no matching document can be found.
+        :type raise_on_missing: bool
+        :return: A document dict
+        :rtype: dict | None
+        :raise DocumentDoesNotExist: No document matching the search criteria
+        :raise MultipleDocumentsReturned: More than one document matches the search criteria
+        """
+        docs = self._find_unique(spec, fields)
+        if len(docs) == 0:
+            if raise_on_missing:
+                raise DocumentDoesNotExist('No document matching {!s}'.format(spec))
+            return None
+        elif len(docs) > 1:
+            raise MultipleDocumentsReturned('Multiple matching documents for {!s}'.format(spec))
+        return docs[0]
+
+    def _get_document_by_unique_attr(self, attr, value, raise_on_missing=True, fields=None):
+        """
+        Return the document in the MongoDB matching field=value, for a field with a unique index.
+
+        Since the server ensures there is at most one matching document, this is a
+        single find_one() without the check for multiple documents done by
+        _get_document_by_attr(). Until the unique index is found in the database (it might
+        not have been created yet, or an older version of it might not be unique), the
+        check for multiple documents is done anyway.
+
+        :param attr: The name of a field with a unique index
+        :param value: The field value
+        :param raise_on_missing: If True, raise exception if no matching document can be found.
+        :param fields: the fields to return in the search result
+
+        :type attr: str
+        :type value: str
+        :type raise_on_missing: bool
+        :type fields: dict | None
+
+        :return: A document dict
+        :rtype: dict | None
+        :raise DocumentDoesNotExist: No document matching the search criteria
+        :raise MultipleDocumentsReturned: More than one document matches the search criteria
+        """
+        spec = {attr: value}
+        if self._has_unique_index(attr):
+            start = time.time()
+            doc = self._coll.find_one(spec, fields)
+            if self.slow_query_log is not None:
+                self.slow_query_log.record(self._coll, spec, start)
+        else:
+            docs = self._find_unique(spec, fields)
+            if len(docs) > 1:
+                raise MultipleDocumentsReturned("Multiple matching documents for %s='%s'" % (attr, value))
+            doc = docs[0] if docs else None
+        if doc is None and raise_on_missing:
+            raise DocumentDoesNotExist("No document matching %s='%s'" % (attr, value))
+        return doc
+
+    def _has_unique_index(self, attr):
+        """
+        Check if the database has a unique index on a single field.
+
+        The indexes are looked up the first time this is called, and again after
+        reconcile_indexes() has been called.
+
+        :param attr: The name of a field
+        :type attr: str
+
+        :rtype: bool
+        """
+        unique = self._unique_indexes
+        if unique is None:
+            unique = set()
+            for info in self._coll.index_information().values():
+                if info.get('unique') and len(info['key']) == 1 and not info.get('partialFilterExpression'):
+                    unique.add(info['key'][0][0])
+            self._unique_indexes = unique
+        return attr in unique
+
+    def _find_unique(self, spec, fields=None):
+        """
+        Fetch the documents needed to decide if `spec' matches exactly one document.
+
+        At most two documents are returned, in a single round trip to the database,
+        which is enough to tell 'none', 'exactly one' and 'more than one' apart without
+        having to ask the server to count the matching documents first.
+
+        :param spec: the search filter
+        :type spec: dict
+        :param fields: the fields to return in the search result
+        :type fields: dict | None
+        :return: Zero, one or two documents
+        :rtype: [dict]
+        """
+        start = time.time()
+        if fields is None:
+            cursor = self._coll.find(spec)
+        else:
+            cursor = self._coll.find(spec, fields)
+        res = list(cursor.limit(2))
+        if self.slow_query_log is not None:
+            self.slow_query_log.record(self._coll, spec, start)
+        return res
+
     def _get_documents_by_attr(self, attr, value, raise_on_missing=True):
         """
         Return the document in the MongoDB matching field=value
@@ -255,16 +669,54 @@ class BaseDB(object):
         :rtype: cursor | []
         :raise DocumentDoesNotExist: No document matching the search criteria
         """
+        start = time.time()
         if fields is None:
             docs = self._coll.find(spec)
         else:
             docs = self._coll.find(spec, fields)
-        if docs.count() == 0:
+        count = docs.count()
+        if self.slow_query_log is not None:
+            self.slow_query_log.record(self._coll, spec, start)
+        if count == 0:
             if raise_on_missing:
                 raise DocumentDoesNotExist('No document matching {!s}'.format(spec))
             return []
         return docs
 
+    def _get_documents_by_values(self, attr, values, chunk_size=1000, fields=None):
+        """
+        Locate documents with any of a number of values for an attribute.
+
+        The values are looked up using one $in query for every `chunk_size' values,
+        so the values can be a generator producing more values than would fit in one query.
+
+        :param attr: The attribute to match on
+        :param values: The values to match on
+        :param chunk_size: Maximum number of values in each query
+        :param fields: the fields to return in the search result
+
+        :type attr: str | unicode
+        :type values: collections.Iterable
+        :type chunk_size: int
+        :type fields: dict | None
+
+        :return: Generator yielding (chunk of values, documents matching them)
+        :rtype: collections.Iterator
+        """
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be at least 1')
+        values = iter(values)
+        while True:
+            chunk = list(itertools.islice(values, chunk_size))
+            if not chunk:
+                return
+            spec = {attr: {'$in': chunk}}
+            if fields is None:
+                docs = self._coll.find(spec)
+            else:
+                docs = self._coll.find(spec, fields)
+            yield chunk, list(docs)
+
     def db_count(self):
         """
         Return number of entries in the database.
@@ -288,6 +740,9 @@ class BaseDB(object):
     def setup_indexes(self, indexes):
         """
         To update an index add a new item in indexes and remove the previous version.
+
+        Indexes not in `indexes' are dropped. See reconcile_indexes() for managing the indexes
+        declared for the class.
         """
         # indexes={'index-name': {'key': [('key', 1)], 'param1': True, 'param2': False}, }
         # http://docs.mongodb.org/manual/reference/method/db.collection.ensureIndex/
@@ -298,9 +753,48 @@ class BaseDB(object):
                 self._coll.drop_index(name)
         for name, params in indexes.items():
             if name not in current_indexes:
+                params = dict(params)
                 key = params.pop('key')
                 params['name'] = name
-                self._coll.ensure_index(key, **params)
+                self._coll.create_index(key, **params)
+
+    def reconcile_indexes(self, dry_run=False, drop_unknown=False):
+        """
+        Create the missing indexes declared in `indexes', and report any differences.
+
+        See eduid_userdb.indexes.reconcile_indexes().
+
+        :param dry_run: Only report, don't modify the database
+        :param drop_unknown: Drop indexes in the database that are not declared
+
+        :type dry_run: bool
+        :type drop_unknown: bool
+
+        :rtype: eduid_userdb.indexes.IndexReport
+        """
+        report = reconcile_indexes(self._coll, self.indexes, dry_run=dry_run, drop_unknown=drop_unknown)
+        # look up the unique indexes again, see _has_unique_index()
+        self._unique_indexes = None
+        return report
+
+    def instrument(self, sink, measure_bytes=False):
+        """
+        Record measurements of every call to the public methods of this object in `sink'.
+
+        See eduid_userdb.instrumentation.
+
+        :param sink: Object with a record(MethodCall) method, like instrumentation.MemorySink
+        :param measure_bytes: Measure the BSON size of the documents returned
+
+        :type measure_bytes: bool
+        """
+        instrumentation.instrument(self, sink, measure_bytes=measure_bytes)
+
+    def uninstrument(self):
+        """
+        Stop recording measurements.
+        """
+        instrumentation.uninstrument(self)
 
     def close(self):
         self._db.close()
@@ -36,6 +36,7 @@ __author__ = 'ft'
 
 import copy
 import datetime
+import weakref
 
 from eduid_userdb.exceptions import EduIDUserDBError, UserHasUnknownData, UserDBValueError
 
@@ -85,6 +86,9 @@ class Element(object):
         created_by
         created_ts
     """
+    # Weak references to the ElementLists holding this element, see _changed()
+    _list_refs = ()
+
     def __init__(self, data):
         if not isinstance(data, dict):
             raise UserDBValueError("Invalid 'data', not dict ({!r})".format(type(data)))
@@ -96,6 +100,12 @@ class Element(object):
     def __repr__(self):
         return '<eduID {!s}: {!r}>'.format(self.__class__.__name__, self._data)
 
+    def __getstate__(self):
+        # Weak references can't be pickled or copied, the lists register again in __setstate__
+        state = self.__dict__.copy()
+        state.pop('_list_refs', None)
+        return state
+
     # -----------------------------------------------------------------
     @property
     def key(self):
@@ -105,6 +115,20 @@ class Element(object):
         """
         raise NotImplementedError("'key' not implemented for Element subclass")
 
+    def _changed(self, key=False):
+        """
+        Tell the ElementLists holding this element that it has been changed.
+
+        Called by the setters of the key, and of the primary and verified status.
+
+        :param key: True if the key of the element was changed
+        :type key: bool
+        """
+        for ref in self._list_refs:
+            _list = ref()
+            if _list is not None:
+                _list._element_changed(key)
+
     # -----------------------------------------------------------------
     @property
     def created_by(self):
@@ -300,6 +324,7 @@ class PrimaryElement(VerifiedElement):
         if not isinstance(value, bool):
             raise UserDBValueError("Invalid 'is_primary': {!r}".format(value))
         self._data['primary'] = value
+        self._changed()
 
     # -----------------------------------------------------------------
     @property
@@ -319,6 +344,7 @@ class PrimaryElement(VerifiedElement):
         if value is False and self.is_primary:
             raise PrimaryElementViolation("Can't remove verified status of primary element")
         VerifiedElement.is_verified.fset(self, value)
+        self._changed()
 
 
 class ElementList(object):
@@ -327,6 +353,11 @@ class ElementList(object):
 
     Provide methods to find, add and remove elements from the list.
 
+    The elements are indexed by their key, so find() does not have to go through
+    the whole list. The elements tell the lists holding them when their key is changed,
+    and changes to the list returned by to_list() are noticed by the next find(), which
+    then rebuilds the index.
+
     :param elements: List of elements
     :type elements: [dict | Element]
     """
@@ -334,17 +365,35 @@ class ElementList(object):
         for this in elements:
             if not isinstance(this, Element):
                 raise ValueError("Not an Element")
-        self._elements = elements
+        # Copy the list, so that only the list returned by to_list() can be modified behind our back
+        self._elements = list(elements)
+        # True when someone else might hold a reference to self._elements and modify it
+        self._exposed = False
+        self._generation = 0
+        self._ref = weakref.ref(self)
+        self._reindex()
 
     def __repr__(self):
         return '<eduID {!s}: {!r}>'.format(self.__class__.__name__, self._elements)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for this in ['_ref', '_index', '_duplicate_keys', '_indexed_elements']:
+            del state[this]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ref = weakref.ref(self)
+        self._reindex()
+
     def to_list(self):
         """
         Return the list of elements as an iterable.
         :return: List of elements
         :rtype: [Element]
         """
+        self._exposed = True
         return self._elements
 
     def to_list_of_dicts(self, old_userdb_format=False):
@@ -367,12 +416,14 @@ class ElementList(object):
         :return: Element found, or False if none was found
         :rtype: Element | False
         """
-        res = [x for x in self._elements if x.key == key]
-        if len(res) == 1:
-            return res[0]
-        if len(res) > 1:
+        if self._index_stale or self._elements_modified():
+            self._reindex()
+        if key in self._duplicate_keys:
             raise EduIDUserDBError("More than one element found")
-        return False
+        res = self._index.get(key)
+        if res is None:
+            return False
+        return res
 
     def add(self, element):
         """
@@ -386,6 +437,8 @@ class ElementList(object):
             raise UserDBValueError("Invalid element: {!r}".format(element))
 
         self._elements.append(element)
+        self._indexed_elements.append(element)
+        self._index_element(element)
         return self
 
     def remove(self, key):
@@ -399,7 +452,14 @@ class ElementList(object):
         if not match:
             raise UserDBValueError("Element not found in list")
 
-        self._elements = [this for this in self._elements if this != match]
+        # Build a new list rather than modifying the one returned by to_list(), which the caller
+        # might be iterating over
+        elements = list(self._elements)
+        elements.remove(match)
+        self._elements = elements
+        self._exposed = False
+        self._indexed_elements = list(elements)
+        del self._index[match.key]
         return self
 
     @property
@@ -409,6 +469,46 @@ class ElementList(object):
         """
         return len(self._elements)
 
+    def _reindex(self):
+        """
+        (Re-)build the index of elements by key.
+        """
+        self._index = {}
+        self._duplicate_keys = set()
+        self._index_stale = False
+        for this in self._elements:
+            self._index_element(this)
+        self._indexed_elements = list(self._elements)
+
+    def _elements_modified(self):
+        """
+        :return: True if self._elements was modified by someone else since it was indexed
+        :rtype: bool
+        """
+        # Comparing the lists only compares the identity of the (unmodified) elements
+        return self._exposed and self._elements != self._indexed_elements
+
+    def _index_element(self, element):
+        key = element.key
+        if key in self._index:
+            self._duplicate_keys.add(key)
+        else:
+            self._index[key] = element
+        if self._ref not in element._list_refs:
+            # a new list, since copies of the element share the old one
+            element._list_refs = [ref for ref in element._list_refs if ref() is not None] + [self._ref]
+
+    def _element_changed(self, key):
+        """
+        Called by the elements in the list when they are changed (see Element._changed()).
+
+        :param key: True if the key of the element was changed
+        :type key: bool
+        """
+        self._generation += 1
+        if key:
+            self._index_stale = True
+
 
 class PrimaryElementList(ElementList):
     """
@@ -419,12 +519,17 @@ class PrimaryElementList(ElementList):
     one primary element in the list (except if the list is empty or there are
     no confirmed elements).
 
+    The primary element is cached between operations, until the primary or verified status
+    of any element in the list is changed.
+
     :param elements: List of elements
     :type elements: [dict | Element]
     """
     def __init__(self, elements):
-        self._get_primary(elements)
+        self._primary_generation = None
+        primary = self._get_primary(elements)
         ElementList.__init__(self, elements)
+        self._set_cached_primary(primary, self._generation)
 
     def add(self, element):
         """
@@ -446,6 +551,18 @@ class PrimaryElementList(ElementList):
         if self.find(element.key):
             raise DuplicateElementViolation("Element {!s} already in list".format(element.key))
 
+        if self._primary_is_cached():
+            # The list is known to be consistent, so only the new element has to be checked
+            primary = self._primary
+            if primary is not None and not (element.is_primary and element.is_verified):
+                ElementList.add(self, element)
+                return self
+            if primary is None and element.is_verified == element.is_primary:
+                ElementList.add(self, element)
+                if element.is_primary:
+                    self._set_cached_primary(element, self._primary_generation)
+                return self
+
         old_list = self._elements
         ElementList.add(self, element)
         self._check_primary(old_list)
@@ -462,6 +579,13 @@ class PrimaryElementList(ElementList):
         :type key: str | unicode
         :return: ElementList
         """
+        if self._primary_is_cached():
+            match = self.find(key)
+            if match and match is not self._primary:
+                # Removing an element that isn't the primary one can't make a consistent list inconsistent
+                ElementList.remove(self, key)
+                return self
+
         old_list = self._elements
         ElementList.remove(self, key)
         self._check_primary(old_list)
@@ -478,7 +602,12 @@ class PrimaryElementList(ElementList):
 
         :rtype: PrimaryElement
         """
-        return self._get_primary(self._elements)
+        if self._primary_is_cached():
+            return self._primary
+        generation = self._generation
+        primary = self._get_primary(self._elements)
+        self._set_cached_primary(primary, generation)
+        return primary
 
     @primary.setter
     def primary(self, key):
@@ -503,6 +632,7 @@ class PrimaryElementList(ElementList):
         # Go through the whole list. Mark element as primary and all other as *not* primary.
         for this in self._elements:
             this.is_primary = bool(this.key == key)
+        self._set_cached_primary(match, self._generation)
 
     def _check_primary(self, old_list):
         """
@@ -513,11 +643,15 @@ class PrimaryElementList(ElementList):
         :param old_list: list of elements to get back to if the constraints are violated
         :type old_list: list
         """
+        generation = self._generation
         try:
-            self._get_primary(self._elements)
+            primary = self._get_primary(self._elements)
         except PrimaryElementViolation:
             self._elements = copy.copy(old_list)
+            self._exposed = False
+            self._reindex()
             raise
+        self._set_cached_primary(primary, generation)
 
     def _get_primary(self, elements):
         """
@@ -543,6 +677,26 @@ class PrimaryElementList(ElementList):
                 len(res), len(elements)))
         return res[0]
 
+    def _primary_is_cached(self):
+        """
+        :return: True if self._primary is known to be the primary element of a consistent list
+        :rtype: bool
+        """
+        if self._elements_modified():
+            return False
+        return self._primary_generation == self._generation
+
+    def _set_cached_primary(self, primary, generation):
+        """
+        :param primary: Primary element (or None) of a consistent list
+        :param generation: Value of self._generation before the list was checked
+
+        :type primary: PrimaryElement | None
+        :type generation: int
+        """
+        self._primary = primary
+        self._primary_generation = generation
+
     @property
     def verified(self):
         """
@@ -123,6 +123,7 @@ class Event(Element):
         if not isinstance(value, ObjectId):
             raise UserDBValueError("Invalid 'id': {!r}".format(value))
         self._data['id'] = value
+        self._changed(key=True)
 
     # -----------------------------------------------------------------
     def to_dict(self, old_userdb_format=False, mixed_format=False):
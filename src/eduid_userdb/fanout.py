@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Run a number of independent database calls concurrently.
+
+Pages that look up data in several collections (like the support application, see
+eduid_userdb.support.db.SupportUserDetails) spend most of their time waiting for the database
+round trips. Running the lookups in a thread pool makes the total latency close to that of the
+slowest lookup instead of the sum of them all:
+
+    results = fan_out({'authn': partial(authninfo_db.get_authn_info, user_id),
+                       'actions': partial(actions_db.get_actions, user_id),
+                       }, timeout=5)
+    authn_info = results['authn'].get()
+
+The database objects share their pymongo client (see eduid_userdb.db.MongoDB), so the calls
+use sockets from the same connection pool.
+
+The calls run in a thread pool of their own rather than the one shared by eduid_userdb.aio, so
+that fan_out() can be used from calls running in that one. fan_out() can't be used from the
+calls it makes though, since they could end up waiting for each other to get a thread.
+"""
+
+from __future__ import absolute_import
+
+import os
+import time
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+# Set in the threads running calls made by fan_out()
+_local = threading.local()
+
+
+class CallResult(object):
+    """
+    The outcome of one of the calls made by fan_out().
+
+    :ivar name: Name of the call
+    :ivar result: Return value of the call
+    :ivar exception: Exception raised by the call, or None
+    :ivar timed_out: True if the call had not finished at the deadline
+    """
+
+    def __init__(self, name, result=None, exception=None, timed_out=False):
+        self.name = name
+        self.result = result
+        self.exception = exception
+        self.timed_out = timed_out
+
+    def __repr__(self):
+        if self.timed_out:
+            status = 'timed out'
+        elif self.exception is not None:
+            status = 'exception {!r}'.format(self.exception)
+        else:
+            status = 'ok'
+        return '<eduID {!s}: {!s} {!s}>'.format(self.__class__.__name__, self.name, status)
+
+    @property
+    def ok(self):
+        """
+        True if the call returned before the deadline.
+        """
+        return not self.timed_out and self.exception is None
+
+    def get(self):
+        """
+        Get the result, raising the exception of the call if it failed.
+
+        :raise TimeoutError: The call did not finish before the deadline
+        """
+        if self.timed_out:
+            raise TimeoutError('Call {!r} did not finish in time'.format(self.name))
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+def get_executor(max_workers=10):
+    """
+    Get the executor used by fan_out() in this process, unless it is given one.
+
+    Threads don't survive os.fork(), so a new executor is created in child processes.
+
+    :param max_workers: Number of worker threads, if the executor has to be created
+    :type max_workers: int
+
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max_workers)
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def fan_out(calls, timeout=None, executor=None):
+    """
+    Make a number of calls concurrently in a thread pool, and wait for them to finish.
+
+    Calls not finished when `timeout' seconds have passed are reported as timed out. They
+    can't be interrupted, so they will run to completion in the background.
+
+    :param calls: Name -> callable taking no arguments (use functools.partial to bind arguments)
+    :param timeout: Maximum number of seconds to wait for all the calls together, None to wait forever
+    :param executor: Executor to run the calls in, default is the one from get_executor()
+
+    :type calls: dict
+    :type timeout: int | float | None
+    :type executor: concurrent.futures.ThreadPoolExecutor
+
+    :return: Name -> CallResult
+    :rtype: dict
+
+    :raise RuntimeError: Called from one of the calls made by fan_out()
+    """
+    if getattr(_local, 'active', False):
+        raise RuntimeError('fan_out() can not be used from the calls it makes')
+    if executor is None:
+        executor = get_executor()
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    futures = [(name, executor.submit(_call, func)) for name, func in calls.items()]
+    res = {}
+    for name, future in futures:
+        remaining = None
+        if deadline is not None:
+            remaining = max(0, deadline - time.time())
+        try:
+            exception = future.exception(timeout=remaining)
+        except TimeoutError:
+            res[name] = CallResult(name, timed_out=True)
+            continue
+        if exception is not None:
+            res[name] = CallResult(name, exception=exception)
+        else:
+            res[name] = CallResult(name, result=future.result())
+    return res
+
+
+def _call(func):
+    """
+    Make one of the calls of fan_out(), in a worker thread.
+    """
+    _local.active = True
+    try:
+        return func()
+    finally:
+        _local.active = False
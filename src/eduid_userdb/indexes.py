@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+Reconcile the indexes of a collection with the indexes declared for it.
+
+Each database class declares the indexes its queries need in the class attribute `indexes',
+in the same format as BaseDB.setup_indexes() takes:
+
+    class ActionDB(BaseDB):
+        indexes = {
+            'user-preference-index-v1': {'key': [('user_oid', 1), ('preference', 1)]},
+        }
+
+To change an index, add a new version of it with a new name and remove the old one.
+
+reconcile_indexes() compares the declaration with the indexes in the database. Missing indexes
+are created (in the background, so the collection isn't locked while they are built). An older
+version of a declared index (an index with the same key but another name) is replaced by the
+declared version, since MongoDB won't create a second index with the same key. Indexes with the
+declared name that differ from the declaration, and indexes in the database that are not
+declared, are reported but left alone unless `drop_unknown' is set. With `dry_run', nothing is
+changed.
+
+    report = userdb.reconcile_indexes(dry_run=True)
+    if not report.in_sync:
+        logger.warning('Index drift: {!r}'.format(report))
+"""
+
+from __future__ import absolute_import
+
+import logging
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Index options compared with the declaration, other options (like 'background') don't matter once built
+_COMPARED_OPTIONS = ['unique', 'sparse', 'expireAfterSeconds', 'partialFilterExpression']
+
+# The _id index can not be dropped from a MongoDB collection
+_DEFAULT_INDEXES = ['_id_']
+
+
+class IndexReport(object):
+    """
+    The result of reconciling the indexes of a collection.
+
+    :ivar missing: Names of declared indexes not in the database
+    :ivar created: Names of indexes created
+    :ivar changed: Name -> description of how an index in the database differs from the declaration
+    :ivar unknown: Names of indexes in the database that are not declared
+    :ivar dropped: Names of indexes dropped
+    :ivar errors: Name -> error message, for indexes that could not be created or dropped
+    :ivar dry_run: True if the database was not modified
+    """
+
+    def __init__(self, collection, dry_run):
+        self.collection = collection
+        self.dry_run = dry_run
+        self.missing = []
+        self.created = []
+        self.changed = {}
+        self.unknown = []
+        self.dropped = []
+        self.errors = {}
+
+    def __repr__(self):
+        return '<eduID {!s}: {!s} missing={!r} changed={!r} unknown={!r} errors={!r}{!s}>'.format(
+            self.__class__.__name__, self.collection, self.missing, sorted(self.changed.keys()), self.unknown,
+            self.errors, ' (dry run)' if self.dry_run else '')
+
+    @property
+    def in_sync(self):
+        """
+        True if the indexes in the database were as declared.
+        """
+        return not (self.missing or self.changed or self.unknown or self.errors)
+
+
+def _index_differences(declared, existing):
+    """
+    Describe how an index in the database differs from the declaration.
+
+    :param declared: Declared index (with a 'key' and any options)
+    :param existing: Index information from the database
+
+    :type declared: dict
+    :type existing: dict
+
+    :return: Descriptions of the differences
+    :rtype: [str]
+    """
+    res = []
+    if [tuple(this) for this in declared['key']] != [tuple(this) for this in existing['key']]:
+        res.append('key {!r} != {!r}'.format(existing['key'], declared['key']))
+    for option in _COMPARED_OPTIONS:
+        if declared.get(option) != existing.get(option):
+            res.append('{!s} {!r} != {!r}'.format(option, existing.get(option), declared.get(option)))
+    return res
+
+
+def reconcile_indexes(coll, indexes, dry_run=False, drop_unknown=False):
+    """
+    Make the indexes of a collection match a declaration.
+
+    An index in the database with another name but the same key as a declared index is
+    reported as changed rather than missing, and (unless dry_run is set) dropped and created
+    again as declared, since MongoDB won't create a second index with the same key. Should
+    creating the declared index fail, the old one is restored.
+
+    :param coll: Collection to reconcile the indexes of
+    :param indexes: Declared indexes, name -> {'key': [(key, direction)], option: value}
+    :param dry_run: Only report, don't modify the database
+    :param drop_unknown: Drop indexes in the database that are not declared
+
+    :type coll: pymongo.collection.Collection
+    :type indexes: dict
+    :type dry_run: bool
+    :type drop_unknown: bool
+
+    :rtype: IndexReport
+    """
+    report = IndexReport(coll.name, dry_run)
+    current = coll.index_information()
+    matched = set(_DEFAULT_INDEXES)
+    replaced = {}  # declared name -> name of the older version in the database
+    for name in sorted(indexes):
+        declared = indexes[name]
+        existing_name = name
+        if name not in current:
+            same_key = [other for other, info in current.items()
+                        if other not in matched and other not in indexes and
+                        not _index_differences({'key': declared['key']}, {'key': info['key']})]
+            if not same_key:
+                report.missing.append(name)
+                continue
+            existing_name = same_key[0]
+            replaced[name] = existing_name
+        matched.add(existing_name)
+        differences = _index_differences(declared, current[existing_name])
+        if existing_name != name:
+            differences.insert(0, 'named {!r}'.format(existing_name))
+        if differences:
+            report.changed[name] = ', '.join(differences)
+
+    report.unknown = sorted([name for name in current if name not in matched])
+
+    if dry_run:
+        return report
+
+    for name, old_name in sorted(replaced.items()):
+        if _drop_index(coll, old_name, report):
+            if not _create_index(coll, name, indexes[name], report):
+                _restore_index(coll, old_name, current[old_name], report)
+    for name in report.missing:
+        _create_index(coll, name, indexes[name], report)
+    if drop_unknown:
+        for name in report.unknown:
+            _drop_index(coll, name, report)
+    for name, description in report.changed.items():
+        if name in replaced and name in report.created:
+            continue
+        logger.warning('Index {!r} on {!r} differs from the declaration: {!s}'.format(name, coll.name, description))
+    return report
+
+
+def _create_index(coll, name, declared, report):
+    """
+    Create a declared index, in the background.
+
+    :param coll: Collection to create the index in
+    :param name: Name of the index
+    :param declared: Declared index (with a 'key' and any options)
+    :param report: Where to record the outcome
+
+    :type coll: pymongo.collection.Collection
+    :type name: str
+    :type declared: dict
+    :type report: IndexReport
+
+    :return: True if the index was created
+    :rtype: bool
+    """
+    params = dict(declared)
+    key = params.pop('key')
+    params['name'] = name
+    params['background'] = True
+    try:
+        coll.create_index(key, **params)
+    except OperationFailure as exc:
+        logger.error('Failed creating index {!r} on {!r}: {!s}'.format(name, coll.name, exc))
+        report.errors[name] = str(exc)
+        return False
+    logger.info('Created index {!r} on {!r}'.format(name, coll.name))
+    report.created.append(name)
+    return True
+
+
+def _drop_index(coll, name, report):
+    """
+    Drop an index.
+
+    :param coll: Collection to drop the index from
+    :param name: Name of the index
+    :param report: Where to record the outcome
+
+    :type coll: pymongo.collection.Collection
+    :type name: str
+    :type report: IndexReport
+
+    :return: True if the index was dropped
+    :rtype: bool
+    """
+    try:
+        coll.drop_index(name)
+    except OperationFailure as exc:
+        logger.error('Failed dropping index {!r} on {!r}: {!s}'.format(name, coll.name, exc))
+        report.errors[name] = str(exc)
+        return False
+    logger.info('Dropped index {!r} on {!r}'.format(name, coll.name))
+    report.dropped.append(name)
+    return True
+
+
+def _restore_index(coll, name, info, report):
+    """
+    Create an index that was dropped again, from the information index_information() returned for it.
+
+    :param coll: Collection to create the index in
+    :param name: Name of the index
+    :param info: Index information from the database
+    :param report: Where to record the outcome
+
+    :type coll: pymongo.collection.Collection
+    :type name: str
+    :type info: dict
+    :type report: IndexReport
+    """
+    params = dict([(option, info[option]) for option in _COMPARED_OPTIONS if option in info])
+    try:
+        coll.create_index(info['key'], name=name, background=True, **params)
+    except OperationFailure as exc:
+        logger.error('Failed restoring index {!r} on {!r}: {!s}'.format(name, coll.name, exc))
+    else:
+        logger.warning('Restored index {!r} on {!r}'.format(name, coll.name))
+        report.dropped.remove(name)
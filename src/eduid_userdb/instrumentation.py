@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Record call counts, latency, documents returned and errors for the methods of database objects.
+
+Instrumentation is enabled per database object by giving it a sink:
+
+    sink = MemorySink()
+    userdb.instrument(sink)
+    ...
+    stats = sink.stats()['UserDB.get_user_by_mail']
+
+The public methods of the object are then replaced by wrappers (on the instance, not the
+class) that time each call and pass the measurements on to the sink. Objects that are not
+instrumented are not affected at all, so there is no overhead when instrumentation is disabled.
+
+Sinks implement record(), and are provided for keeping aggregated statistics in memory
+(MemorySink), passing measurements on to a statsd style client (CallbackSink) and logging
+every call (LoggingSink).
+"""
+
+from __future__ import absolute_import
+
+import time
+import logging
+import functools
+import threading
+
+import bson
+
+# Upper limits of the latency histogram buckets, in milliseconds
+HISTOGRAM_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+# Public methods of the database classes that are not instrumented
+_NOT_INSTRUMENTED = ['instrument', 'uninstrument', 'close']
+
+
+class MethodCall(object):
+    """
+    Measurements of one call to an instrumented method.
+
+    :ivar name: Name of the method, prefixed with the class name (e.g. 'UserDB.save')
+    :ivar seconds: Duration of the call
+    :ivar documents: Number of documents (users, actions, ...) returned
+    :ivar bytes: BSON size of the documents returned, if measured (else None)
+    :ivar error: Exception raised by the call, or None
+    """
+
+    def __init__(self, name, seconds, documents, bytes, error):
+        self.name = name
+        self.seconds = seconds
+        self.documents = documents
+        self.bytes = bytes
+        self.error = error
+
+    def __repr__(self):
+        return '<eduID {!s}: {!s} {:.3f} ms documents={!s} bytes={!s} error={!r}>'.format(
+            self.__class__.__name__, self.name, self.seconds * 1000, self.documents, self.bytes, self.error)
+
+
+class MemorySink(object):
+    """
+    Aggregate the measurements in memory.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, call):
+        """
+        :type call: MethodCall
+        """
+        with self._lock:
+            stats = self._stats.get(call.name)
+            if stats is None:
+                stats = {'calls': 0,
+                         'errors': 0,
+                         'documents': 0,
+                         'bytes': 0,
+                         'seconds': 0.0,
+                         'histogram': [0] * len(HISTOGRAM_BUCKETS),
+                         }
+                self._stats[call.name] = stats
+            stats['calls'] += 1
+            if call.error is not None:
+                stats['errors'] += 1
+            stats['documents'] += call.documents
+            stats['bytes'] += call.bytes or 0
+            stats['seconds'] += call.seconds
+            ms = call.seconds * 1000
+            for idx, limit in enumerate(HISTOGRAM_BUCKETS):
+                if ms <= limit:
+                    stats['histogram'][idx] += 1
+                    break
+
+    def stats(self):
+        """
+        Get a copy of the statistics gathered so far.
+
+        The histogram is a list of the number of calls in each bucket of HISTOGRAM_BUCKETS.
+
+        :return: Method name -> {'calls': int, 'errors': int, 'documents': int, 'bytes': int,
+                                 'seconds': float, 'histogram': [int]}
+        :rtype: dict
+        """
+        with self._lock:
+            res = {}
+            for name, stats in self._stats.items():
+                res[name] = dict(stats)
+                res[name]['histogram'] = list(stats['histogram'])
+            return res
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+class CallbackSink(object):
+    """
+    Pass the measurements on to a statsd style client.
+
+    The callback is called with (metric name, value, metric type) where the type is
+    'counter' (calls, errors, documents, bytes) or 'timing' (latency in milliseconds):
+
+        sink = CallbackSink(lambda name, value, kind: statsd.timing(name, value) if kind == 'timing'
+                                                      else statsd.incr(name, value))
+
+    :param callback: Function to call for each metric
+    :param prefix: Prefix of the metric names
+
+    :type callback: callable
+    :type prefix: str
+    """
+
+    def __init__(self, callback, prefix='eduid_userdb'):
+        self.callback = callback
+        self.prefix = prefix
+
+    def record(self, call):
+        """
+        :type call: MethodCall
+        """
+        name = '{!s}.{!s}'.format(self.prefix, call.name)
+        self.callback(name + '.calls', 1, 'counter')
+        self.callback(name + '.latency', call.seconds * 1000, 'timing')
+        if call.error is not None:
+            self.callback(name + '.errors', 1, 'counter')
+        if call.documents:
+            self.callback(name + '.documents', call.documents, 'counter')
+        if call.bytes:
+            self.callback(name + '.bytes', call.bytes, 'counter')
+
+
+class LoggingSink(object):
+    """
+    Log every call.
+
+    :param logger: Logger to use, default is the one of this module
+    :param level: Log level
+
+    :type logger: logging.Logger
+    :type level: int
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        if logger is None:
+            logger = logging.getLogger(__name__)
+        self.logger = logger
+        self.level = level
+
+    def record(self, call):
+        """
+        :type call: MethodCall
+        """
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, '{!r}'.format(call))
+
+
+def _count_documents(result):
+    """
+    Find the documents (dicts, or objects with a to_dict() method like User and Action) in
+    the return value of a database method.
+
+    Only a document, or a list of documents, is counted. Documents returned through iterators
+    (e.g. by UserDB.iter_users(), or the generator returned by UserDB.get_users_by_ids())
+    are not counted, since that would mean consuming the iterator.
+
+    :return: Number of documents, and the documents
+    :rtype: int, list
+    """
+    if not isinstance(result, list):
+        result = [result]
+    docs = [this for this in result if isinstance(this, dict) or hasattr(this, 'to_dict')]
+    return len(docs), docs
+
+
+def _bson_size(documents):
+    """
+    Get the BSON size of documents (or objects with a to_dict() method).
+
+    :rtype: int
+    """
+    res = 0
+    for doc in documents:
+        if hasattr(doc, 'to_dict'):
+            doc = doc.to_dict()
+        if isinstance(doc, dict):
+            res += len(bson.BSON.encode(doc))
+    return res
+
+
+def _wrap(method, name, sink, measure_bytes):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as exc:
+            sink.record(MethodCall(name, time.time() - start, 0, None, exc))
+            raise
+        seconds = time.time() - start
+        documents, docs = _count_documents(result)
+        nbytes = _bson_size(docs) if measure_bytes else None
+        sink.record(MethodCall(name, seconds, documents, nbytes, None))
+        return result
+    wrapper._eduid_instrumented = True
+    return wrapper
+
+
+def instrument(db, sink, measure_bytes=False):
+    """
+    Instrument the public methods of a database object.
+
+    Methods returning iterators are only timed until the iterator is returned, and the
+    documents they produce are not counted (or measured).
+
+    :param db: Database object
+    :param sink: Object with a record(MethodCall) method
+    :param measure_bytes: Measure the BSON size of the documents returned (costs a BSON encoding)
+
+    :type db: eduid_userdb.db.BaseDB
+    :type measure_bytes: bool
+    """
+    uninstrument(db)
+    for attr in dir(db.__class__):
+        if attr.startswith('_') or attr in _NOT_INSTRUMENTED:
+            continue
+        if isinstance(getattr(db.__class__, attr), property):
+            continue
+        method = getattr(db, attr)
+        if not callable(method) or isinstance(method, type):
+            continue
+        name = '{!s}.{!s}'.format(db.__class__.__name__, attr)
+        setattr(db, attr, _wrap(method, name, sink, measure_bytes))
+
+
+def uninstrument(db):
+    """
+    Remove the instrumentation of a database object.
+
+    :type db: eduid_userdb.db.BaseDB
+    """
+    for attr, value in db.__dict__.items():
+        if getattr(value, '_eduid_instrumented', False):
+            delattr(db, attr)
@@ -100,6 +100,7 @@ class MailAddress(PrimaryElement):
         if not isinstance(value, basestring):
             raise UserDBValueError("Invalid 'email': {!r}".format(value))
         self._data['email'] = str(value.lower())
+        self._changed(key=True)
 
     # -----------------------------------------------------------------
     def to_dict(self, old_userdb_format=False):
@@ -97,6 +97,7 @@ class Password(Element):
         if not isinstance(value, ObjectId):
             raise UserDBValueError("Invalid 'id': {!r}".format(value))
         self._data['id'] = value
+        self._changed(key=True)
 
     @property
     def salt(self):
@@ -93,6 +93,7 @@ class PhoneNumber(PrimaryElement):
         if not isinstance(value, basestring):
             raise UserDBValueError("Invalid 'number': {!r}".format(value))
         self._data['number'] = str(value.lower())
+        self._changed(key=True)
 
     # -----------------------------------------------------------------
     def to_dict(self, old_userdb_format=False):
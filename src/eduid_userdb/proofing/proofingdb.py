@@ -49,6 +49,14 @@ class ProofingStateDB(BaseDB):
 
     ProofingStateClass = None
 
+    indexes = {
+        'eppn-index-v2': {'key': [('eduPersonPrincipalName', 1)], 'unique': True},
+        # for the deprecated get_state_by_user_id()
+        'user-id-index-v1': {'key': [('user_id', 1)], 'sparse': True},
+        # let the server remove states 30 days after they were last saved
+        'modified-ts-ttl-index-v1': {'key': [('modified_ts', 1)], 'expireAfterSeconds': 30 * 24 * 3600},
+    }
+
     def __init__(self, db_uri, db_name, collection='proofing_data'):
         BaseDB.__init__(self, db_uri, db_name, collection)
 
@@ -110,10 +118,22 @@ class ProofingStateDB(BaseDB):
         :raise self.MultipleDocumentsReturned: More than one user matches the search criteria
         """
 
-        state = self._get_document_by_attr('eduPersonPrincipalName', eppn, raise_on_missing)
+        state = self._get_document_by_unique_attr('eduPersonPrincipalName', eppn, raise_on_missing)
         if state:
             return self.ProofingStateClass(state)
 
+    def has_state(self, eppn):
+        """
+        Check if there is a state for the user, without loading it.
+
+        :param eppn: eduPersonPrincipalName
+        :type eppn: str | unicode
+
+        :rtype: bool
+        """
+        return self._get_document_by_unique_attr('eduPersonPrincipalName', eppn, raise_on_missing=False,
+                                                 fields={'_id': True}) is not None
+
     def save(self, state, check_sync=True):
         """
 
@@ -131,8 +151,9 @@ class ProofingStateDB(BaseDB):
         if modified is None:
             # document has never been modified
             result = self._coll.insert(state.to_dict())
-            logging.debug("{!s} Inserted new state {!r} into {!r}): {!r})".format(
-                self, state, self._coll_name, result))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("{!s} Inserted new state {!r} into {!r}): {!r})".format(
+                    self, state, self._coll_name, result))
         else:
             test_doc = {'eduPersonPrincipalName': state.eppn}
             if check_sync:
@@ -143,12 +164,13 @@ class ProofingStateDB(BaseDB):
                 db_state = self._coll.find_one({'eduPersonPrincipalName': state.eppn})
                 if db_state:
                     db_ts = db_state['modified_ts']
-                logging.debug("{!s} FAILED Updating state {!r} (ts {!s}) in {!r}). "
-                              "ts in db = {!s}".format(self, state, modified, self._coll_name, db_ts))
+                logger.debug("{!s} FAILED Updating state {!r} (ts {!s}) in {!r}). "
+                             "ts in db = {!s}".format(self, state, modified, self._coll_name, db_ts))
                 raise DocumentOutOfSync('Stale state object can\'t be saved')
 
-            logging.debug("{!s} Updated state {!r} (ts {!s}) in {!r}): {!r}".format(
-                self, state, modified, self._coll_name, result))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("{!s} Updated state {!r} (ts {!s}) in {!r}): {!r}".format(
+                    self, state, modified, self._coll_name, result))
 
     def remove_state(self, state):
         """
@@ -171,6 +193,9 @@ class OidcProofingStateDB(ProofingStateDB):
 
     ProofingStateClass = OidcProofingState
 
+    indexes = dict(ProofingStateDB.indexes)
+    indexes['state-index-v2'] = {'key': [('state', 1)], 'unique': True}
+
     def __init__(self, db_uri, db_name='eduid_oidc_proofing'):
         ProofingStateDB.__init__(self, db_uri, db_name)
 
@@ -191,7 +216,7 @@ class OidcProofingStateDB(ProofingStateDB):
         :raise self.MultipleDocumentsReturned: More than one user matches the search criteria
         """
 
-        state = self._get_document_by_attr('state', oidc_state, raise_on_missing)
+        state = self._get_document_by_unique_attr('state', oidc_state, raise_on_missing)
         if state:
             return self.ProofingStateClass(state)
 
@@ -44,9 +44,10 @@ class SignupUser(User):
     Subclass of eduid_userdb.User with eduid Signup application specific data.
     """
 
-    def __init__(self, userid = None, eppn = None, subject = 'physical person', data = None):
+    def __init__(self, userid = None, eppn = None, subject = 'physical person', data = None, copy_data = True):
         data_in = data
-        data = copy.copy(data_in)  # to not modify callers data
+        if copy_data:
+            data = copy.copy(data_in)  # to not modify callers data
 
         if data is None:
             if userid is None:
@@ -62,7 +63,7 @@ class SignupUser(User):
             _pending_mail_address = MailAddress(data=_pending_mail_address)
         self._pending_mail_address = None
 
-        User.__init__(self, data = data)
+        User.__init__(self, data = data, copy_data = copy_data)
 
         # now self._data exists so we can call our setters
         self.social_network = _social_network
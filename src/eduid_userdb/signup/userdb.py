@@ -40,6 +40,10 @@ class SignupUserDB(UserDB):
 
     UserClass = SignupUser
 
+    indexes = dict(UserDB.indexes)
+    indexes['pending-mail-code-index-v1'] = {'key': [('pending_mail_address.verification_code', 1)], 'sparse': True}
+    indexes['pending-mail-email-index-v1'] = {'key': [('pending_mail_address.email', 1)], 'sparse': True}
+
     def __init__(self, db_uri, db_name='eduid_signup', collection='registered'):
         UserDB.__init__(self, db_uri, db_name, collection)
 
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Log of slow database queries, kept in memory for operators to inspect.
+
+    userdb.slow_query_log = SlowQueryLog(threshold=0.05, explain=True)
+    ...
+    for entry in userdb.slow_query_log.dump():
+        print(entry['collection'], entry['duration_ms'], entry['filter'], entry['plan'])
+
+The filters are recorded with all values replaced by '?', since they contain personal data
+(NINs, e-mail addresses, phone numbers). Only the shape of the filter - the attributes and
+the operators - is kept, which is what is needed to find the index missing for a query.
+For the same reason, only the stages and index names of the query plans are recorded.
+"""
+
+from __future__ import absolute_import
+
+import time
+import logging
+import datetime
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+REDACTED = '?'
+
+# Parts of a query plan kept by _plan_summary(), the rest (like index bounds) might contain personal data
+_PLAN_KEYS = ['stage', 'indexName', 'keyPattern', 'direction', 'cursor']
+_PLAN_CHILDREN = ['inputStage', 'inputStages', 'clauses']
+
+
+def redact_filter(spec):
+    """
+    Replace all the values in a query filter with REDACTED, keeping attribute names and operators.
+
+    :param spec: Query filter
+    :type spec: dict
+
+    :rtype: dict
+    """
+    if isinstance(spec, dict):
+        return dict([(key, redact_filter(value)) for key, value in spec.items()])
+    if isinstance(spec, (list, tuple)):
+        if spec and all([isinstance(this, dict) for this in spec]):
+            # e.g. the clauses of an $or
+            return [redact_filter(this) for this in spec]
+        return [REDACTED]
+    return REDACTED
+
+
+def _plan_summary(plan):
+    """
+    Reduce a query plan to its stages and the indexes used.
+
+    :type plan: dict
+    :rtype: dict
+    """
+    res = {}
+    for key in _PLAN_KEYS:
+        if key in plan:
+            res[key] = plan[key]
+    for key in _PLAN_CHILDREN:
+        if isinstance(plan.get(key), dict):
+            res[key] = _plan_summary(plan[key])
+        elif isinstance(plan.get(key), list):
+            res[key] = [_plan_summary(this) for this in plan[key] if isinstance(this, dict)]
+    return res
+
+
+def winning_plan(explain):
+    """
+    Get a summary of the winning plan from the output of explain().
+
+    :param explain: Result of cursor.explain()
+    :type explain: dict
+
+    :rtype: dict
+    """
+    if 'queryPlanner' in explain:
+        return _plan_summary(explain['queryPlanner'].get('winningPlan', {}))
+    # MongoDB before 3.0
+    return _plan_summary(explain)
+
+
+class SlowQueryLog(object):
+    """
+    Ring buffer of the most recent queries slower than a threshold.
+
+    :param threshold: Queries taking at least this many seconds are recorded
+    :param maxlen: Maximum number of queries kept
+    :param explain: Record the winning query plan (costs an extra query for each slow query)
+
+    :type threshold: float
+    :type maxlen: int
+    :type explain: bool
+    """
+
+    def __init__(self, threshold=0.1, maxlen=100, explain=False):
+        self.threshold = threshold
+        self.explain = explain
+        self._entries = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<eduID {!s}: {!s} entries, threshold {!s} s>'.format(self.__class__.__name__,
+                                                                    len(self._entries), self.threshold)
+
+    def record(self, coll, spec, start):
+        """
+        Record a query, if it was slow.
+
+        :param coll: Collection queried
+        :param spec: Query filter
+        :param start: Time the query started (time.time())
+
+        :type coll: pymongo.collection.Collection
+        :type spec: dict
+        :type start: float
+        """
+        seconds = time.time() - start
+        if seconds < self.threshold:
+            return
+        entry = {'ts': datetime.datetime.utcnow(),
+                 'collection': coll.name,
+                 'filter': redact_filter(spec),
+                 'duration_ms': seconds * 1000,
+                 'plan': None,
+                 }
+        if self.explain:
+            try:
+                entry['plan'] = winning_plan(coll.find(spec).explain())
+            except Exception as exc:
+                logger.warning('Failed getting query plan for slow query on {!r}: {!r}'.format(coll.name, exc))
+        logger.debug('Slow query: {!r}'.format(entry))
+        with self._lock:
+            self._entries.append(entry)
+
+    def dump(self):
+        """
+        Get the recorded queries, oldest first.
+
+        :return: Dicts with the keys 'ts', 'collection', 'filter' (redacted), 'duration_ms' and 'plan'
+        :rtype: [dict]
+        """
+        with self._lock:
+            return [dict(entry) for entry in self._entries]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -2,8 +2,11 @@
 
 from __future__ import absolute_import
 
+from functools import partial
+
 from bson import ObjectId
 
+from eduid_userdb.fanout import fan_out
 from eduid_userdb.userdb import BaseDB, UserDB
 from eduid_userdb.dashboard.userdb import DashboardUserDB
 from eduid_userdb.signup.userdb import SignupUserDB
@@ -18,6 +21,14 @@ way we can minimize the risk of accidentally sharing any secret user data.
 
 
 class SupportUserDB(UserDB):
+    """
+    Users database for the support application.
+
+    search_users() looks for the query in several attributes using one $or query, so a user
+    matching more than one of them is only returned once. MongoDB evaluates each clause of
+    an $or separately, so every clause needs an index for the search not to scan the whole
+    collection. The indexes needed are declared in UserDB.indexes, see reconcile_indexes().
+    """
 
     UserClass = models.SupportUser
 
@@ -31,15 +42,13 @@ class SupportUserDB(UserDB):
         :return: A list of SupportUser objects
         :rtype: list
         """
-        results = list()
-        # We could do this with a custom filter (and one db call) but it is better to lean on existing methods
-        # if the way we find users change in the future
-        results.append(self.get_user_by_eppn(query, raise_on_missing=False))
-        results.append(self.get_user_by_nin(query, raise_on_missing=False))
-        results.extend(self.get_user_by_mail(query, raise_on_missing=False, return_list=True))
-        results.extend(self.get_user_by_phone(query, raise_on_missing=False, return_list=True))
-        users = [user for user in results if user]
-        return users
+        # Use the same filters as the get_user_by_* methods, in a single $or query
+        clauses = [{'eduPersonPrincipalName': query}]
+        clauses.extend(self._nin_filter(query)['$or'])
+        clauses.extend(self._mail_filter(query.lower())['$or'])
+        clauses.extend(self._phone_filter(query)['$or'])
+        # MongoDB returns each document once, even if it matches several of the clauses
+        return [self._user_from_document(doc) for doc in self._coll.find({'$or': clauses})]
 
 
 class SupportDashboardUserDB(DashboardUserDB):
@@ -160,3 +169,42 @@ class SupportProofingLogDB(BaseDB):
         """
         docs = self._get_documents_by_attr('eppn', eppn, raise_on_missing=False)
         return [self.model(doc) for doc in docs]
+
+
+class SupportUserDetails(object):
+    """
+    The information about a user shown in the support application, besides the user itself.
+
+    The information is looked up in all the collections concurrently, see eduid_userdb.fanout.
+
+    :param db_uri: mongodb:// URI to connect to
+    :type db_uri: str | unicode
+    """
+
+    def __init__(self, db_uri):
+        self.authn_info_db = SupportAuthnInfoDB(db_uri)
+        self.verifications_db = SupportVerificationsDB(db_uri)
+        self.actions_db = SupportActionsDB(db_uri)
+        self.letter_proofing_db = SupportLetterProofingDB(db_uri)
+        self.proofing_log_db = SupportProofingLogDB(db_uri)
+
+    def get_details(self, user, timeout=10):
+        """
+        :param user: User from SupportUserDB.search_users()
+        :param timeout: Maximum number of seconds to wait for the lookups
+
+        :type user: eduid_userdb.support.models.SupportUser
+        :type timeout: int | float | None
+
+        :return: 'authn_info', 'verifications', 'actions', 'letter_proofing' and
+                 'proofing_log' -> eduid_userdb.fanout.CallResult
+        :rtype: dict
+        """
+        user_id = user['user_id']
+        eppn = user['eduPersonPrincipalName']
+        return fan_out({'authn_info': partial(self.authn_info_db.get_authn_info, user_id),
+                        'verifications': partial(self.verifications_db.get_verifications, user_id),
+                        'actions': partial(self.actions_db.get_actions, user_id),
+                        'letter_proofing': partial(self.letter_proofing_db.get_proofing_state, eppn),
+                        'proofing_log': partial(self.proofing_log_db.get_entries, eppn),
+                        }, timeout=timeout)
@@ -0,0 +1,53 @@
+from unittest import TestCase
+
+from eduid_userdb.actions.cache import ActionCache
+from eduid_userdb.tests.test_cache import FakeTimer
+
+
+class TestActionCache(TestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = ActionCache(max_size=2, ttl=10, timer=self.timer)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get('user1'))
+        actions = [{'action': 'dummy'}]
+        self.cache.put('user1', actions)
+        # not copied, ActionDB.get_next_action() consumes the cached actions
+        self.assertIs(self.cache.get('user1'), actions)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_lru(self):
+        self.cache.put('user1', [{'action': 'one'}])
+        self.cache.put('user2', [{'action': 'two'}])
+        self.cache.get('user1')
+        self.cache.put('user3', [{'action': 'three'}])
+        self.assertIsNone(self.cache.get('user2'))
+        self.assertIsNotNone(self.cache.get('user1'))
+        self.assertIsNotNone(self.cache.get('user3'))
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        self.cache.put('user1', [{'action': 'one'}])
+        self.timer.now += 9
+        self.assertIsNotNone(self.cache.get('user1'))
+        self.timer.now += 1
+        self.assertIsNone(self.cache.get('user1'))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate_and_clear(self):
+        self.cache.put('user1', [{'action': 'one'}])
+        self.cache.put('user2', [{'action': 'two'}])
+        self.cache.invalidate('user1')
+        self.cache.invalidate('unknown')
+        self.assertIsNone(self.cache.get('user1'))
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('user2'))
+
+    def test_max_size(self):
+        with self.assertRaises(ValueError):
+            ActionCache(max_size=0)
@@ -30,10 +30,13 @@
 # POSSIBILITY OF SUCH DAMAGE.
 #
 
+import datetime
 from copy import deepcopy
 from bson import ObjectId
+from eduid_userdb.actions.cache import ActionCache
 from eduid_userdb.actions.db import ActionDB
 from eduid_userdb.testing import MongoTestCase
+from eduid_userdb.tests.test_cache import FakeTimer
 
 
 USERID = '123467890123456789014567'
@@ -183,3 +186,169 @@ class TestActionsDB(MongoTestCase):
         self.assertTrue(self.actionsdb.has_actions(userid=USERID,
                                                    action_type='tou',
                                                    params={'version': 'test-version'}))
+
+    def test_cache_bounded(self):
+        actionsdb = ActionDB(self.tmp_db.get_uri(''), cache=ActionCache(max_size=1))
+        self.assertIsNotNone(actionsdb.get_next_action(USERID))
+        dummy2 = deepcopy(DUMMY_ACTION)
+        dummy2['user_oid'] = ObjectId(USERID2)
+        del dummy2['_id']
+        self.actionsdb.add_action(data=dummy2)
+        self.assertIsNotNone(actionsdb.get_next_action(USERID2))
+        self.assertEqual(len(actionsdb._cache), 1)
+        self.assertEqual(actionsdb._cache.stats()['evictions'], 1)
+
+    def test_cache_ttl(self):
+        timer = FakeTimer()
+        actionsdb = ActionDB(self.tmp_db.get_uri(''), cache=ActionCache(ttl=10, timer=timer))
+        self.assertIsNotNone(actionsdb.get_next_action(USERID))
+        self.actionsdb._coll.remove({})
+        # still cached
+        self.assertTrue(actionsdb.has_pending_actions(USERID))
+        timer.now += 11
+        self.assertFalse(actionsdb.has_pending_actions(USERID))
+
+    def test_invalidation(self):
+        idp = ActionDB(self.tmp_db.get_uri(''), invalidation_interval=0)
+        actions = ActionDB(self.tmp_db.get_uri(''), invalidation_interval=0)
+        self.assertTrue(idp.has_pending_actions(USERID))
+        self.assertEqual(actions.get_next_action(USERID).action_type, 'dummy')
+        # remove both actions through the other instance
+        for doc in self.actionsdb._coll.find({}):
+            actions.remove_action_by_id(doc['_id'])
+        self.assertFalse(idp.has_pending_actions(USERID))
+        self.assertEqual(idp.invalidation.invalidations, 1)
+
+    def test_invalidation_polling(self):
+        timer = FakeTimer()
+        idp = ActionDB(self.tmp_db.get_uri(''), invalidation_interval=10)
+        idp.invalidation._timer = timer
+        actions = ActionDB(self.tmp_db.get_uri(''), invalidation_interval=10)
+        self.assertIsNotNone(idp.get_next_action(USERID))
+        for doc in self.actionsdb._coll.find({}):
+            actions.remove_action_by_id(doc['_id'])
+        # the counter is not read again until the poll interval has passed
+        self.assertTrue(idp.has_pending_actions(USERID))
+        self.assertEqual(idp.invalidation.polls, 1)
+        timer.now += 10
+        self.assertFalse(idp.has_pending_actions(USERID))
+        self.assertEqual(idp.invalidation.polls, 2)
+
+    def test_negative_cache(self):
+        self.assertFalse(self.actionsdb.has_pending_actions(USERID2))
+        # added by another process, not noticed until the negative cache entry expires
+        self.actionsdb._coll.insert({'user_oid': ObjectId(USERID2), 'action': 'dummy', 'preference': 100})
+        self.assertFalse(self.actionsdb.has_pending_actions(USERID2))
+        self.assertIsNone(self.actionsdb.get_next_action(USERID2))
+        self.assertEqual(self.actionsdb._negative_cache.stats()['hits'], 2)
+
+    def test_negative_cache_add_action(self):
+        self.assertFalse(self.actionsdb.has_pending_actions(USERID2, session='abc'))
+        self.assertFalse(self.actionsdb.has_pending_actions(USERID2))
+        self.actionsdb.add_action(ObjectId(USERID2), action_type='dummy', session='abc')
+        self.assertTrue(self.actionsdb.has_pending_actions(USERID2, session='abc'))
+        self.assertFalse(self.actionsdb.has_pending_actions(USERID2))
+
+    def test_negative_cache_disabled(self):
+        actionsdb = ActionDB(self.tmp_db.get_uri(''), negative_ttl=0)
+        self.assertFalse(actionsdb.has_pending_actions(USERID2))
+        actionsdb._coll.insert({'user_oid': ObjectId(USERID2), 'action': 'dummy', 'preference': 100})
+        self.assertTrue(actionsdb.has_pending_actions(USERID2))
+
+    def test_has_pending_actions_probe(self):
+        # finding out if there are pending actions doesn't load them
+        self.assertTrue(self.actionsdb.has_pending_actions(USERID))
+        self.assertEqual(len(self.actionsdb._cache), 0)
+        self.assertEqual(self.actionsdb.get_next_action(USERID).action_type, 'dummy')
+        self.assertEqual(len(self.actionsdb._cache), 1)
+
+    def test_claim_next_action(self):
+        worker1 = ActionDB(self.tmp_db.get_uri(''))
+        worker2 = ActionDB(self.tmp_db.get_uri(''))
+        first = worker1.claim_next_action(USERID)
+        self.assertEqual(first.action_type, 'dummy')
+        self.assertIsNotNone(first.claim_id)
+        self.assertIsNotNone(first.claim_expires_ts)
+        second = worker2.claim_next_action(USERID)
+        self.assertEqual(second.action_type, 'tou')
+        self.assertIsNone(worker1.claim_next_action(USERID))
+        self.assertIsNone(worker1.claim_next_action(USERID2))
+
+    def test_claim_next_action_session(self):
+        tou2 = deepcopy(TOU_ACTION)
+        tou2['session'] = 'xzf'
+        tou2['preference'] = 1000
+        del tou2['_id']
+        self.actionsdb.add_action(data=tou2)
+        self.assertEqual(self.actionsdb.claim_next_action(USERID).action_type, 'dummy')
+        action = self.actionsdb.claim_next_action(USERID, session='xzf')
+        self.assertEqual(action.session, 'xzf')
+
+    def test_claim_lease_expired(self):
+        first = self.actionsdb.claim_next_action(USERID, lease=0)
+        again = self.actionsdb.claim_next_action(USERID)
+        self.assertEqual(first.action_id, again.action_id)
+        self.assertNotEqual(first.claim_id, again.claim_id)
+        # the first claim was taken over
+        self.assertFalse(self.actionsdb.remove_claimed_action(first))
+        self.assertTrue(self.actionsdb.remove_claimed_action(again))
+        self.assertFalse(self.actionsdb.has_actions(action_type='dummy'))
+
+    def test_release_action(self):
+        action = self.actionsdb.claim_next_action(USERID)
+        self.assertTrue(self.actionsdb.release_action(action))
+        self.assertEqual(self.actionsdb.claim_next_action(USERID).action_id, action.action_id)
+        self.assertFalse(self.actionsdb.release_action(action))
+
+    def test_claim_actions(self):
+        worker1 = ActionDB(self.tmp_db.get_uri(''))
+        worker2 = ActionDB(self.tmp_db.get_uri(''))
+        claimed = worker1.claim_actions(USERID, limit=1)
+        self.assertEqual([x.action_type for x in claimed], ['dummy'])
+        claimed = worker2.claim_actions(USERID, limit=10)
+        self.assertEqual([x.action_type for x in claimed], ['tou'])
+        self.assertEqual(worker1.claim_actions(USERID), [])
+        for action in claimed:
+            self.assertTrue(worker2.remove_claimed_action(action))
+        self.assertFalse(self.actionsdb.has_actions(action_type='tou'))
+
+    def test_add_actions(self):
+        userids = [ObjectId() for _ in range(5)]
+        added, skipped = self.actionsdb.add_actions([USERID, USERID2] + userids + [USERID2], 'tou',
+                                                    params={'version': 'test-version'}, chunk_size=3)
+        # USERID already has the action, USERID2 is listed twice
+        self.assertEqual((added, skipped), (6, 2))
+        for userid in userids + [USERID2]:
+            self.assertTrue(self.actionsdb.has_actions(userid=userid, action_type='tou',
+                                                       params={'version': 'test-version'}))
+        self.assertEqual(self.actionsdb._coll.find({'action': 'tou'}).count(), 7)
+        # adding again is a no-op
+        self.assertEqual(self.actionsdb.add_actions(userids, 'tou', params={'version': 'test-version'}), (0, 5))
+        # other params
+        self.assertEqual(self.actionsdb.add_actions(userids, 'tou', params={'version': 'v2'}), (5, 0))
+
+    def test_add_actions_negative_cache(self):
+        self.assertFalse(self.actionsdb.has_pending_actions(USERID2))
+        self.actionsdb.add_actions([USERID2], 'tou')
+        self.assertTrue(self.actionsdb.has_pending_actions(USERID2))
+
+    def test_remove_expired_actions(self):
+        now = datetime.datetime.utcnow()
+        self.actionsdb.add_action(ObjectId(USERID2), action_type='old', expires_ts=now - datetime.timedelta(seconds=10))
+        self.actionsdb.add_action(ObjectId(USERID2), action_type='new', expires_ts=now + datetime.timedelta(seconds=10))
+        self.assertEqual(self.actionsdb.get_next_action(USERID2).expires_ts.date(), now.date())
+        self.assertEqual(self.actionsdb.remove_expired_actions(), 1)
+        self.assertFalse(self.actionsdb.has_actions(action_type='old'))
+        self.assertTrue(self.actionsdb.has_actions(action_type='new'))
+
+    def test_remove_expired_session_actions(self):
+        dummy2 = deepcopy(DUMMY_ACTION)
+        dummy2['session'] = 'xzf'
+        del dummy2['_id']
+        self.actionsdb.add_action(data=dummy2)
+        later = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+        self.assertEqual(self.actionsdb.remove_expired_actions(session_max_age=3600), 0)
+        self.assertEqual(self.actionsdb.remove_expired_actions(session_max_age=3600, now=later), 1)
+        # actions without session are left alone
+        self.assertTrue(self.actionsdb.has_actions(userid=USERID))
+        self.assertFalse(self.actionsdb.has_actions(session='xzf'))
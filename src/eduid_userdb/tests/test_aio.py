@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from concurrent.futures import ThreadPoolExecutor
+
+import eduid_userdb.aio.db
+
+from eduid_userdb import UserDB
+from eduid_userdb.actions import ActionDB
+from eduid_userdb.aio import AsyncUserDB, AsyncActionDB, AsyncProofingStateDB, get_default_executor
+from eduid_userdb.exceptions import UserDoesNotExist, UserOutOfSync, DocumentDoesNotExist
+from eduid_userdb.proofing import LetterProofingState, LetterProofingStateDB
+from eduid_userdb.testing import MongoTestCase
+
+
+class TestDefaultExecutor(TestCase):
+
+    def test_shared(self):
+        executor = get_default_executor()
+        self.assertIs(get_default_executor(), executor)
+        self.assertEqual(executor.submit(pow, 2, 10).result(timeout=5), 1024)
+
+    def test_fork(self):
+        executor = get_default_executor()
+        # pretend the executor was created in a parent process
+        eduid_userdb.aio.db._default_executor_pid = -1
+        new_executor = get_default_executor()
+        self.assertIsNot(new_executor, executor)
+        self.assertEqual(new_executor.submit(pow, 2, 10).result(timeout=5), 1024)
+
+
+class TestAsyncDB(MongoTestCase):
+
+    def setUp(self):
+        super(TestAsyncDB, self).setUp(None, None)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.userdb = AsyncUserDB(UserDB(self.tmp_db.get_uri(''), 'eduid_am'), executor=self.executor)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        super(TestAsyncDB, self).tearDown()
+
+    def test_get_user(self):
+        user = self.userdb.get_user_by_eppn(self.user.eppn).result(timeout=5)
+        self.assertEqual(user.user_id, self.user.user_id)
+        self.assertIsInstance(self.userdb.get_user_by_eppn('unknown').exception(timeout=5), UserDoesNotExist)
+        users, missing = self.userdb.get_users_by_eppns([self.user.eppn, 'unknown']).result(timeout=5)
+        self.assertEqual([this.user_id for this in users], [self.user.user_id])
+        self.assertEqual(missing, set(['unknown']))
+
+    def test_save_out_of_sync(self):
+        user1 = self.userdb.get_user_by_id(self.user.user_id).result(timeout=5)
+        user2 = self.userdb.get_user_by_id(self.user.user_id).result(timeout=5)
+        user1.given_name = 'First'
+        self.userdb.save(user1).result(timeout=5)
+        user2.given_name = 'Second'
+        with self.assertRaises(UserOutOfSync):
+            self.userdb.save(user2).result(timeout=5)
+
+    def test_actions(self):
+        actionsdb = AsyncActionDB(ActionDB(self.tmp_db.get_uri('')), executor=self.executor)
+        user_id = str(self.user.user_id)
+        actionsdb.add_action(userid=self.user.user_id, action_type='dummy', preference=100).result(timeout=5)
+        self.assertTrue(actionsdb.has_pending_actions(user_id).result(timeout=5))
+        action = actionsdb.get_next_action(user_id).result(timeout=5)
+        self.assertEqual(action.action_type, 'dummy')
+
+    def test_proofing_state(self):
+        statedb = AsyncProofingStateDB(LetterProofingStateDB(self.tmp_db.get_uri('')), executor=self.executor)
+        state = LetterProofingState({'eduPersonPrincipalName': self.user.eppn,
+                                     'nin': {'number': '200102034567',
+                                             'created_by': 'eduid_userdb.tests',
+                                             'created_ts': True,
+                                             'verified': False,
+                                             'verification_code': 'abc123',
+                                             },
+                                     })
+        statedb.save(state).result(timeout=5)
+        res = statedb.get_state_by_eppn(self.user.eppn).result(timeout=5)
+        self.assertEqual(res.nin.number, '200102034567')
+        future = statedb.get_state_by_eppn('unknown')
+        self.assertIsInstance(future.exception(timeout=5), DocumentDoesNotExist)
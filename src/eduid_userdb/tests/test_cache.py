@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from bson import ObjectId
+
+from eduid_userdb.cache import UserCache
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestUserCache(TestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = UserCache(max_size=2, ttl=10, timer=self.timer)
+        self.doc1 = {'_id': ObjectId(), 'eduPersonPrincipalName': 'test-one', 'givenName': 'One'}
+        self.doc2 = {'_id': ObjectId(), 'eduPersonPrincipalName': 'test-two', 'givenName': 'Two'}
+        self.doc3 = {'_id': ObjectId(), 'eduPersonPrincipalName': 'test-three', 'givenName': 'Three'}
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get(self.doc1['_id']))
+        self.cache.put(self.doc1)
+        self.assertEqual(self.cache.get(self.doc1['_id']), self.doc1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_aliases(self):
+        self.cache.put(self.doc1, aliases=[('mail', 'one@example.org', False)])
+        self.assertEqual(self.cache.get_by_alias(('eppn', 'test-one')), self.doc1)
+        self.assertEqual(self.cache.get_by_alias(('mail', 'one@example.org', False)), self.doc1)
+        self.assertIsNone(self.cache.get_by_alias(('mail', 'one@example.org', True)))
+        self.cache.invalidate(self.doc1['_id'])
+        self.assertIsNone(self.cache.get_by_alias(('eppn', 'test-one')))
+        self.assertIsNone(self.cache.get_by_alias(('mail', 'one@example.org', False)))
+
+    def test_independent_copies(self):
+        self.cache.put(self.doc1)
+        self.doc1['givenName'] = 'Modified after put'
+        res = self.cache.get(self.doc1['_id'])
+        self.assertEqual(res['givenName'], 'One')
+        res['givenName'] = 'Modified after get'
+        self.assertEqual(self.cache.get(self.doc1['_id'])['givenName'], 'One')
+
+    def test_lru_eviction(self):
+        self.cache.put(self.doc1)
+        self.cache.put(self.doc2)
+        # touch doc1 to make doc2 the least recently used entry
+        self.cache.get(self.doc1['_id'])
+        self.cache.put(self.doc3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get(self.doc2['_id']))
+        self.assertIsNone(self.cache.get_by_alias(('eppn', 'test-two')))
+        self.assertEqual(self.cache.get(self.doc1['_id']), self.doc1)
+        self.assertEqual(self.cache.get(self.doc3['_id']), self.doc3)
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_ttl(self):
+        self.cache.put(self.doc1)
+        self.timer.now += 9
+        self.assertEqual(self.cache.get(self.doc1['_id']), self.doc1)
+        self.timer.now += 1
+        self.assertIsNone(self.cache.get(self.doc1['_id']))
+        self.assertIsNone(self.cache.get_by_alias(('eppn', 'test-one')))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_clear(self):
+        self.cache.put(self.doc1)
+        self.cache.put(self.doc2)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+        self.assertIsNone(self.cache.get_by_alias(('eppn', 'test-one')))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from functools import partial
+from unittest import TestCase
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from eduid_userdb.fanout import fan_out, get_executor
+
+
+class TestFanOut(TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def test_results(self):
+        res = fan_out({'pow': partial(pow, 2, 10),
+                       'int': partial(int, 'not a number'),
+                       }, timeout=5, executor=self.executor)
+        self.assertTrue(res['pow'].ok)
+        self.assertEqual(res['pow'].get(), 1024)
+        self.assertFalse(res['int'].ok)
+        self.assertIsInstance(res['int'].exception, ValueError)
+        with self.assertRaises(ValueError):
+            res['int'].get()
+
+    def test_concurrent(self):
+        # all the calls must be running at the same time for any of them to finish
+        condition = threading.Condition()
+        started = []
+
+        def _wait():
+            with condition:
+                started.append(True)
+                condition.notify_all()
+                while len(started) < 3:
+                    condition.wait(5)
+                return len(started)
+        res = fan_out(dict([(num, _wait) for num in range(3)]), timeout=5, executor=self.executor)
+        self.assertEqual([res[num].get() for num in range(3)], [3, 3, 3])
+
+    def test_timeout(self):
+        event = threading.Event()
+        res = fan_out({'slow': partial(event.wait, 5),
+                       'fast': partial(len, 'abc'),
+                       }, timeout=0.05, executor=self.executor)
+        event.set()
+        self.assertTrue(res['slow'].timed_out)
+        with self.assertRaises(TimeoutError):
+            res['slow'].get()
+        self.assertEqual(res['fast'].get(), 3)
+
+    def test_nested(self):
+        # the inner calls could be waiting for threads held by the outer ones
+        res = fan_out({'nested': partial(fan_out, {'pow': partial(pow, 2, 10)})}, timeout=5,
+                      executor=self.executor)
+        with self.assertRaises(RuntimeError):
+            res['nested'].get()
+        # fan_out() can be used again in the same worker threads
+        res = fan_out(dict([(num, partial(pow, 2, num)) for num in range(8)]), timeout=5, executor=self.executor)
+        self.assertEqual([res[num].get() for num in range(8)], [2 ** num for num in range(8)])
+
+    def test_default_executor(self):
+        res = fan_out({'pow': partial(pow, 2, 10)}, timeout=5)
+        self.assertEqual(res['pow'].get(), 1024)
+        self.assertIs(get_executor(), get_executor())
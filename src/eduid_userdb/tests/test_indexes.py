@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+from unittest import SkipTest, TestCase
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+
+from eduid_userdb import UserDB
+from eduid_userdb.indexes import reconcile_indexes
+from eduid_userdb.actions import ActionDB
+from eduid_userdb.proofing import LetterProofingStateDB, OidcProofingStateDB
+from eduid_userdb.signup.userdb import SignupUserDB
+from eduid_userdb.support.db import SupportUserDB
+from eduid_userdb.testing import MongoTestCase
+
+
+class RecordingCollection(object):
+    """
+    Proxy for a pymongo collection, recording the filters of the queries made.
+    """
+
+    def __init__(self, coll):
+        self._coll = coll
+        self.queries = []
+
+    def __getattr__(self, name):
+        return getattr(self._coll, name)
+
+    def find(self, spec=None, *args, **kwargs):
+        self.queries.append(spec)
+        return self._coll.find(spec, *args, **kwargs)
+
+    def find_one(self, spec_or_id=None, *args, **kwargs):
+        self.queries.append(spec_or_id)
+        return self._coll.find_one(spec_or_id, *args, **kwargs)
+
+
+class IndexCollection(object):
+    """
+    Just enough of a pymongo collection to reconcile indexes, refusing two indexes with the same
+    key like MongoDB does.
+    """
+
+    def __init__(self):
+        self.name = 'test_indexes'
+        self.indexes = {'_id_': {'key': [('_id', 1)]}}
+        self.fail_unique = False
+
+    def index_information(self):
+        return dict([(name, dict(info)) for name, info in self.indexes.items()])
+
+    def create_index(self, key, name, background=False, **kwargs):
+        for other, info in self.indexes.items():
+            if info['key'] == key and other != name:
+                raise OperationFailure('Index with name: {!s} already exists with a different name'.format(other))
+        if kwargs.get('unique') and self.fail_unique:
+            raise OperationFailure('E11000 duplicate key error')
+        self.indexes[name] = dict(kwargs, key=key)
+
+    def drop_index(self, name):
+        if name not in self.indexes:
+            raise OperationFailure('index not found with name [{!s}]'.format(name))
+        del self.indexes[name]
+
+
+class TestReconcileIndexes(TestCase):
+
+    def setUp(self):
+        self.coll = IndexCollection()
+        self.v1 = {'eppn-index-v1': {'key': [('eduPersonPrincipalName', 1)]},
+                   'user-id-index-v1': {'key': [('user_id', 1)], 'sparse': True},
+                   }
+        self.v2 = {'eppn-index-v2': {'key': [('eduPersonPrincipalName', 1)], 'unique': True},
+                   'user-id-index-v1': {'key': [('user_id', 1)], 'sparse': True},
+                   }
+        reconcile_indexes(self.coll, self.v1)
+
+    def test_migrate(self):
+        """ Test replacing an index with a new version with the same key """
+        report = reconcile_indexes(self.coll, self.v2, dry_run=True)
+        self.assertEqual(report.missing, [])
+        self.assertEqual(report.unknown, [])
+        self.assertEqual(report.changed.keys(), ['eppn-index-v2'])
+        self.assertIn("named 'eppn-index-v1'", report.changed['eppn-index-v2'])
+        self.assertIn('unique', report.changed['eppn-index-v2'])
+        self.assertIn('eppn-index-v1', self.coll.indexes)
+
+        report = reconcile_indexes(self.coll, self.v2)
+        self.assertEqual(report.dropped, ['eppn-index-v1'])
+        self.assertEqual(report.created, ['eppn-index-v2'])
+        self.assertEqual(report.errors, {})
+        self.assertEqual(sorted(self.coll.indexes.keys()), ['_id_', 'eppn-index-v2', 'user-id-index-v1'])
+        self.assertTrue(self.coll.indexes['eppn-index-v2']['unique'])
+
+        report = reconcile_indexes(self.coll, self.v2)
+        self.assertTrue(report.in_sync)
+        self.assertEqual((report.created, report.dropped), ([], []))
+
+    def test_migrate_failed(self):
+        """ Test that the old version of an index is restored if the new one can't be created """
+        self.coll.fail_unique = True
+        report = reconcile_indexes(self.coll, self.v2)
+        self.assertIn('eppn-index-v2', report.errors)
+        self.assertEqual((report.created, report.dropped), ([], []))
+        self.assertEqual(sorted(self.coll.indexes.keys()), ['_id_', 'eppn-index-v1', 'user-id-index-v1'])
+
+        self.coll.fail_unique = False
+        report = reconcile_indexes(self.coll, self.v2)
+        self.assertEqual(report.created, ['eppn-index-v2'])
+
+    def test_changed_options(self):
+        """ Test that an index with the declared name but other options is only reported """
+        self.v1['user-id-index-v1'] = {'key': [('user_id', 1)]}
+        report = reconcile_indexes(self.coll, self.v1, drop_unknown=True)
+        self.assertIn('sparse', report.changed['user-id-index-v1'])
+        self.assertEqual((report.created, report.dropped), ([], []))
+
+
+def _plan_stages(explain):
+    """
+    Find all the stages of a query plan (MongoDB >= 3.0) and cursor types (older versions).
+    """
+    res = []
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key in ['stage', 'cursor'] and isinstance(value, basestring):
+                res.append(value)
+            else:
+                res.extend(_plan_stages(value))
+    elif isinstance(explain, list):
+        for value in explain:
+            res.extend(_plan_stages(value))
+    return res
+
+
+class TestIndexes(MongoTestCase):
+
+    def setUp(self):
+        super(TestIndexes, self).setUp(None, None)
+        self.userdb = UserDB(self.tmp_db.get_uri(''), 'eduid_am', collection='test_indexes')
+        self.userdb._drop_whole_collection()
+
+    def _require_index_names(self):
+        self.userdb._coll.create_index([('test', 1)], name='test-index-v1')
+        if 'test-index-v1' not in self.userdb._coll.index_information():
+            raise SkipTest('The database does not keep the names of indexes')
+        self.userdb._coll.drop_index('test-index-v1')
+
+    def test_reconcile(self):
+        self._require_index_names()
+        report = self.userdb.reconcile_indexes(dry_run=True)
+        self.assertFalse(report.in_sync)
+        self.assertEqual(sorted(report.missing), sorted(UserDB.indexes.keys()))
+        self.assertEqual(report.created, [])
+        self.assertEqual([name for name in self.userdb._coll.index_information() if name != '_id_'], [])
+
+        report = self.userdb.reconcile_indexes()
+        self.assertEqual(sorted(report.created), sorted(UserDB.indexes.keys()))
+        self.assertEqual(report.errors, {})
+        keys = [info['key'] for info in self.userdb._coll.index_information().values()]
+        for params in UserDB.indexes.values():
+            self.assertIn(params['key'], keys)
+
+        report = self.userdb.reconcile_indexes()
+        self.assertEqual((report.missing, report.created, report.unknown), ([], [], []))
+
+    def test_drift(self):
+        self._require_index_names()
+        self.userdb._coll.create_index([('eduPersonPrincipalName', 1)], name='eppn-index-v0')
+        self.userdb._coll.create_index([('givenName', 1)], name='given-name-index-v1')
+        report = self.userdb.reconcile_indexes(dry_run=True)
+        self.assertIn('eppn-index-v1', report.changed)
+        self.assertIn('unique', report.changed['eppn-index-v1'])
+        self.assertNotIn('eppn-index-v1', report.missing)
+        self.assertEqual(report.unknown, ['given-name-index-v1'])
+        self.assertFalse(report.in_sync)
+
+        # the older version of the eppn index is replaced, the unknown index left alone
+        report = self.userdb.reconcile_indexes()
+        self.assertEqual(report.dropped, ['eppn-index-v0'])
+        self.assertIn('eppn-index-v1', report.created)
+        self.assertEqual(report.unknown, ['given-name-index-v1'])
+        info = self.userdb._coll.index_information()
+        self.assertTrue(info['eppn-index-v1']['unique'])
+        self.assertNotIn('eppn-index-v0', info)
+
+        report = self.userdb.reconcile_indexes(drop_unknown=True)
+        self.assertEqual(report.dropped, ['given-name-index-v1'])
+        keys = [info['key'] for info in self.userdb._coll.index_information().values()]
+        self.assertNotIn([('givenName', 1)], keys)
+        self.assertTrue(self.userdb.reconcile_indexes().in_sync)
+
+    def _explain(self, db, lookups):
+        """
+        Make the lookups, and fail if any query they made would scan the whole collection.
+        """
+        db.reconcile_indexes()
+        real_coll = db._coll
+        recorder = RecordingCollection(real_coll)
+        db._coll = recorder
+        try:
+            for lookup in lookups:
+                res = lookup()
+                if isinstance(res, tuple):
+                    # get_users_by_ids() and friends return a generator
+                    list(res[0])
+        finally:
+            db._coll = real_coll
+        self.assertTrue(recorder.queries)
+        for spec in recorder.queries:
+            if not isinstance(spec, dict):
+                spec = {'_id': spec}
+            cursor = real_coll.find(spec)
+            if not hasattr(cursor, 'explain'):
+                raise SkipTest('The database does not support explain()')
+            stages = _plan_stages(cursor.explain())
+            self.assertNotIn('COLLSCAN', stages, 'Query {!r} on {!r} scans the collection'.format(
+                spec, real_coll.name))
+            self.assertFalse([this for this in stages if this.startswith('BasicCursor')],
+                             'Query {!r} on {!r} scans the collection'.format(spec, real_coll.name))
+
+    def test_userdb_lookups(self):
+        user_id = ObjectId()
+        db = self.userdb
+        self._explain(db, [lambda: db.get_user_by_id(user_id, raise_on_missing=False),
+                           lambda: db.get_user_by_eppn('hubba-bubba', raise_on_missing=False),
+                           lambda: db.get_user_by_mail('test@example.com', raise_on_missing=False),
+                           lambda: db.get_user_by_mail('test@example.com', raise_on_missing=False,
+                                                       include_unconfirmed=True),
+                           lambda: db.get_user_by_nin('197801011234', raise_on_missing=False),
+                           lambda: db.get_user_by_phone('+46700011111', raise_on_missing=False),
+                           lambda: db.get_users_by_ids([user_id]),
+                           lambda: db.get_users_by_eppns(['hubba-bubba']),
+                           ])
+
+    def test_support_search(self):
+        db = SupportUserDB(self.tmp_db.get_uri(''), collection='test_indexes')
+        self._explain(db, [lambda: db.search_users('hubba-bubba')])
+
+    def test_signup_lookups(self):
+        db = SignupUserDB(self.tmp_db.get_uri(''), collection='test_indexes')
+        self._explain(db, [lambda: db.get_user_by_mail_verification_code('abc123'),
+                           lambda: db.get_user_by_pending_mail_address('test@example.com'),
+                           ])
+
+    def test_actiondb_lookups(self):
+        db = ActionDB(self.tmp_db.get_uri(''), collection='test_indexes')
+        db._drop_whole_collection()
+        user_id = str(ObjectId())
+        self._explain(db, [lambda: db.has_pending_actions(user_id),
+                           lambda: db.has_pending_actions(user_id, session='abc'),
+                           lambda: db.has_actions(userid=user_id, action_type='tou'),
+                           lambda: db.get_next_action(user_id),
+                           ])
+
+    def test_proofing_state_lookups(self):
+        db = LetterProofingStateDB(self.tmp_db.get_uri(''))
+        self._explain(db, [lambda: db.get_state_by_eppn('hubba-bubba', raise_on_missing=False),
+                           lambda: db.get_state_by_user_id(ObjectId(), 'hubba-bubba', raise_on_missing=False),
+                           ])
+        db = OidcProofingStateDB(self.tmp_db.get_uri(''))
+        self._explain(db, [lambda: db.get_state_by_oidc_state('abc123', raise_on_missing=False)])
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+from eduid_userdb import UserDB
+from eduid_userdb.exceptions import UserDoesNotExist
+from eduid_userdb.instrumentation import MemorySink, CallbackSink, LoggingSink, HISTOGRAM_BUCKETS
+from eduid_userdb.testing import MongoTestCase
+
+
+class TestInstrumentation(MongoTestCase):
+
+    def setUp(self):
+        super(TestInstrumentation, self).setUp(None, None)
+        self.userdb = UserDB(self.tmp_db.get_uri(''), 'eduid_am')
+
+    def test_memory_sink(self):
+        sink = MemorySink()
+        self.userdb.instrument(sink, measure_bytes=True)
+        self.userdb.get_user_by_eppn(self.user.eppn)
+        self.userdb.get_user_by_mail(self.user.mail_addresses.primary.email, return_list=True)
+        with self.assertRaises(UserDoesNotExist):
+            self.userdb.get_user_by_eppn('unknown')
+        stats = sink.stats()
+        self.assertEqual(stats['UserDB.get_user_by_eppn']['calls'], 2)
+        self.assertEqual(stats['UserDB.get_user_by_eppn']['errors'], 1)
+        self.assertEqual(stats['UserDB.get_user_by_eppn']['documents'], 1)
+        self.assertTrue(stats['UserDB.get_user_by_eppn']['bytes'] > 0)
+        self.assertEqual(stats['UserDB.get_user_by_mail']['documents'], 1)
+        self.assertEqual(sum(stats['UserDB.get_user_by_mail']['histogram']), 1)
+        self.assertEqual(len(stats['UserDB.get_user_by_mail']['histogram']), len(HISTOGRAM_BUCKETS))
+
+        self.userdb.uninstrument()
+        self.assertNotIn('get_user_by_eppn', self.userdb.__dict__)
+        self.userdb.get_user_by_eppn(self.user.eppn)
+        self.assertEqual(sink.stats()['UserDB.get_user_by_eppn']['calls'], 2)
+
+    def test_iterators_not_counted(self):
+        sink = MemorySink()
+        self.userdb.instrument(sink, measure_bytes=True)
+        users, missing = self.userdb.get_users_by_ids([self.user.user_id])
+        self.assertEqual([user.user_id for user in users], [self.user.user_id])
+        self.assertEqual(len(list(self.userdb.iter_users())), self.userdb.db_count())
+        stats = sink.stats()
+        for name in ['UserDB.get_users_by_ids', 'UserDB.iter_users']:
+            self.assertEqual(stats[name]['calls'], 1)
+            self.assertEqual(stats[name]['documents'], 0)
+            self.assertEqual(stats[name]['bytes'], 0)
+
+    def test_other_sinks(self):
+        metrics = []
+        self.userdb.instrument(CallbackSink(lambda name, value, kind: metrics.append((name, kind))))
+        self.userdb.get_user_by_id(self.user.user_id)
+        self.assertEqual(metrics, [('eduid_userdb.UserDB.get_user_by_id.calls', 'counter'),
+                                   ('eduid_userdb.UserDB.get_user_by_id.latency', 'timing'),
+                                   ('eduid_userdb.UserDB.get_user_by_id.documents', 'counter'),
+                                   ])
+
+        records = []
+
+        class _Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        logger = logging.getLogger('eduid_userdb.tests.instrumentation')
+        logger.addHandler(_Handler())
+        logger.setLevel(logging.INFO)
+        self.userdb.instrument(LoggingSink(logger, logging.INFO))
+        self.userdb.save(self.userdb.get_user_by_id(self.user.user_id))
+        self.assertEqual([record.getMessage().split()[2] for record in records],
+                         ['UserDB.get_user_by_id', 'UserDB.save'])
@@ -149,6 +149,88 @@ class TestMailAddressList(TestCase):
         with self.assertRaises(eduid_userdb.element.PrimaryElementViolation):
             MailAddressList([one])
 
+    def test_find_after_add_and_remove(self):
+        third = self.three.find('ft@three.example.org')
+        self.two.add(third)
+        self.assertIs(self.two.find('ft@three.example.org'), third)
+        self.two.remove('ft@three.example.org')
+        self.assertFalse(self.two.find('ft@three.example.org'))
+        self.assertEqual(self.two.primary.email, 'ft@one.example.org')
+
+    def test_add_verified_to_unverified(self):
+        this = MailAddressList([_three_dict])
+        self.assertIsNone(this.primary)
+        new = eduid_userdb.mail.address_from_dict({'email': 'ft@verified.example.org',
+                                                   'verified': True,
+                                                   'primary': False,
+                                                   })
+        with self.assertRaises(eduid_userdb.element.PrimaryElementViolation):
+            this.add(new)
+
+    def test_primary_modified_elements(self):
+        """
+        Test that the primary element is checked again after elements have been modified directly.
+        """
+        self.assertEqual(self.two.primary.email, 'ft@one.example.org')
+        self.two.find('ft@two.example.org').is_primary = True
+        with self.assertRaises(eduid_userdb.element.PrimaryElementViolation):
+            self.two.primary
+        self.two.find('ft@one.example.org').is_primary = False
+        self.assertEqual(self.two.primary.email, 'ft@two.example.org')
+
+    def test_find_changed_key(self):
+        """
+        Test finding an element whose key has been changed while it was in the list.
+        """
+        self.three.find('ft@two.example.org').email = 'ft@changed.example.org'
+        self.assertEqual(self.three.find('ft@changed.example.org').email, 'ft@changed.example.org')
+        self.assertFalse(self.three.find('ft@two.example.org'))
+        with self.assertRaises(eduid_userdb.element.DuplicateElementViolation):
+            self.three.add(eduid_userdb.mail.address_from_dict({'email': 'ft@changed.example.org',
+                                                                'verified': False,
+                                                                'primary': False,
+                                                                }))
+        self.three.remove('ft@changed.example.org')
+        self.assertEqual(2, self.three.count)
+
+    def test_find_added_to_list(self):
+        """
+        Test finding an element added to the list returned by to_list().
+        """
+        new = eduid_userdb.mail.address_from_dict({'email': 'ft@new.example.org',
+                                                   'verified': False,
+                                                   'primary': False,
+                                                   })
+        self.two.to_list().append(new)
+        self.assertIs(self.two.find('ft@new.example.org'), new)
+        with self.assertRaises(eduid_userdb.element.DuplicateElementViolation):
+            self.two.add(copy.copy(new))
+
+    def test_find_replaced_in_list(self):
+        """
+        Test finding elements after one was added to, and one removed from, the list returned by to_list().
+        """
+        new = eduid_userdb.mail.address_from_dict({'email': 'ft@new.example.org',
+                                                   'verified': False,
+                                                   'primary': False,
+                                                   })
+        three = self.three.find('ft@three.example.org')
+        elements = self.three.to_list()
+        elements.append(new)
+        elements.remove(three)
+        self.assertIs(self.three.find('ft@new.example.org'), new)
+        self.assertFalse(self.three.find('ft@three.example.org'))
+
+    def test_primary_cached(self):
+        """
+        Test that the primary element stays cached when elements outside the list are changed.
+        """
+        primary = self.two.primary
+        self.assertTrue(self.two._primary_is_cached())
+        MailAddressList([_one_dict, _two_dict]).primary = 'ft@two.example.org'
+        self.assertTrue(self.two._primary_is_cached())
+        self.assertIs(self.two.primary, primary)
+
 
 class TestMailAddress(TestCase):
 
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from pymongo.errors import DuplicateKeyError
+
+from eduid_userdb.exceptions import DocumentDoesNotExist, MultipleDocumentsReturned
+from eduid_userdb.nin import Nin
+from eduid_userdb.proofing import LetterProofingStateDB, OidcProofingStateDB
+from eduid_userdb.proofing.proofing_state import LetterProofingState, OidcProofingState
+from eduid_userdb.testing import MongoTestCase
+
+EPPN = 'foob-arra'
+OIDC_STATE = '2c84fedd-a694-46f0-b235-7c4dd7982852'
+
+
+def _nin():
+    return Nin(number='200102034567', application='eduid_oidc_proofing', verified=False, primary=False).to_dict()
+
+
+class TestProofingStateDB(MongoTestCase):
+
+    def setUp(self):
+        super(TestProofingStateDB, self).setUp(None, None)
+        self.letterdb = LetterProofingStateDB(self.tmp_db.get_uri(''))
+        self.oidcdb = OidcProofingStateDB(self.tmp_db.get_uri(''))
+        for db in [self.letterdb, self.oidcdb]:
+            db._drop_whole_collection()
+            db.reconcile_indexes()
+
+    def _oidc_state(self, eppn=EPPN, state=OIDC_STATE):
+        return OidcProofingState({'eduPersonPrincipalName': eppn,
+                                  'nin': _nin(),
+                                  'state': state,
+                                  'nonce': 'bbca50f6-5213-4784-b6e6-289bd1debda5',
+                                  'token': 'de5b3f2a-14e9-49b8-9c78-a15fcf60d119',
+                                  })
+
+    def test_get_state_by_eppn(self):
+        self.assertFalse(self.letterdb.has_state(EPPN))
+        self.assertIsNone(self.letterdb.get_state_by_eppn(EPPN, raise_on_missing=False))
+        with self.assertRaises(DocumentDoesNotExist):
+            self.letterdb.get_state_by_eppn(EPPN)
+        self.letterdb.save(LetterProofingState({'eduPersonPrincipalName': EPPN, 'nin': _nin()}))
+        self.assertTrue(self.letterdb.has_state(EPPN))
+        state = self.letterdb.get_state_by_eppn(EPPN)
+        self.assertEqual(state.nin.number, '200102034567')
+
+    def test_get_state_by_oidc_state(self):
+        self.oidcdb.save(self._oidc_state())
+        self.assertEqual(self.oidcdb.get_state_by_oidc_state(OIDC_STATE).eppn, EPPN)
+        self.assertIsNone(self.oidcdb.get_state_by_oidc_state('unknown', raise_on_missing=False))
+
+    def test_v1_indexes(self):
+        """ Test the lookups in a database with the indexes from before the unique ones """
+        self.letterdb._drop_whole_collection()
+        self.letterdb._coll.create_index([('eduPersonPrincipalName', 1)], name='eppn-index-v1')
+        self.letterdb._unique_indexes = None
+        for _ in range(2):
+            self.letterdb._coll.insert(LetterProofingState({'eduPersonPrincipalName': EPPN,
+                                                            'nin': _nin()}).to_dict())
+        self.assertFalse(self.letterdb._has_unique_index('eduPersonPrincipalName'))
+        with self.assertRaises(MultipleDocumentsReturned):
+            self.letterdb.get_state_by_eppn(EPPN)
+        with self.assertRaises(MultipleDocumentsReturned):
+            self.letterdb.has_state(EPPN)
+
+        self.letterdb.remove_document({'_id': self.letterdb._coll.find_one()['_id']})
+        self.assertEqual(self.letterdb.get_state_by_eppn(EPPN).eppn, EPPN)
+        self.assertTrue(self.letterdb.has_state(EPPN))
+
+        # the unique index replaces the v1 index, and is used once it is in the database
+        self.letterdb.reconcile_indexes()
+        info = self.letterdb._coll.index_information()
+        unique = [this for this in info.values()
+                  if this['key'] == [('eduPersonPrincipalName', 1)] and this.get('unique')]
+        self.assertEqual(self.letterdb._has_unique_index('eduPersonPrincipalName'), bool(unique))
+        self.assertEqual(self.letterdb.get_state_by_eppn(EPPN).eppn, EPPN)
+
+    def test_unique_indexes(self):
+        self.oidcdb.save(self._oidc_state())
+        with self.assertRaises(DuplicateKeyError):
+            self.oidcdb.save(self._oidc_state(state='another-state'))
+        with self.assertRaises(DuplicateKeyError):
+            self.oidcdb.save(self._oidc_state(eppn='another-eppn'))
+
+    def test_ttl_index(self):
+        created = []
+        real_coll = self.letterdb._coll
+
+        class _Recorder(object):
+            def __getattr__(self, name):
+                return getattr(real_coll, name)
+
+            def create_index(self, key, **kwargs):
+                created.append((key, kwargs))
+                return real_coll.create_index(key, **kwargs)
+
+        self.letterdb._drop_whole_collection()
+        self.letterdb._coll = _Recorder()
+        try:
+            self.letterdb.reconcile_indexes()
+        finally:
+            self.letterdb._coll = real_coll
+        ttl = [kwargs for key, kwargs in created if key == [('modified_ts', 1)]]
+        self.assertEqual(len(ttl), 1)
+        self.assertEqual(ttl[0]['expireAfterSeconds'], 30 * 24 * 3600)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from eduid_userdb import UserDB
+from eduid_userdb.slowlog import SlowQueryLog, redact_filter, winning_plan
+from eduid_userdb.testing import MongoTestCase
+
+
+class TestRedaction(TestCase):
+
+    def test_redact_filter(self):
+        spec = {'$or': [{'mail': 'test@example.com'},
+                        {'mailAliases': {'$elemMatch': {'email': 'test@example.com', 'verified': True}}}],
+                'nins.number': {'$in': ['197801011234', '197801011235']},
+                }
+        self.assertEqual(redact_filter(spec),
+                         {'$or': [{'mail': '?'},
+                                  {'mailAliases': {'$elemMatch': {'email': '?', 'verified': '?'}}}],
+                          'nins.number': {'$in': ['?']},
+                          })
+
+    def test_winning_plan(self):
+        explain = {'queryPlanner': {'winningPlan': {
+            'stage': 'FETCH',
+            'filter': {'verified': {'$eq': True}},
+            'inputStage': {'stage': 'IXSCAN',
+                           'indexName': 'mailaliases-email-index-v1',
+                           'keyPattern': {'mailAliases.email': 1},
+                           'indexBounds': {'mailAliases.email': ['["test@example.com", "test@example.com"]']},
+                           }}}}
+        self.assertEqual(winning_plan(explain),
+                         {'stage': 'FETCH',
+                          'inputStage': {'stage': 'IXSCAN',
+                                         'indexName': 'mailaliases-email-index-v1',
+                                         'keyPattern': {'mailAliases.email': 1},
+                                         }})
+
+
+class TestSlowQueryLog(MongoTestCase):
+
+    def setUp(self):
+        super(TestSlowQueryLog, self).setUp(None, None)
+        self.userdb = UserDB(self.tmp_db.get_uri(''), 'eduid_am')
+
+    def test_slow_queries(self):
+        self.userdb.slow_query_log = SlowQueryLog(threshold=0, maxlen=2)
+        self.userdb.get_user_by_eppn(self.user.eppn)
+        self.userdb.get_user_by_mail(self.user.mail_addresses.primary.email)
+        self.userdb.get_user_by_nin('197801011234', raise_on_missing=False, return_list=True)
+        entries = self.userdb.slow_query_log.dump()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]['collection'], self.userdb._coll_name)
+        self.assertEqual(entries[0]['filter']['$or'][0], {'mail': '?'})
+        self.assertEqual(entries[1]['filter']['$or'][0], {'norEduPersonNIN': '?'})
+        self.assertIsNone(entries[1]['plan'])
+        self.userdb.slow_query_log.clear()
+        self.assertEqual(self.userdb.slow_query_log.dump(), [])
+
+    def test_threshold(self):
+        self.userdb.slow_query_log = SlowQueryLog(threshold=60)
+        self.userdb.get_user_by_eppn(self.user.eppn)
+        self.assertEqual(self.userdb.slow_query_log.dump(), [])
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import bson
+
+from eduid_userdb import User
+from eduid_userdb.support.db import SupportUserDB, SupportUserDetails
+from eduid_userdb.testing import MongoTestCase
+
+
+class TestSupportUserDB(MongoTestCase):
+
+    def setUp(self):
+        super(TestSupportUserDB, self).setUp(None, None)
+        self.support_userdb = SupportUserDB(self.tmp_db.get_uri(''))
+
+    def test_search_users(self):
+        users = self.support_userdb.search_users(self.user.eppn)
+        self.assertEqual([user['user_id'] for user in users], [self.user.user_id])
+        users = self.support_userdb.search_users(self.user.mail_addresses.primary.email.upper())
+        self.assertEqual([user['user_id'] for user in users], [self.user.user_id])
+        self.assertEqual(self.support_userdb.search_users('unknown'), [])
+
+    def test_search_users_multiple_matches(self):
+        number = '+46700000001'
+        user = User(data={'_id': bson.ObjectId(),
+                          'eduPersonPrincipalName': 'search-test',
+                          'nins': [{'number': number, 'verified': True, 'primary': True}],
+                          'phone': [{'number': number, 'verified': True, 'primary': True}],
+                          'passwords': [],
+                          })
+        other = User(data={'_id': bson.ObjectId(),
+                           'eduPersonPrincipalName': 'search-test2',
+                           'norEduPersonNIN': [number],
+                           'passwords': [],
+                           })
+        self.amdb.save(user, check_sync=False)
+        self.amdb.save(other, check_sync=False, old_format=True)
+        users = self.support_userdb.search_users(number)
+        self.assertEqual(sorted([this['user_id'] for this in users]), sorted([user.user_id, other.user_id]))
+
+    def test_user_details(self):
+        user = self.support_userdb.search_users(self.user.eppn)[0]
+        details = SupportUserDetails(self.tmp_db.get_uri(''))
+        res = details.get_details(user, timeout=10)
+        self.assertEqual(sorted(res.keys()), ['actions', 'authn_info', 'letter_proofing', 'proofing_log',
+                                              'verifications'])
+        for name, result in res.items():
+            self.assertTrue(result.ok, '{!s} failed: {!r}'.format(name, result))
+        self.assertIsNone(res['authn_info'].get())
+        self.assertEqual(res['actions'].get(), [])
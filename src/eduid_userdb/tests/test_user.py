@@ -1,8 +1,12 @@
 from bson import ObjectId
+from bson.tz_util import utc
+import copy
 import datetime
+import pickle
 
 from unittest import TestCase
 
+import eduid_userdb.exceptions
 from eduid_userdb.user import User
 from eduid_userdb.tou import ToUList
 from eduid_userdb.exceptions import UserHasUnknownData, UserHasNotCompletedSignup, UserIsRevoked
@@ -215,6 +219,89 @@ class TestUser(TestCase):
         d2 = u2.to_dict(old_userdb_format=True)
         self.assertEqual(d1, d2)
 
+    def test_copy_data(self):
+        """
+        Test that the callers data is only modified when ownership of it is handed over to the User.
+        """
+        data = copy.deepcopy(self.data1)
+        user1 = User(data)
+        self.assertEqual(data, self.data1)
+        user2 = User(data, copy_data=False)
+        self.assertEqual(user1.to_dict(), user2.to_dict())
+        self.assertNotEqual(data, self.data1)
+
+    def test_lazy_element_lists(self):
+        """
+        Test that element lists are only parsed when used, and that unused lists are saved as loaded.
+        """
+        d1 = self.user1.to_dict()
+        user = User(d1)
+        self.assertIsNone(user._mail_addresses)
+        self.assertIsNone(user._passwords)
+        d2 = user.to_dict()
+        self.assertEqual(d1, d2)
+        self.assertIsNone(user._mail_addresses)
+        self.assertEqual(user.mail_addresses.primary.email, 'user@example.net')
+        self.assertEqual(d1, user.to_dict())
+        # modifications made through the element lists must be in the output
+        user.mail_addresses.primary.verification_code = 'abc123'
+        self.assertEqual(user.to_dict()['mailAliases'][0]['verification_code'], 'abc123')
+
+    def test_lazy_element_lists_copied(self):
+        """
+        Test that modifying the output of to_dict() does not modify an unused element list.
+        """
+        user = User(self.user1.to_dict())
+        d1 = user.to_dict()
+        d1['mailAliases'][0]['email'] = 'modified@example.net'
+        self.assertIsNone(user._mail_addresses)
+        self.assertEqual(user.to_dict()['mailAliases'][0]['email'], 'user@example.net')
+        self.assertEqual(user.mail_addresses.primary.email, 'user@example.net')
+
+    def test_lazy_element_lists_bad_number(self):
+        """
+        Test that a list with a number that is not a string is parsed (and rejected) rather than returned as loaded.
+        """
+        data = self.user1.to_dict()
+        data['phone'] = [{'number': 46700000000, 'verified': True, 'primary': True}]
+        user = User(data)
+        with self.assertRaises(eduid_userdb.exceptions.UserDBValueError):
+            user.to_dict()
+
+    def test_lazy_element_lists_normalized(self):
+        """
+        Test that lists not in the current format are normalized even if they were never used.
+        """
+        # data2 has the old format keys 'added_timestamp' and 'source'
+        d1 = self.user2.to_dict()
+        self.assertNotIn('added_timestamp', d1['mailAliases'][1])
+        self.assertEqual(d1['mailAliases'][1]['created_ts'], datetime.datetime(2014, 12, 17, 14, 35, 14, 728000))
+        self.assertEqual(d1['passwords'][0]['created_by'], 'dashboard')
+        self.assertEqual(d1['phone'][0]['number'], '+46702222222')
+        d1['mailAliases'][0]['email'] = 'SomeOne+Test1@gmail.com'
+        d2 = User(d1).to_dict()
+        self.assertEqual(d2['mailAliases'][0]['email'], 'someone+test1@gmail.com')
+        d3 = User(d2).to_dict(old_userdb_format=True)
+        self.assertNotIn('primary', d3['mailAliases'][0])
+
+    def test_changed_fields(self):
+        """
+        Test listing the fields changed since the user was loaded.
+        """
+        self.assertIsNone(self.user2.changed_fields())
+        self.user2._set_unchanged()
+        self.assertEqual({}, self.user2.changed_fields())
+        self.user2.given_name = 'Other'
+        self.user2.mail_addresses.remove('someone+test1@gmail.com')
+        self.user2.passwords  # accessed, but not modified
+        changes = self.user2.changed_fields()
+        self.assertEqual(['givenName', 'mailAliases'], sorted(changes.keys()))
+        self.assertEqual(('Some', 'Other'), changes['givenName'])
+        self.assertEqual(2, len(changes['mailAliases'][0]))
+        self.assertEqual(1, len(changes['mailAliases'][1]))
+        self.user2._set_unchanged()
+        self.assertEqual({}, self.user2.changed_fields())
+
     def test_modified_ts(self):
         """
         Test the modified_ts property.
@@ -362,3 +449,44 @@ class TestUser(TestCase):
         user = User(data)
         self.assertTrue(user.tou.has_accepted('1'))
         self.assertFalse(user.tou.has_accepted('2'))
+
+    def test_pickle(self):
+        """
+        Test pickling a user whose element lists have been used, and changing keys in the copy.
+        """
+        self.assertEqual(self.user2.mail_addresses.primary.email, u'some.one@gmail.com')
+        user = pickle.loads(pickle.dumps(self.user2, pickle.HIGHEST_PROTOCOL))
+        self.assertEqual(user.to_dict(), self.user2.to_dict())
+        user.mail_addresses.primary.email = u'changed@example.com'
+        self.assertEqual(user.mail_addresses.find(u'changed@example.com').email, u'changed@example.com')
+        self.assertFalse(user.mail_addresses.find(u'some.one@gmail.com'))
+        self.assertEqual(self.user2.mail_addresses.find(u'some.one@gmail.com').email, u'some.one@gmail.com')
+
+    def test_deepcopy(self):
+        """
+        Test that changing keys in a deep copy of a user does not affect the original user, and vice versa.
+        """
+        self.assertEqual(self.user2.mail_addresses.primary.email, u'some.one@gmail.com')
+        user = copy.deepcopy(self.user2)
+        user.mail_addresses.primary.email = u'changed@example.com'
+        self.assertEqual(user.mail_addresses.find(u'changed@example.com').email, u'changed@example.com')
+        self.assertFalse(user.mail_addresses.find(u'some.one@gmail.com'))
+        self.assertFalse(self.user2.mail_addresses.find(u'changed@example.com'))
+        self.user2.mail_addresses.primary.email = u'other@example.com'
+        self.assertEqual(user.mail_addresses.primary.email, u'changed@example.com')
+        self.assertFalse(user.mail_addresses.find(u'other@example.com'))
+
+    def test_changed_fields_naive_timestamps(self):
+        """
+        Test comparing naive timestamps set on a user with the timezone aware ones loaded from the database.
+        """
+        data = copy.deepcopy(self.data2)
+        data['modified_ts'] = datetime.datetime(2015, 2, 11, 13, 58, 42, tzinfo=utc)
+        data['mailAliases'][0]['created_ts'] = datetime.datetime(2015, 2, 11, 13, 58, 42, tzinfo=utc)
+        user = User(data)
+        user._set_unchanged(data.keys())
+        user.modified_ts = datetime.datetime(2015, 2, 11, 13, 58, 42)
+        self.assertEqual(user.changed_fields(), {})
+        user.mail_addresses.primary = u'someone+test1@gmail.com'
+        user.modified_ts = datetime.datetime(2015, 2, 12)
+        self.assertEqual(sorted(user.changed_fields().keys()), ['mailAliases', 'modified_ts'])
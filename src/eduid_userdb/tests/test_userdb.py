@@ -31,9 +31,13 @@
 #
 
 import bson
+import logging
 from eduid_userdb.testing import MongoTestCase
 import eduid_userdb
-from eduid_userdb import User
+from eduid_userdb import User, UserDB
+from eduid_userdb.bulk import BulkUserWriter
+from eduid_userdb.password import Password
+from eduid_userdb.cache import UserCache
 from datetime import datetime
 
 
@@ -95,6 +99,270 @@ class TestUserDB(MongoTestCase):
         with self.assertRaises(eduid_userdb.exceptions.UserDoesNotExist):
             self.amdb.get_user_by_eppn('abc123')
 
+    def test_get_users_by_ids(self):
+        """ Test bulk lookup using _id """
+        unknown = bson.ObjectId()
+        user_ids = [self.user.user_id, str(self.user.user_id), unknown, 'not-a-valid-object-id']
+        users, missing = self.amdb.get_users_by_ids(user_ids, chunk_size=1)
+        res = list(users)
+        self.assertEqual([self.user.user_id], [x.user_id for x in res])
+        self.assertIsInstance(res[0], User)
+        self.assertEqual(missing, set([unknown, 'not-a-valid-object-id']))
+
+    def test_get_users_by_eppns(self):
+        """ Test bulk lookup using eppn """
+        eppns = [x['eduPersonPrincipalName'] for x in self.amdb._get_all_docs()]
+        users, missing = self.amdb.get_users_by_eppns(iter(eppns + ['abc123']), chunk_size=2)
+        self.assertEqual(sorted(eppns), sorted([x.eppn for x in users]))
+        self.assertEqual(missing, set(['abc123']))
+
+    def test_iter_users(self):
+        """ Test going through all users in _id order, one page at a time """
+        user_ids = sorted([x['_id'] for x in self.amdb._get_all_docs()])
+        res = list(self.amdb.iter_users(batch_size=1))
+        self.assertEqual(user_ids, [x.user_id for x in res])
+        self.assertIsInstance(res[0], User)
+        # resume after the first user
+        res = list(self.amdb.iter_users(batch_size=1, after_id=user_ids[0]))
+        self.assertEqual(user_ids[1:], [x.user_id for x in res])
+
+    def test_save_many(self):
+        """ Test saving users with bulk operations """
+        users = list(self.amdb.iter_users())
+        for user in users:
+            user.given_name = 'Bulk'
+        stale = self.amdb.get_user_by_id(users[0].user_id)
+        new = User(data={'_id': bson.ObjectId(), 'eduPersonPrincipalName': 'bulk-new', 'givenName': 'Bulk',
+                         'passwords': []})
+        result = self.amdb.save_many(users + [new], flush_size=2)
+        self.assertEqual(result.counts()['updated'], len(users))
+        self.assertEqual(result.outcomes[new.user_id], 'inserted')
+        self.assertEqual(result.out_of_sync, [])
+        for user in self.amdb.iter_users():
+            self.assertEqual(user.given_name, 'Bulk')
+
+        # the first user was modified in the database after `stale' was loaded
+        stale.given_name = 'Stale'
+        result = self.amdb.save_many([stale])
+        self.assertEqual(result.out_of_sync, [stale])
+        self.assertEqual(result.outcomes, {stale.user_id: 'out_of_sync'})
+        self.assertEqual(self.amdb.get_user_by_id(stale.user_id).given_name, 'Bulk')
+
+    def test_save_many_out_of_sync(self):
+        """ Test that only the users modified in the database are left out of a bulk save """
+        users = list(self.amdb.iter_users())
+        self.assertGreater(len(users), 1)
+        # modified in the database by someone else after it was loaded
+        self.amdb._coll.update({'_id': users[0].user_id}, {'$set': {'givenName': 'Other',
+                                                                    'modified_ts': datetime(2000, 1, 1)}})
+        for user in users:
+            user.given_name = 'Bulk'
+        result = self.amdb.save_many(users)
+        self.assertEqual(result.out_of_sync, [users[0]])
+        self.assertEqual(result.counts()['updated'], len(users) - 1)
+        self.assertEqual(self.amdb.get_user_by_id(users[0].user_id).given_name, 'Other')
+        for user in users[1:]:
+            self.assertEqual(result.outcomes[user.user_id], 'updated')
+            self.assertEqual(self.amdb.get_user_by_id(user.user_id).given_name, 'Bulk')
+
+        # the users saved can be saved again, which means comparing the timestamps they were saved with
+        for user in users[1:]:
+            user.surname = 'Bulk'
+        result = self.amdb.save_many(users[1:] + [users[0]])
+        self.assertEqual(result.out_of_sync, [users[0]])
+        self.assertEqual(result.counts()['updated'], len(users) - 1)
+
+    def test_save_many_discarded(self):
+        """ Test that the queued writes are discarded when a bulk save is interrupted """
+        users = list(self.amdb.iter_users())
+        new = User(data={'_id': bson.ObjectId(), 'eduPersonPrincipalName': 'bulk-new', 'passwords': []})
+        modified = [user.modified_ts for user in users]
+        with self.assertRaises(ValueError):
+            with BulkUserWriter(self.amdb) as writer:
+                for user in users + [new]:
+                    user.given_name = 'Bulk'
+                    writer.save(user)
+                    self.assertEqual(user.modified_ts.microsecond % 1000, 0)
+                raise ValueError('interrupted')
+        self.assertEqual([user.modified_ts for user in users], modified)
+        self.assertIsNone(new.modified_ts)
+        self.assertEqual(writer.flush().outcomes, {})
+        for user in self.amdb.iter_users():
+            self.assertNotEqual(user.given_name, 'Bulk')
+        # the users can still be saved
+        result = self.amdb.save_many(users)
+        self.assertEqual(result.counts()['updated'], len(users))
+
+    def test_save_audit_changes(self):
+        """ Test logging the changed fields when saving a user """
+        records = []
+
+        class _Handler(logging.Handler):
+            def emit(self, record):
+                records.append(record)
+
+        handler = _Handler()
+        audit_logger = logging.getLogger('eduid_userdb.userdb.audit')
+        audit_logger.addHandler(handler)
+        audit_logger.setLevel(logging.INFO)
+        try:
+            test_user = self.amdb.get_user_by_id(self.user.user_id)
+            test_user.given_name = 'Audited'
+            self.amdb.save(test_user)
+            self.assertEqual(records, [])
+            self.amdb.audit_changes = True
+            test_user = self.amdb.get_user_by_id(self.user.user_id)
+            test_user.surname = 'Audited'
+            self.amdb.save(test_user)
+            test_user.passwords.add(Password(data={'id': bson.ObjectId(),
+                                                   'salt': 'secretAuditedSalt',
+                                                   'source': 'test',
+                                                   }))
+            self.amdb.save(test_user)
+        finally:
+            audit_logger.removeHandler(handler)
+            audit_logger.setLevel(logging.NOTSET)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0].user_id, test_user.user_id)
+        self.assertEqual(records[0].changes, ['surname'])
+        self.assertNotIn('Audited', records[0].getMessage())
+        self.assertEqual(records[1].changes, ['passwords'])
+        self.assertNotIn('secretAuditedSalt', records[1].getMessage())
+
+    def test_save_partial(self):
+        """ Test saving only the changed fields of a user """
+        self.amdb.track_changes = True
+        test_user = self.amdb.get_user_by_id(self.user.user_id)
+        # a change made in the database behind our back, without updating modified_ts
+        self.amdb._coll.update({'_id': test_user.user_id}, {'$set': {'displayName': 'Untouched'}})
+        test_user.given_name = 'Partial'
+        update = test_user.to_update_dict()
+        self.assertEqual(sorted(update['$set'].keys()), ['givenName'])
+        self.assertNotIn('$unset', update)
+        self.amdb.save(test_user, partial=True)
+        doc = self.amdb._coll.find_one({'_id': test_user.user_id})
+        self.assertEqual(doc['givenName'], 'Partial')
+        self.assertEqual(doc['displayName'], 'Untouched')
+
+        # saved state is the new baseline, and removed fields are $unset
+        self.assertEqual(test_user.to_update_dict(), {'$set': {}})
+        test_user.given_name = None
+        self.amdb.save(test_user, partial=True)
+        doc = self.amdb._coll.find_one({'_id': test_user.user_id})
+        self.assertNotIn('givenName', doc)
+
+        # a user modified in the database since it was loaded is not saved
+        self.amdb._coll.update({'_id': test_user.user_id}, {'$set': {'surname': 'Other',
+                                                                     'modified_ts': datetime(2000, 1, 1)}})
+        test_user.surname = 'Stale'
+        with self.assertRaises(eduid_userdb.exceptions.UserOutOfSync):
+            self.amdb.save(test_user, partial=True)
+        self.assertEqual(self.amdb.get_user_by_id(self.user.user_id).surname, 'Other')
+
+    def test_save_partial_old_format(self):
+        """ Test that a partial save migrates fields stored in the old userdb format """
+        self.amdb.track_changes = True
+        user_id = bson.ObjectId()
+        self.amdb._coll.insert({'_id': user_id,
+                                'eduPersonPrincipalName': 'partial-old',
+                                'mail': 'partial@example.com',
+                                'mailAliases': [{'email': 'partial@example.com', 'verified': True}],
+                                'sn': 'Oldformat',
+                                'passwords': [],
+                                'modified_ts': datetime.utcnow(),
+                                })
+        test_user = self.amdb.get_user_by_id(user_id)
+        test_user.given_name = 'Partial'
+        update = test_user.to_update_dict()
+        self.assertEqual(update['$unset'], {'mail': True, 'sn': True})
+        self.assertEqual(update['$set']['surname'], 'Oldformat')
+        self.amdb.save(test_user, partial=True)
+        doc = self.amdb._coll.find_one({'_id': user_id})
+        self.assertNotIn('sn', doc)
+        self.assertNotIn('mail', doc)
+        self.assertEqual(doc['surname'], 'Oldformat')
+        self.assertEqual(doc['mailAliases'][0]['primary'], True)
+
+    def test_save_partial_untracked(self):
+        """ Test that a partial save writes the whole user when changes are not tracked """
+        test_user = self.amdb.get_user_by_id(self.user.user_id)
+        self.assertIsNone(test_user.changed_fields())
+        self.assertIsNone(test_user.to_update_dict())
+        self.amdb._coll.update({'_id': test_user.user_id}, {'$set': {'displayName': 'Overwritten'}})
+        test_user.given_name = 'Partial'
+        self.amdb.save(test_user, partial=True)
+        doc = self.amdb._coll.find_one({'_id': test_user.user_id})
+        self.assertEqual(doc['givenName'], 'Partial')
+        self.assertEqual(doc['displayName'], self.user.display_name)
+
+        # the state saved by a partial save is recorded for the next one
+        test_user.surname = 'Partial'
+        self.assertEqual(sorted(test_user.to_update_dict()['$set'].keys()), ['surname'])
+        self.amdb.save(test_user, partial=True)
+        self.assertEqual(self.amdb.get_user_by_id(self.user.user_id).surname, 'Partial')
+
+    def test_iter_users_raw(self):
+        """ Test going through raw documents with a projection """
+        res = list(self.amdb.iter_users(fields=['eduPersonPrincipalName'], raw=True))
+        self.assertEqual(len(res), self.amdb.db_count())
+        for doc in res:
+            self.assertEqual(set(doc.keys()), set(['_id', 'eduPersonPrincipalName']))
+
+
+class TestUserDB_cache(MongoTestCase):
+
+    def setUp(self):
+        super(TestUserDB_cache, self).setUp(None, None)
+        self.cache = UserCache(max_size=10, ttl=60)
+        self.userdb = UserDB(self.tmp_db.get_uri(''), 'eduid_am', cache=self.cache)
+
+    def test_cached_lookups(self):
+        """ Test that repeated lookups are served from the cache """
+        user = self.userdb.get_user_by_eppn(self.user.eppn)
+        self.assertEqual(self.cache.stats()['hits'], 0)
+        res = self.userdb.get_user_by_id(self.user.user_id)
+        self.assertEqual(res.user_id, user.user_id)
+        res = self.userdb.get_user_by_eppn(self.user.eppn)
+        self.assertEqual(res.user_id, user.user_id)
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+        email = user.mail_addresses.primary.email
+        self.userdb.get_user_by_mail(email)
+        self.userdb.get_user_by_mail(email)
+        self.assertEqual(self.cache.stats()['hits'], 3)
+
+    def test_cache_returns_copies(self):
+        """ Test that modifying a returned user does not change the cached user """
+        user = self.userdb.get_user_by_eppn(self.user.eppn)
+        user.given_name = 'Modified'
+        res = self.userdb.get_user_by_eppn(self.user.eppn)
+        self.assertEqual(res.given_name, self.user.given_name)
+
+    def test_save_invalidates(self):
+        """ Test that saving a user drops it from the cache """
+        user = self.userdb.get_user_by_eppn(self.user.eppn)
+        user.given_name = 'Kalle Anka'
+        self.userdb.save(user)
+        self.assertEqual(len(self.cache), 0)
+        res = self.userdb.get_user_by_eppn(self.user.eppn)
+        self.assertEqual(res.given_name, 'Kalle Anka')
+        # the new modified_ts must be visible, or the next save will fail
+        res.given_name = 'Kalle Anka 2'
+        self.userdb.save(res)
+
+    def test_update_user_invalidates(self):
+        """ Test that update_user drops the user from the cache """
+        self.userdb.get_user_by_id(self.user.user_id)
+        self.userdb.update_user(self.user.user_id, {'givenName': 'Kalle Anka'})
+        res = self.userdb.get_user_by_id(self.user.user_id)
+        self.assertEqual(res.given_name, 'Kalle Anka')
+
+    def test_remove_user_invalidates(self):
+        """ Test that removing a user drops it from the cache """
+        self.userdb.get_user_by_id(self.user.user_id)
+        self.userdb.remove_user_by_id(self.user.user_id)
+        self.assertIsNone(self.userdb.get_user_by_id(self.user.user_id, raise_on_missing = False))
+
 
 class TestUserDB_mail(MongoTestCase):
 
@@ -146,6 +414,24 @@ class TestUserDB_mail(MongoTestCase):
         with self.assertRaises(eduid_userdb.exceptions.MultipleUsersReturned):
             self.amdb.get_user_by_mail('test@gmail.com', include_unconfirmed = True)
 
+    def test_get_document_by_filter(self):
+        """ Test the single round trip document lookup """
+        doc = self.amdb._get_document_by_filter({'eduPersonPrincipalName': 'mail-test1'})
+        self.assertEqual(doc['_id'], self.user1.user_id)
+
+        res = self.amdb._get_document_by_filter({'eduPersonPrincipalName': 'unknown'}, raise_on_missing = False)
+        self.assertIsNone(res)
+
+        with self.assertRaises(eduid_userdb.exceptions.DocumentDoesNotExist):
+            self.amdb._get_document_by_filter({'eduPersonPrincipalName': 'unknown'})
+
+        with self.assertRaises(eduid_userdb.exceptions.MultipleDocumentsReturned):
+            self.amdb._get_document_by_filter({'mailAliases.email': 'test@gmail.com'})
+
+        doc = self.amdb._get_document_by_filter({'eduPersonPrincipalName': 'mail-test2'},
+                                                fields = {'eduPersonPrincipalName': True})
+        self.assertEqual(doc, {'_id': self.user2.user_id, 'eduPersonPrincipalName': 'mail-test2'})
+
 
 class TestUserDB_phone(MongoTestCase):
 
@@ -44,21 +44,57 @@ from eduid_userdb.phone import PhoneNumberList
 from eduid_userdb.password import PasswordList
 from eduid_userdb.nin import NinList
 from eduid_userdb.tou import ToUList
+from eduid_userdb.util import naive_utc
 
 VALID_SUBJECT_VALUES = ['physical person']
 
+# Keys (required, optional) of element dicts already in the format the element lists serialize them
+# to. Lists of such dicts are saved as they are if they were never used after the user was loaded.
+_PRIMARY_ELEMENT_KEYS = ['created_by', 'created_ts', 'verified_by', 'verified_ts', 'verification_code']
+_SERIALIZED_ELEMENT_KEYS = {
+    'mailAliases': (['email', 'verified', 'primary'], _PRIMARY_ELEMENT_KEYS),
+    'phone': (['number', 'verified', 'primary'], _PRIMARY_ELEMENT_KEYS),
+    'nins': (['number', 'verified', 'primary'], _PRIMARY_ELEMENT_KEYS),
+    'passwords': (['id', 'salt'], ['created_by', 'created_ts']),
+    'tou': (['id', 'version', 'created_by', 'created_ts'], []),
+}
+# Database key and property name of the element lists
+_ELEMENT_LISTS = [('mailAliases', 'mail_addresses'),
+                  ('phone', 'phone_numbers'),
+                  ('passwords', 'passwords'),
+                  ('nins', 'nins'),
+                  ('tou', 'tou'),
+                  ]
+# Attributes stored under another name in the database (by to_dict())
+_RENAMED_ATTRIBUTES = {'entitlements': 'eduPersonEntitlement'}
+
 
 class User(object):
     """
     Generic eduID user object.
 
+    The lists of mail addresses, phone numbers, nins, ToU events and passwords are parsed
+    the first time they are accessed, since many applications only use some of them.
+
+    The `data' dict is copied before it is parsed, unless `copy_data' is False. Callers
+    passing copy_data=False hand over ownership of `data' (and everything in it) to the
+    User object, which is what the database lookups do with freshly fetched documents.
+
     :param data: MongoDB document representing a user
+    :param raise_on_unknown: Raise exception on unknown values in `data' or not.
+    :param copy_data: Copy `data' before using it or not.
+
     :type  data: dict
+    :type raise_on_unknown: bool
+    :type copy_data: bool
     """
-    def __init__(self, data, raise_on_unknown = True):
-        self._data_in = copy.deepcopy(data)  # to not modify callers data
-        self._data_orig = copy.deepcopy(data)  # to not modify callers data
+    def __init__(self, data, raise_on_unknown = True, copy_data = True):
+        if copy_data:
+            data = copy.deepcopy(data)  # to not modify callers data
+        self._data_in = data
         self._data = dict()
+        self._raw_lists = dict()
+        self._migrated_lists = set()  # element lists not loaded in the format they are saved in
 
         self._parse_check_invalid_users()
 
@@ -80,7 +116,8 @@ class User(object):
         self._parse_nins()
         self._parse_tous()
 
-        self._passwords = PasswordList(self._data_in.pop('passwords', []))
+        self._passwords = None
+        self._raw_lists['passwords'] = self._data_in.pop('passwords', [])
         # generic (known) attributes
         self.eppn = self._data_in.pop('eduPersonPrincipalName')  # mandatory
         self.subject = self._data_in.pop('subject', None)
@@ -154,13 +191,16 @@ class User(object):
                     if _mail_addresses[idx].get('verified', False):
                         _mail_addresses[idx]['primary'] = True
             self._data_in.pop('mail')
+            self._migrated_lists.add('mailAliases')
 
         if len(_mail_addresses) == 1 and _mail_addresses[0].get('verified', False):
             if not _mail_addresses[0].get('primary', False):
                 # A single mail address was not set as Primary until it was verified
                 _mail_addresses[0]['primary'] = True
+                self._migrated_lists.add('mailAliases')
 
-        self._mail_addresses = MailAddressList(_mail_addresses)
+        self._mail_addresses = None
+        self._raw_lists['mailAliases'] = _mail_addresses
 
     def _parse_phone_numbers(self):
         """
@@ -176,6 +216,7 @@ class User(object):
             for _this in _phones:
                 if not _this.get('verified', False) and _this.get('primary', False):
                     _this['primary'] = False
+                    self._migrated_lists.add('phone')
             _primary = [x for x in _phones if x.get('primary', False)]
             if _phones and not _primary:
                 # None of the phone numbers are primary. Promote the first verified
@@ -183,11 +224,12 @@ class User(object):
                 for _this in _phones:
                     if _this.get('verified', False):
                         _this['primary'] = True
+                        self._migrated_lists.add('phone')
                         break
             self._data_in['phone'] = _phones
 
-        _phones = self._data_in.pop('phone', [])
-        self._phone_numbers = PhoneNumberList(_phones)
+        self._phone_numbers = None
+        self._raw_lists['phone'] = self._data_in.pop('phone', [])
 
     def _parse_nins(self):
         """
@@ -199,6 +241,7 @@ class User(object):
         if 'norEduPersonNIN' in self._data_in:
             # old-style list of verified nins
             old_nins = self._data_in.pop('norEduPersonNIN')
+            self._migrated_lists.add('nins')
             for this in old_nins:
                 if isinstance(this, basestring):
                     # XXX lookup NIN in eduid-dashboards verifications to make sure it is verified somehow?
@@ -216,7 +259,8 @@ class User(object):
                         raise UserDBValueError('Old-style NIN-as-dict has unknown data')
                 else:
                     raise UserDBValueError('Old-style NIN is not a string or dict')
-        self._nins = NinList(_nins)
+        self._nins = None
+        self._raw_lists['nins'] = _nins
 
     def _parse_tous(self):
         """
@@ -224,8 +268,8 @@ class User(object):
 
         Parse the ToU acceptance events.
         """
-        _tou = self._data_in.pop('tou', [])
-        self._tou = ToUList(_tou)
+        self._tou = None
+        self._raw_lists['tou'] = self._data_in.pop('tou', [])
 
     # -----------------------------------------------------------------
     @property
@@ -370,6 +414,8 @@ class User(object):
         :rtype: eduid_userdb.mail.MailAddressList
         """
         # no setter for this one, as the MailAddressList object provides modification functions
+        if self._mail_addresses is None:
+            self._mail_addresses = MailAddressList(self._raw_lists['mailAliases'])
         return self._mail_addresses
 
     # -----------------------------------------------------------------
@@ -381,6 +427,8 @@ class User(object):
         :rtype: eduid_userdb.phone.PhoneNumberList
         """
         # no setter for this one, as the PhoneNumberList object provides modification functions
+        if self._phone_numbers is None:
+            self._phone_numbers = PhoneNumberList(self._raw_lists['phone'])
         return self._phone_numbers
 
     # -----------------------------------------------------------------
@@ -392,6 +440,8 @@ class User(object):
         :rtype: eduid_userdb.password.PasswordList
         """
         # no setter for this one, as the PasswordList object provides modification functions
+        if self._passwords is None:
+            self._passwords = PasswordList(self._raw_lists['passwords'])
         return self._passwords
 
     # -----------------------------------------------------------------
@@ -403,6 +453,8 @@ class User(object):
         :rtype: eduid_userdb.nin.NinList
         """
         # no setter for this one, as the NinList object provides modification functions
+        if self._nins is None:
+            self._nins = NinList(self._raw_lists['nins'])
         return self._nins
 
     # -----------------------------------------------------------------
@@ -462,6 +514,8 @@ class User(object):
         :rtype: eduid_userdb.nin.ToUList
         """
         # no setter for this one, as the ToUList object provides modification functions
+        if self._tou is None:
+            self._tou = ToUList(self._raw_lists['tou'])
         return self._tou
 
     # -----------------------------------------------------------------
@@ -499,11 +553,11 @@ class User(object):
         :rtype: dict
         """
         res = copy.copy(self._data)  # avoid caller messing up our private _data
-        res['mailAliases'] = self.mail_addresses.to_list_of_dicts(old_userdb_format=old_userdb_format)
-        res['phone'] = self.phone_numbers.to_list_of_dicts(old_userdb_format=old_userdb_format)
-        res['passwords'] = self.passwords.to_list_of_dicts(old_userdb_format=old_userdb_format)
-        res['nins'] = self.nins.to_list_of_dicts(old_userdb_format=old_userdb_format)
-        res['tou'] = self.tou.to_list_of_dicts(old_userdb_format=old_userdb_format)
+        res['mailAliases'] = self._element_list_to_dicts('mailAliases', 'mail_addresses', old_userdb_format)
+        res['phone'] = self._element_list_to_dicts('phone', 'phone_numbers', old_userdb_format)
+        res['passwords'] = self._element_list_to_dicts('passwords', 'passwords', old_userdb_format)
+        res['nins'] = self._element_list_to_dicts('nins', 'nins', old_userdb_format)
+        res['tou'] = self._element_list_to_dicts('tou', 'tou', old_userdb_format)
         if 'eduPersonEntitlement' not in res:
             res['eduPersonEntitlement'] = res.pop('entitlements', [])
         # Remove these values if they have a value that evaluates to False
@@ -530,3 +584,193 @@ class User(object):
             if res.get('mailAliases') == []:
                 del res['mailAliases']
         return res
+
+    def changed_fields(self):
+        """
+        Get the fields that have been changed since the user was loaded from (or saved to)
+        the database.
+
+        The values include credentials and personal data, so they should not be logged.
+
+        The keys are the attribute names in the database, except for the user attributes
+        that are renamed by to_dict() (e.g. 'entitlements'). Element lists are compared in
+        their serialized form.
+
+        :return: field -> (old value, new value), with None for fields added or removed.
+                 None if the user has not been loaded from the database.
+        :rtype: dict | None
+        """
+        if getattr(self, '_data_orig', None) is None:
+            return None
+        res = {}
+        for key in set(self._data_orig.keys() + self._data.keys()):
+            old = self._data_orig.get(key)
+            new = self._data.get(key)
+            if _differ(old, new):
+                res[key] = (old, new)
+        for key, attr in _ELEMENT_LISTS:
+            _list = getattr(self, '_' + attr, None)
+            if _list is None:
+                # never accessed, so not modified
+                continue
+            old = self._raw_lists.get(key, [])
+            new = _list.to_list_of_dicts()
+            if _differ(old, new):
+                # the loaded list might not be in the current format
+                old = _list.__class__(old).to_list_of_dicts()
+            if _differ(old, new):
+                res[key] = (old, new)
+        return res
+
+    def to_update_dict(self):
+        """
+        Get a MongoDB update document ($set/$unset) with only the changes made to the user
+        since it was loaded from (or saved to) the database, in the new userdb format.
+
+        Fields are $set if they have been changed, or if they were not in the database
+        document (e.g. when the document was in the old userdb format), or if their
+        changes are not tracked (like data added to to_dict() by subclasses).
+        Fields in the database document but not in to_dict() are $unset.
+
+        :return: Update document, or None if the state of the user in the database is not known
+        :rtype: dict | None
+        """
+        if getattr(self, '_db_keys', None) is None:
+            return None
+        changed = self.changed_fields()
+        if changed is None:
+            return None
+        doc = self.to_dict()
+        dirty = set([_RENAMED_ATTRIBUTES.get(key, key) for key in changed])
+        tracked = set([_RENAMED_ATTRIBUTES.get(key, key) for key in self._data_orig.keys() + self._data.keys()])
+        tracked.update([key for key, _attr in _ELEMENT_LISTS])
+        _set = {}
+        for key, value in doc.items():
+            if key in dirty or key not in tracked or key not in self._db_keys:
+                _set[key] = value
+        _set.pop('_id', None)
+        res = {'$set': _set}
+        _unset = dict([(key, True) for key in self._db_keys if key not in doc])
+        if _unset:
+            res['$unset'] = _unset
+        return res
+
+    def _set_unchanged(self, db_keys=None, track_changes=True):
+        """
+        Record the current state of the user as the state in the database, for changed_fields().
+
+        Element lists that were migrated from an old format when the user was loaded are
+        left out of the database keys, so that to_update_dict() will write them.
+
+        Keeping track of the changes means copying the user data, and serializing the element
+        lists that have been accessed. With track_changes False, only the database keys are
+        recorded, and changed_fields() and to_update_dict() return None until the next call.
+
+        :param db_keys: Keys of the document in the database, for to_update_dict()
+        :param track_changes: Record the state of the user data for changed_fields()
+
+        :type db_keys: collections.Iterable | None
+        :type track_changes: bool
+        """
+        self._db_keys = None
+        if db_keys is not None:
+            self._db_keys = set(db_keys).difference(self._migrated_lists)
+        self._migrated_lists = set()
+        if not track_changes:
+            self._data_orig = None
+            return
+        self._data_orig = {}
+        for key, value in self._data.items():
+            if isinstance(value, (list, dict)):
+                value = copy.copy(value)
+            self._data_orig[key] = value
+        for key, attr in _ELEMENT_LISTS:
+            _list = getattr(self, '_' + attr, None)
+            if _list is not None:
+                self._raw_lists[key] = [copy.copy(this) for this in _list.to_list_of_dicts()]
+
+    def _element_list_to_dicts(self, key, attr, old_userdb_format):
+        """
+        Part of to_dict().
+
+        Serialize one of the element lists. A list that was never accessed is returned
+        as it was loaded (copied), if it is already in the format it would be serialized to.
+
+        :param key: Name of the list in the database ('mailAliases', ...)
+        :param attr: Name of the property holding the list ('mail_addresses', ...)
+        :param old_userdb_format: Set to True to get the list in the old database format.
+
+        :type key: str
+        :type attr: str
+        :type old_userdb_format: bool
+
+        :return: List of dicts
+        :rtype: [dict]
+        """
+        if getattr(self, '_' + attr) is None and not old_userdb_format:
+            _raw = self._raw_lists[key]
+            if _is_serialized(_raw, _SERIALIZED_ELEMENT_KEYS[key]):
+                # copies of the dicts, like the ones the elements serialize to
+                return [dict(this) for this in _raw]
+        return getattr(self, attr).to_list_of_dicts(old_userdb_format=old_userdb_format)
+
+
+def _differ(old, new):
+    """
+    Compare two values of user data for changed_fields().
+
+    Timestamps set by the caller are naive, while the ones loaded from the database are
+    timezone aware, and comparing them raises TypeError.
+
+    :rtype: bool
+    """
+    try:
+        return old != new
+    except TypeError:
+        return _naive_timestamps(old) != _naive_timestamps(new)
+
+
+def _naive_timestamps(value):
+    """
+    Part of _differ(). Convert all timestamps in some user data to naive datetimes in UTC.
+    """
+    if isinstance(value, datetime.datetime):
+        return naive_utc(value)
+    if isinstance(value, dict):
+        return dict([(k, _naive_timestamps(v)) for k, v in value.items()])
+    if isinstance(value, (list, tuple)):
+        return [_naive_timestamps(this) for this in value]
+    return value
+
+
+def _is_serialized(elements, keys):
+    """
+    Check if a list of element dicts is in the format an element list serializes to,
+    meaning parsing and serializing it again would not change anything.
+
+    :param elements: List of element dicts from the database
+    :param keys: Required and optional keys of the element dicts
+
+    :type elements: [dict]
+    :type keys: ([str], [str])
+
+    :rtype: bool
+    """
+    required, optional = keys
+    for this in elements:
+        if not isinstance(this, dict):
+            return False
+        for key in required:
+            if key not in this:
+                return False
+        for key, value in this.items():
+            if value is None or (key not in required and key not in optional):
+                return False
+            if key in ['email', 'number'] and (not isinstance(value, basestring) or value != value.lower()):
+                # addresses and numbers are lower-cased when parsed
+                return False
+            if key in ['verified', 'primary'] and not isinstance(value, bool):
+                return False
+            if key.endswith('_ts') and not isinstance(value, datetime.datetime):
+                return False
+    return True
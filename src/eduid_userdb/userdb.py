@@ -35,11 +35,16 @@ from bson.errors import InvalidId
 
 from eduid_userdb.user import User
 from eduid_userdb.db import BaseDB
+from eduid_userdb.bulk import BulkUserWriter
 import eduid_userdb.exceptions
-from eduid_userdb.exceptions import DocumentDoesNotExist, UserDoesNotExist, MultipleUsersReturned
+from eduid_userdb.exceptions import DocumentDoesNotExist, MultipleDocumentsReturned
+from eduid_userdb.exceptions import UserDoesNotExist, MultipleUsersReturned
 
 import logging
+import pprint
+import time
 logger = logging.getLogger(__name__)
+audit_logger = logging.getLogger(__name__ + '.audit')
 
 
 class UserDB(BaseDB):
@@ -49,14 +54,40 @@ class UserDB(BaseDB):
     :param db_uri: mongodb:// URI to connect to
     :param db_name: mongodb database name
     :param collection: mongodb collection name
+    :param user_class: class to return users as (default UserClass)
+    :param cache: read-through cache of user documents (default no caching)
+
+    Set `audit_changes' to True to log the names of the fields changed by every save() to
+    the 'eduid_userdb.userdb.audit' logger (at level INFO). The values are not logged, since
+    they include credentials and personal data.
+
+    Set `track_changes' to True to record the state of the users as they are loaded, so
+    that save(partial=True) can write only the fields that have been changed. Without it,
+    the first partial save of a user writes the whole document.
 
     :type db_uri: str or unicode
     :type db_name: str or unicode
     :type collection: str or unicode
+    :type cache: eduid_userdb.cache.UserCache | None
     """
     UserClass = User
-
-    def __init__(self, db_uri, db_name, collection='userdb', user_class=None):
+    cache = None
+    audit_changes = False
+    track_changes = False
+
+    # Each clause of the $or filters used by get_user_by_mail/nin/phone needs an index,
+    # including the ones for the old userdb format
+    indexes = {
+        'eppn-index-v1': {'key': [('eduPersonPrincipalName', 1)], 'unique': True},
+        'mailaliases-email-index-v1': {'key': [('mailAliases.email', 1)]},
+        'nins-number-index-v1': {'key': [('nins.number', 1)]},
+        'phone-number-index-v1': {'key': [('phone.number', 1)]},
+        'mail-legacy-index-v1': {'key': [('mail', 1)], 'sparse': True},
+        'nin-legacy-index-v1': {'key': [('norEduPersonNIN', 1)], 'sparse': True},
+        'mobile-legacy-index-v1': {'key': [('mobile.mobile', 1)], 'sparse': True},
+    }
+
+    def __init__(self, db_uri, db_name, collection='userdb', user_class=None, cache=None):
 
         if db_name == 'eduid_am' and collection == 'userdb':
             # Hack to get right collection name while the configuration points to the old database
@@ -67,6 +98,7 @@ class UserDB(BaseDB):
 
         if user_class is not None:
             self.UserClass = user_class
+        self.cache = cache
 
         logger.debug("{!s} connected to database".format(self))
         # XXX Backwards compatibility.
@@ -80,6 +112,26 @@ class UserDB(BaseDB):
                                                                  self.UserClass.__name__,
                                                                  )
 
+    def _user_from_document(self, doc):
+        """
+        Create a UserClass instance from a document fetched from the database.
+
+        The document is handed over to the User object rather than copied, since the
+        caller has no further use for it. UserClasses not derived from User (like the
+        support applications filtered dicts) are created the ordinary way.
+
+        :param doc: User document, not referenced by anything else
+        :type doc: dict
+
+        :rtype: UserClass
+        """
+        if issubclass(self.UserClass, User):
+            db_keys = doc.keys()
+            user = self.UserClass(data=doc, copy_data=False)
+            user._set_unchanged(db_keys, track_changes=self._tracks_changes())
+            return user
+        return self.UserClass(data=doc)
+
     def get_user_by_id(self, user_id, raise_on_missing=True):
         """
         Locate a user in the userdb given the user's _id.
@@ -101,39 +153,58 @@ class UserDB(BaseDB):
                 user_id = ObjectId(user_id)
             except InvalidId:
                 return None
+        if self.cache is not None:
+            doc = self.cache.get(user_id)
+            if doc is not None:
+                return self._user_from_document(doc)
         return self._get_user_by_attr('_id', user_id, raise_on_missing)
 
-    def _get_user_by_filter(self, filter, raise_on_missing=True, return_list=False):
+    def _get_user_by_filter(self, filter, raise_on_missing=True, return_list=False, cache_alias=None):
         """
         return the user matching the provided filter.
 
         :param filter: The filter to match the user
         :param raise_on_missing: If True, raise exception if no matching user object can be found.
         :param return_list: If True, always return a list of user objects regardless of how many there is.
+        :param cache_alias: Key to find the user in the cache with (single user lookups only)
 
         :type filter: dict
         :type raise_on_missing: bool
         :type return_list: bool
+        :type cache_alias: tuple | None
 
         :return: User instance
         :rtype: UserClass
         """
+        if return_list:
+            start = time.time()
+            users = list(self._coll.find(filter))
+            if self.slow_query_log is not None:
+                self.slow_query_log.record(self._coll, filter, start)
+            if not users and raise_on_missing:
+                logger.debug("{!s} No user found with filter {!r} in {!r}".format(self, filter, self._coll_name))
+                raise UserDoesNotExist("No user matching filter {!r}".format(filter))
+            return [self._user_from_document(user) for user in users]
+
+        if self.cache is not None and cache_alias is not None:
+            doc = self.cache.get_by_alias(cache_alias)
+            if doc is not None:
+                return self._user_from_document(doc)
+
         try:
-            users = list(self._get_documents_by_filter(filter, raise_on_missing=raise_on_missing))
+            doc = self._get_document_by_filter(filter, raise_on_missing=raise_on_missing)
         except DocumentDoesNotExist:
             logger.debug("{!s} No user found with filter {!r} in {!r}".format(self, filter, self._coll_name))
             raise UserDoesNotExist("No user matching filter {!r}".format(filter))
+        except MultipleDocumentsReturned:
+            raise MultipleUsersReturned("Multiple matching users for filter {!r}".format(filter))
 
-        if return_list:
-            return [self.UserClass(data=user) for user in users]
-
-        if len(users) == 0:
+        if doc is None:
             return None
 
-        if len(users) > 1:
-            raise MultipleUsersReturned("Multiple matching users for filter {!r}".format(filter))
-
-        return self.UserClass(data=users[0])
+        if self.cache is not None:
+            self.cache.put(doc, aliases=[cache_alias] if cache_alias else None)
+        return self._user_from_document(doc)
 
     def get_user_by_mail(self, email, raise_on_missing=True, return_list=False,
                          include_unconfirmed=False):
@@ -156,16 +227,32 @@ class UserDB(BaseDB):
         :rtype: UserClass
         """
         email = email.lower()
+        filter = self._mail_filter(email, include_unconfirmed)
+        return self._get_user_by_filter(filter,
+                                        raise_on_missing=raise_on_missing,
+                                        return_list=return_list,
+                                        cache_alias=('mail', email, include_unconfirmed))
+
+    @staticmethod
+    def _mail_filter(email, include_unconfirmed=False):
+        """
+        Filter for users with an e-mail address, see get_user_by_mail().
+
+        :param email: The (lower case) email address to look for
+        :param include_unconfirmed: Match addresses that are not confirmed/verified too
+
+        :type email: str | unicode
+        :type include_unconfirmed: bool
+
+        :rtype: dict
+        """
         elemmatch = {'email': email, 'verified': True}
         if include_unconfirmed:
             elemmatch = {'email': email}
-        filter = {'$or': [
+        return {'$or': [
             {'mail': email},
             {'mailAliases': {'$elemMatch': elemmatch}}
         ]}
-        return self._get_user_by_filter(filter,
-                                        raise_on_missing=raise_on_missing,
-                                        return_list=return_list)
 
     def get_user_by_nin(self, nin, raise_on_missing=True, return_list=False,
                         include_unconfirmed=False):
@@ -187,15 +274,31 @@ class UserDB(BaseDB):
         :return: User instance
         :rtype: UserClass
         """
+        filter = self._nin_filter(nin, include_unconfirmed)
+        return self._get_user_by_filter(filter,
+                                        raise_on_missing=raise_on_missing,
+                                        return_list=return_list,
+                                        cache_alias=('nin', nin, include_unconfirmed))
+
+    @staticmethod
+    def _nin_filter(nin, include_unconfirmed=False):
+        """
+        Filter for users with a NIN, see get_user_by_nin().
+
+        :param nin: The nin to look for
+        :param include_unconfirmed: Match NINs that are not confirmed/verified too
+
+        :type nin: str | unicode
+        :type include_unconfirmed: bool
+
+        :rtype: dict
+        """
         old_filter = {'norEduPersonNIN': nin}
         newmatch = {'number': nin, 'verified': True}
         if include_unconfirmed:
             newmatch = {'number': nin}
         new_filter = {'nins': {'$elemMatch': newmatch}}
-        filter = {'$or': [old_filter, new_filter]}
-        return self._get_user_by_filter(filter,
-                                        raise_on_missing=raise_on_missing,
-                                        return_list=return_list)
+        return {'$or': [old_filter, new_filter]}
 
     def get_user_by_phone(self, phone, raise_on_missing=True, return_list=False,
                           include_unconfirmed=False):
@@ -217,6 +320,25 @@ class UserDB(BaseDB):
         :return: User instance
         :rtype: UserClass
         """
+        filter = self._phone_filter(phone, include_unconfirmed)
+        return self._get_user_by_filter(filter,
+                                        raise_on_missing=raise_on_missing,
+                                        return_list=return_list,
+                                        cache_alias=('phone', phone, include_unconfirmed))
+
+    @staticmethod
+    def _phone_filter(phone, include_unconfirmed=False):
+        """
+        Filter for users with a phone number, see get_user_by_phone().
+
+        :param phone: The phone to look for
+        :param include_unconfirmed: Match phone numbers that are not confirmed/verified too
+
+        :type phone: str | unicode
+        :type include_unconfirmed: bool
+
+        :rtype: dict
+        """
         oldmatch = {'mobile': phone, 'verified': True}
         if include_unconfirmed:
             oldmatch = {'mobile': phone}
@@ -225,10 +347,7 @@ class UserDB(BaseDB):
         if include_unconfirmed:
             newmatch = {'number': phone}
         new_filter = {'phone': {'$elemMatch': newmatch}}
-        filter = {'$or': [old_filter, new_filter]}
-        return self._get_user_by_filter(filter,
-                                        raise_on_missing=raise_on_missing,
-                                        return_list=return_list)
+        return {'$or': [old_filter, new_filter]}
 
     def get_user_by_eppn(self, eppn, raise_on_missing=True):
         """
@@ -243,8 +362,141 @@ class UserDB(BaseDB):
         :return: UserClass instance
         :rtype: UserClass
         """
+        if self.cache is not None:
+            doc = self.cache.get_by_alias(('eppn', eppn))
+            if doc is not None:
+                return self._user_from_document(doc)
         return self._get_user_by_attr('eduPersonPrincipalName', eppn, raise_on_missing)
 
+    def get_users_by_ids(self, user_ids, chunk_size=1000):
+        """
+        Locate a number of users in the userdb given their _id.
+
+        The users are fetched using one query for every `chunk_size' ids, and returned
+        as they are fetched (in no particular order). The returned set of ids that were
+        not found is complete when all users have been consumed:
+
+            users, missing = userdb.get_users_by_ids(user_ids)
+            for user in users:
+                ...
+            logger.info('Users not found: {!r}'.format(missing))
+
+        The cache is not used, since bulk lookups would just push other users out of it.
+
+        :param user_ids: User identifiers
+        :param chunk_size: Maximum number of users to fetch in each query
+
+        :type user_ids: collections.Iterable
+        :type chunk_size: int
+
+        :return: Generator yielding UserClass instances, and a set of the user_ids not found
+        :rtype: (collections.Iterator, set)
+        """
+        def _normalize(user_id):
+            if isinstance(user_id, ObjectId):
+                return user_id
+            try:
+                return ObjectId(user_id)
+            except (InvalidId, TypeError):
+                return None
+
+        return self._get_users_by_values('_id', user_ids, _normalize, chunk_size)
+
+    def get_users_by_eppns(self, eppns, chunk_size=1000):
+        """
+        Locate a number of users in the userdb using their eduPersonPrincipalName.
+
+        Works like get_users_by_ids().
+
+        :param eppns: eduPersonPrincipalNames to look for
+        :param chunk_size: Maximum number of users to fetch in each query
+
+        :type eppns: collections.Iterable
+        :type chunk_size: int
+
+        :return: Generator yielding UserClass instances, and a set of the eppns not found
+        :rtype: (collections.Iterator, set)
+
+        :raise self.MultipleUsersReturned: More than one user has the same eppn
+        """
+        return self._get_users_by_values('eduPersonPrincipalName', eppns, lambda eppn: eppn, chunk_size)
+
+    def iter_users(self, batch_size=1000, fields=None, after_id=None, raw=False):
+        """
+        Go through all users in the userdb, in _id order.
+
+        Users are fetched `batch_size' at a time, so memory usage does not depend on the
+        size of the collection. An interrupted scan can be resumed by passing the _id of
+        the last user processed as `after_id'.
+
+        When only some fields are requested, the documents are typically not complete
+        enough to create UserClass instances from, so `raw' should be used too.
+
+        :param batch_size: Number of users to fetch in each query
+        :param fields: the fields to return (default all fields)
+        :param after_id: Only return users with an _id greater than this
+        :param raw: Return the documents as dicts instead of UserClass instances
+
+        :type batch_size: int
+        :type fields: dict | [str] | None
+        :type after_id: bson.ObjectId | None
+        :type raw: bool
+
+        :return: Generator yielding UserClass instances (or dicts if raw is True)
+        :rtype: collections.Iterator
+        """
+        for doc in self._iter_documents(fields=fields, batch_size=batch_size, after_id=after_id):
+            if raw:
+                yield doc
+            else:
+                yield self._user_from_document(doc)
+
+    def _get_users_by_values(self, attr, values, normalize, chunk_size):
+        """
+        Shared code for get_users_by_ids() and get_users_by_eppns().
+
+        :param attr: The attribute to match on
+        :param values: The values to match on, as given by the caller
+        :param normalize: Function returning the value to query for (None if invalid)
+        :param chunk_size: Maximum number of values in each query
+
+        :return: Generator yielding UserClass instances, and a set of the values not found
+        :rtype: (collections.Iterator, set)
+        """
+        missing = set()
+        seen = set()
+        given = {}  # normalized value -> value as given by the caller, for values being looked up
+
+        def _values():
+            for value in values:
+                this = normalize(value)
+                if this is None:
+                    missing.add(value)
+                elif this not in seen:
+                    seen.add(this)
+                    given[this] = value
+                    yield this
+
+        def _users():
+            for chunk, docs in self._get_documents_by_values(attr, _values(), chunk_size=chunk_size):
+                found = set()
+                for doc in docs:
+                    if doc[attr] in found:
+                        logger.error("MultipleUsersReturned, {!r} = {!r}".format(attr, doc[attr]))
+                        raise MultipleUsersReturned('Multiple matching users for {!s}={!r}'.format(
+                            attr, doc[attr]))
+                    found.add(doc[attr])
+                for this in chunk:
+                    value = given.pop(this)
+                    if this not in found:
+                        missing.add(value)
+                logger.debug("{!s} Found {!s}/{!s} users with {!r} in {!r}".format(
+                    self, len(docs), len(chunk), attr, self._coll_name))
+                for doc in docs:
+                    yield self._user_from_document(doc)
+
+        return _users(), missing
+
     def _get_user_by_attr(self, attr, value, raise_on_missing=True):
         """
         Locate a user in the userdb using any attribute and value.
@@ -267,7 +519,9 @@ class UserDB(BaseDB):
             doc = self._get_document_by_attr(attr, value, raise_on_missing)
             if doc is not None:
                 logger.debug("{!s} Found user with id {!s}".format(self, doc['_id']))
-                user = self.UserClass(data=doc)
+                if self.cache is not None and attr in ['_id', 'eduPersonPrincipalName']:
+                    self.cache.put(doc)
+                user = self._user_from_document(doc)
                 logger.debug("{!s} Returning user {!s}".format(self, user))
             return user
         except self.exceptions.DocumentDoesNotExist as e:
@@ -277,36 +531,56 @@ class UserDB(BaseDB):
             logger.error("MultipleUsersReturned, {!r} = {!r}".format(attr, value))
             raise MultipleUsersReturned(e.reason)
 
-    def save(self, user, check_sync=True, old_format=False):
+    def save(self, user, check_sync=True, old_format=False, partial=False):
         """
 
+        With `partial', only the fields changed since the user was loaded from the database
+        are written (see User.to_update_dict()). The whole document is written anyway if the
+        user was not loaded from the database, or when not using check_sync or new format.
+
         :param user: UserClass object
         :param check_sync: Ensure the user hasn't been updated in the database since it was loaded
         :param old_format: Save the user in legacy format in the database
+        :param partial: Only write changed fields
 
         :type user: UserClass
         :type check_sync: bool
         :type old_format: bool
+        :type partial: bool
         :return:
         """
         assert isinstance(user.user_id, ObjectId)
         # XXX add modified_by info. modified_ts alone is not unique when propagated to eduid_am.
 
+        if self.cache is not None:
+            # a stale cached copy is a likely cause of UserOutOfSync, so drop it even if the save fails
+            self.cache.invalidate(user.user_id)
+        changes = None
+        if self.audit_changes and audit_logger.isEnabledFor(logging.INFO):
+            changed = user.changed_fields()
+            if changed is not None:
+                changes = sorted(changed.keys())
         modified = user.modified_ts
+        doc = None
+        if partial and check_sync and not old_format and modified is not None and isinstance(user, User):
+            # before modified_ts is updated, since it is compared with the value loaded from the database
+            doc = user.to_update_dict()
         user.modified_ts = True  # update to current time
+        if doc is None:
+            doc = user.to_dict(old_userdb_format=old_format)
+        else:
+            doc['$set']['modified_ts'] = user.modified_ts
         if modified is None:
             # profile has never been modified through the dashboard.
             # possibly just created in signup.
-            result = self._coll.insert(user.to_dict(old_userdb_format=old_format))
+            result = self._coll.insert(doc)
             logger.debug("{!s} Inserted new user {!r} into {!r} (old_format={!r}): {!r})".format(
                 self, user, self._coll_name, old_format, result))
-            import pprint
-            logger.debug("Extra debug:\n{!s}".format(pprint.pformat(user.to_dict(old_userdb_format=old_format))))
         else:
             test_doc = {'_id': user.user_id}
             if check_sync:
                 test_doc['modified_ts'] = modified
-            result = self._coll.update(test_doc, user.to_dict(old_userdb_format=old_format), upsert=(not check_sync))
+            result = self._coll.update(test_doc, doc, upsert=(not check_sync))
             if check_sync and result['n'] == 0:
                 db_ts = None
                 db_user = self._coll.find_one({'_id': user.user_id})
@@ -318,10 +592,59 @@ class UserDB(BaseDB):
                 raise eduid_userdb.exceptions.UserOutOfSync('Stale user object can\'t be saved')
             logger.debug("{!s} Updated user {!r} (ts {!s}) in {!r} (old_format={!r}): {!r}".format(
                 self, user, modified, self._coll_name, old_format, result))
-            import pprint
-            logger.debug("Extra debug:\n{!s}".format(pprint.pformat(user.to_dict(old_userdb_format=old_format))))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extra debug:\n{!s}".format(pprint.pformat(doc)))
+        if self.audit_changes and audit_logger.isEnabledFor(logging.INFO):
+            audit_logger.info("{!s} Saved user {!s} (ts {!s}), changed fields: {!r}".format(
+                self, user, user.modified_ts, changes), extra={'user_id': user.user_id, 'changes': changes})
+        if isinstance(user, User):
+            if '$set' in doc:
+                db_keys = user._db_keys.difference(doc.get('$unset', {})).union(doc['$set'])
+            else:
+                db_keys = doc.keys()
+            user._set_unchanged(db_keys, track_changes=(partial or self._tracks_changes()))
+        if self.cache is not None:
+            # in case another thread put the user back in the cache while we were saving it
+            self.cache.invalidate(user.user_id)
         return result
 
+    def _tracks_changes(self):
+        """
+        Check if the changes made to loaded users need to be recorded (see User._set_unchanged()).
+
+        :rtype: bool
+        """
+        return self.track_changes or self.audit_changes
+
+    def save_many(self, users, check_sync=True, old_format=False, flush_size=500, max_bytes=8 * 1024 * 1024):
+        """
+        Save a number of users using bulk operations.
+
+        Users that have been updated in the database since they were loaded are not saved
+        when check_sync is True, but collected in the result's out_of_sync list instead
+        of raising UserOutOfSync. See eduid_userdb.bulk.BulkUserWriter for details.
+
+        :param users: UserClass objects
+        :param check_sync: Ensure the users haven't been updated in the database since they were loaded
+        :param old_format: Save the users in legacy format in the database
+        :param flush_size: Maximum number of users in each bulk operation
+        :param max_bytes: Maximum (BSON encoded) size of the users waiting to be written
+
+        :type users: collections.Iterable
+        :type check_sync: bool
+        :type old_format: bool
+        :type flush_size: int
+        :type max_bytes: int
+
+        :return: Outcome for every user
+        :rtype: eduid_userdb.bulk.BulkSaveResult
+        """
+        with BulkUserWriter(self, check_sync=check_sync, old_format=old_format,
+                            flush_size=flush_size, max_bytes=max_bytes) as writer:
+            for user in users:
+                writer.save(user)
+        return writer.result
+
     def remove_user_by_id(self, user_id):
         """
         Remove a user in the userdb given the user's _id.
@@ -342,7 +665,10 @@ class UserDB(BaseDB):
         :type user_id: bson.ObjectId
         """
         logger.debug("{!s} Removing user with id {!r} from {!r}".format(self, user_id, self._coll_name))
-        return self.remove_document(spec_or_id=user_id)
+        result = self.remove_document(spec_or_id=user_id)
+        if self.cache is not None:
+            self.cache.invalidate(user_id)
+        return result
 
     def update_user(self, obj_id, attributes):
         """
@@ -382,6 +708,8 @@ class UserDB(BaseDB):
                         '$set': attributes,
                     }
                 )
+        if self.cache is not None:
+            self.cache.invalidate(obj_id)
 
     def get_identity_proofing(self, user):
         """
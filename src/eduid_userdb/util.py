@@ -36,3 +36,19 @@ __author__ = 'ft'
 import datetime
 from eduid_userdb.exceptions import UserDBValueError
 
+
+def naive_utc(ts):
+    """
+    Get a timestamp as a naive datetime in UTC.
+
+    The timestamps set on User objects are naive, while the ones read from the database
+    are timezone aware (the clients are created with tz_aware=True).
+
+    :param ts: Timestamp
+    :type ts: datetime.datetime
+
+    :rtype: datetime.datetime
+    """
+    if ts.tzinfo is not None:
+        ts = ts.replace(tzinfo=None) - ts.utcoffset()
+    return ts